@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 import click
 
 COV = None
@@ -11,7 +12,9 @@ if os.environ.get('FLASK_COVERAGE'):
 
 from flask_migrate import Migrate
 from app import create_app, db
-from app.models import User, Conversation, Message
+from app.export import FORMATS, export_conversation
+from app.models import User, Conversation, Message, expire_client_message_ids, rebuild_inbox
+from app.seed import SeedSpec, seed as seed_data
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
@@ -44,4 +47,67 @@ def test(coverage):
         cov_dir = os.path.join(BASE_DIR, 'tmp/coverage')
         COV.html_report(directory=cov_dir)
         print(f'HTML version: file://{cov_dir}/index.html')
-        COV.erase()
\ No newline at end of file
+        COV.erase()
+
+
+@app.cli.command('export-conversation')
+@click.argument('conversation_id', type=int)
+@click.option('--format', 'fmt', type=click.Choice(list(FORMATS)), default='ndjson', help='Output format')
+@click.option('--gzip/--no-gzip', 'compress', default=False, help='Compress the output')
+@click.option('--output', '-o', type=click.File('wb'), default='-', help='Output file')
+def export_conversation_command(conversation_id, fmt, compress, output):
+    """Export the full message history of a conversation."""
+    if Conversation.query.get(conversation_id) is None:
+        raise click.BadParameter('conversation does not exist', param_hint='CONVERSATION_ID')
+    for chunk in export_conversation(conversation_id, fmt, compress):
+        output.write(chunk)
+
+
+@app.cli.command()
+@click.option('--users', default=1000, help='Users to create')
+@click.option('--contacts', default=20.0, help='Mean contacts per user')
+@click.option('--personal-chats', default=0.5, help='Share of contact pairs with a personal chat')
+@click.option('--groups', default=100, help='Group chats to create')
+@click.option('--group-size', nargs=2, type=int, default=(3, 20), help='Min and max group members')
+@click.option('--messages', default=50.0, help='Mean messages per chat')
+@click.option('--max-messages', default=10000, help='Messages per chat at most')
+@click.option('--skew', default=1.5, help='Pareto shape of contacts and messages, > 1, lower is more skewed')
+@click.option('--days', default=365, help='Days of history to spread the data over')
+@click.option('--password', default='password', help='Password of every user')
+@click.option('--batch-size', default=10000, help='Rows per COPY or executemany')
+@click.option('--random-seed', type=int, default=None, help='Seed for reproducible data')
+def seed(users, contacts, personal_chats, groups, group_size, messages, max_messages,
+         skew, days, password, batch_size, random_seed):
+    """Bulk-load synthetic users, contacts, chats and messages."""
+    if skew <= 1:
+        raise click.BadParameter('must be greater than 1', param_hint='--skew')
+    if group_size[0] > group_size[1]:
+        raise click.BadParameter('min is greater than max', param_hint='--group-size')
+    spec = SeedSpec(
+        users, contacts, personal_chats, groups, group_size,
+        messages, max_messages, skew, days, password
+    )
+    start = time.perf_counter()
+    with db.engine.begin() as connection:
+        counts = seed_data(connection, spec, random_seed, batch_size)
+    for table, count in counts.items():
+        click.echo(f'{table}: {count} rows')
+    click.echo(f'seeded in {time.perf_counter() - start:.1f}s')
+
+
+@app.cli.command('expire-message-keys')
+@click.option('--ttl', type=int, default=None, help='Seconds to keep keys, FLCHAT_CLIENT_MESSAGE_ID_TTL by default')
+def expire_message_keys(ttl):
+    """Clear sendMessage idempotency keys past their TTL."""
+    if ttl is None:
+        ttl = app.config['FLCHAT_CLIENT_MESSAGE_ID_TTL']
+    count = expire_client_message_ids(ttl, app.config['FLCHAT_CLIENT_MESSAGE_ID_BATCH'])
+    click.echo(f'cleared {count} message keys')
+
+
+@app.cli.command('rebuild-inbox')
+def rebuild_inbox_command():
+    """Refill the per-user inbox table from the memberships."""
+    start = time.perf_counter()
+    count = rebuild_inbox()
+    click.echo(f'wrote {count} inbox entries in {time.perf_counter() - start:.1f}s')
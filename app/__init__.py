@@ -1,11 +1,24 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
+from werkzeug.middleware.proxy_fix import ProxyFix
 from config import config
+from .pubsub import PubSub
+from .identity import IdentityCache
+from .metrics import Metrics
+from .tracing import Tracer
+from .ratelimit import RateLimiter
+from .groupcommit import GroupCommitter
 
 
 db = SQLAlchemy()
 jwt = JWTManager()
+pubsub = PubSub()
+identity_cache = IdentityCache()
+metrics = Metrics()
+tracer = Tracer()
+rate_limiter = RateLimiter()
+group_committer = GroupCommitter()
 
 
 def create_app(env):
@@ -13,12 +26,22 @@ def create_app(env):
     app.config.from_object(config[env])
     config[env].init_app(app)
 
+    hops = app.config['FLCHAT_PROXY_HOPS']
+    if hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
     if app.config['SSL_REDIRECT']:
         from flask_sslify import SSLify
         sslify = SSLify(app)
 
     db.init_app(app)
     jwt.init_app(app)
+    pubsub.init_app(app)
+    identity_cache.init_app(app, pubsub)
+    metrics.init_app(app)
+    tracer.init_app(app)
+    rate_limiter.init_app(app)
+    group_committer.init_app(app)
 
     from .graphql import graphql as graphql_blueprint
     app.register_blueprint(graphql_blueprint, url_prefix='/api')
@@ -0,0 +1,177 @@
+"""Optional ASGI entry point, e.g. ``uvicorn --factory app.asgi:create_asgi_app``.
+
+Every request is dispatched to the regular Flask app inside
+``AsyncSession.run_sync``: the schema, resolvers and models run unchanged on
+``db.session``, which for the request is the synchronous facade of an
+``AsyncSession``. Whenever they wait for the database, the greenlet switches
+back to the event loop, so one process serves many slow clients at once
+instead of one per thread.
+
+CPU bound work (password hashing) is moved off the loop with
+:func:`run_blocking`.
+"""
+import asyncio
+import io
+import os
+import sys
+from functools import partial
+
+from flask import has_request_context, request
+
+ASGI_ENVIRON_KEY = 'flchat.asgi'
+
+
+def run_blocking(fn, *args):
+    """Call ``fn`` in a worker thread when serving through ASGI, inline otherwise."""
+    if not (has_request_context() and request.environ.get(ASGI_ENVIRON_KEY)):
+        return fn(*args)
+
+    from sqlalchemy.util import await_only
+    loop = asyncio.get_event_loop()
+    return await_only(loop.run_in_executor(None, partial(fn, *args)))
+
+
+def async_database_uri(uri):
+    """Map a synchronous database URI to its asyncio driver."""
+    for prefix, driver in (
+        ('postgres://', 'postgresql+asyncpg://'),
+        ('postgresql://', 'postgresql+asyncpg://'),
+        ('postgresql+psycopg2://', 'postgresql+asyncpg://'),
+        ('sqlite://', 'sqlite+aiosqlite://'),
+    ):
+        if uri.startswith(prefix):
+            return driver + uri[len(prefix):]
+    return uri
+
+
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        ASGI_ENVIRON_KEY: True,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+            continue
+        key = f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class FLChatASGI:
+    def __init__(self, app, engine):
+        self.app = app
+        self.engine = engine
+        self.started = None
+
+    async def startup(self):
+        # The pool's first connect runs under a thread lock, which greenlets
+        # of concurrent requests would deadlock on; make it happen once here.
+        if self.started is None:
+            self.started = asyncio.ensure_future(self.connect())
+        await self.started
+
+    async def connect(self):
+        async with self.engine.connect():
+            pass
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            # WebSocket subscriptions are served by the WSGI app only.
+            await send({'type': 'websocket.close', 'code': 1000})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        body = []
+        while True:
+            message = await receive()
+            body.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+
+        from sqlalchemy.ext.asyncio import AsyncSession
+        await self.startup()
+        environ = build_environ(scope, b''.join(body))
+        async with AsyncSession(self.engine) as session:
+            await session.run_sync(self.dispatch, environ, send)
+
+    def dispatch(self, session, environ, send):
+        """Run the WSGI app for ``environ`` inside the session's greenlet."""
+        from sqlalchemy.util import await_only
+        from . import db
+
+        # Sessions are scoped to the current greenlet, this one belongs to
+        # this request only. The app context teardown removes it again.
+        db.session.registry.set(session)
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers
+            ]
+
+        def start():
+            if not response.get('started'):
+                response['started'] = True
+                await_only(send({
+                    'type': 'http.response.start',
+                    'status': response['status'],
+                    'headers': response['headers'],
+                }))
+
+        result = self.app.wsgi_app(environ, start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    start()
+                    await_only(send({'type': 'http.response.body', 'body': chunk, 'more_body': True}))
+            start()
+            await_only(send({'type': 'http.response.body', 'body': b''}))
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+
+def create_asgi_app(env=None):
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from . import create_app
+
+    app = create_app(env or os.getenv('FLASK_ENV') or 'default')
+    uri = app.config['FLCHAT_ASYNC_DATABASE_URI'] or \
+        async_database_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+    return FLChatASGI(app, create_async_engine(uri))
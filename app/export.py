@@ -0,0 +1,81 @@
+"""Streaming export of a conversation's full message history.
+
+Rows are read through a server-side cursor as plain tuples, so neither the
+ORM identity map nor the output is ever held in memory as a whole.
+"""
+import csv
+import io
+import json
+import zlib
+
+from . import db
+from .models import Message, User
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+FIELDS = ('id', 'conversation_id', 'sender_id', 'sender_email', 'sent_at', 'message')
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+
+
+def export_rows(conversation_id):
+    query = db.session.query(
+        Message.id, Message.conversation_id, Message.sender_id,
+        User.email, Message.sent_at, Message.message
+    ).outerjoin(User, User.id == Message.sender_id) \
+        .filter(Message.conversation_id == conversation_id) \
+        .order_by(Message.sent_at, Message.id) \
+        .yield_per(BATCH_SIZE)
+    for row in query:
+        values = dict(zip(FIELDS, row))
+        values['sent_at'] = values['sent_at'].isoformat() if values['sent_at'] else None
+        yield values
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def chunked(lines):
+    """Join text lines into encoded chunks of about ``CHUNK_SIZE`` bytes."""
+    chunk, size = [], 0
+    for line in lines:
+        data = line.encode('utf-8')
+        chunk.append(data)
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            yield b''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_conversation(conversation_id, fmt='ndjson', compress=False):
+    """Yield the export of ``conversation_id`` as ``bytes`` chunks."""
+    lines = {'ndjson': ndjson_lines, 'csv': csv_lines}[fmt](export_rows(conversation_id))
+    chunks = chunked(lines)
+    return gzipped(chunks) if compress else chunks
@@ -0,0 +1,205 @@
+import json
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import ExitStack
+from functools import partial
+from hashlib import sha256
+
+from graphql import GraphQLError
+from graphql.backend.base import GraphQLBackend, GraphQLDocument
+from graphql.execution import ExecutionResult, execute
+from graphql.execution.middleware import MiddlewareManager
+from graphql.language.parser import parse
+from graphql.validation import validate
+from graphql_server import HttpQueryError
+
+
+def query_hash(query):
+    return sha256(query.encode('utf-8')).hexdigest()
+
+
+def operation_name(document_ast, name=None):
+    """The name of the operation executed, ``anonymous`` if it has none.
+
+    Only names defined in the document are returned, ``unknown`` stands for
+    anything the document does not select, so a requested ``operationName``
+    never reaches metric labels unchecked.
+    """
+    operations = [
+        definition for definition in document_ast.definitions
+        if getattr(definition, 'operation', None) is not None
+    ]
+    if name:
+        names = {o.name.value for o in operations if o.name}
+        return name if name in names else 'unknown'
+    if len(operations) == 1:
+        return operations[0].name.value if operations[0].name else 'anonymous'
+    return 'unknown'
+
+
+class LRUCache:
+    """A thread-safe mapping that keeps the ``maxsize`` most recently used keys."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key):
+        with self.lock:
+            try:
+                self.data.move_to_end(key)
+            except KeyError:
+                return None
+            return self.data[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+
+class ExtendedExecutionResult(ExecutionResult):
+    """An ``ExecutionResult`` that also serializes its ``extensions``."""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_result(cls, result, extensions):
+        extensions = dict(result.extensions, **extensions)
+        return cls(result.data, result.errors, result.invalid, extensions)
+
+    def to_dict(self, format_error=None, dict_class=OrderedDict):
+        response = super(ExtendedExecutionResult, self).to_dict(format_error, dict_class)
+        if self.extensions:
+            response['extensions'] = self.extensions
+        return response
+
+
+class CachedDocumentBackend(GraphQLBackend):
+    """Parse and validate every distinct query text only once.
+
+    Documents are kept in a bounded LRU keyed by the sha256 of the query, the
+    same hash persisted queries are addressed by. Validation errors are
+    cached along with the document so invalid queries are not re-validated
+    either.
+
+    When a :class:`~.cost.QueryCostLimiter` is given, every execution is
+    checked against it first and the computed cost is returned in the
+    ``cost`` response extension.
+
+    ``instruments`` observe every execution: each provides an
+    ``operation(name)`` context manager wrapped around it, which is handed
+    the result, and a graphene ``middleware`` run around the resolvers.
+    """
+
+    def __init__(self, maxsize, limiter=None, instruments=()):
+        self.documents = LRUCache(maxsize)
+        self.limiter = limiter
+        self.instruments = tuple(instruments)
+
+    def document_from_string(self, schema, document_string):
+        key = (schema, query_hash(document_string))
+        document = self.documents.get(key)
+        if document is None:
+            document_ast = parse(document_string)
+            errors = validate(schema, document_ast)
+            document = GraphQLDocument(
+                schema=schema,
+                document_string=document_string,
+                document_ast=document_ast,
+                execute=partial(self.execute, schema, document_ast, errors),
+            )
+            self.documents.set(key, document)
+        return document
+
+    def execute(self, schema, document_ast, validation_errors, *args, **kwargs):
+        if validation_errors:
+            return ExecutionResult(errors=validation_errors, invalid=True)
+
+        extensions = {}
+        if self.limiter is not None:
+            try:
+                cost = self.limiter.check(
+                    schema, document_ast,
+                    kwargs.get('operation_name'), kwargs.get('variable_values')
+                )
+            except GraphQLError as e:
+                return ExecutionResult(errors=[e], invalid=True)
+            if cost is not None:
+                extensions['cost'] = cost
+
+        if not self.instruments:
+            return self.run(schema, document_ast, extensions, *args, **kwargs)
+
+        name = operation_name(document_ast, kwargs.get('operation_name'))
+        middleware = kwargs.get('middleware') or []
+        if isinstance(middleware, MiddlewareManager):
+            middleware = middleware.middlewares
+        kwargs['middleware'] = MiddlewareManager(
+            *middleware, *(i.middleware for i in self.instruments), wrap_in_promise=False
+        )
+        with ExitStack() as stack:
+            operations = [stack.enter_context(i.operation(name)) for i in self.instruments]
+            result = self.run(schema, document_ast, extensions, *args, **kwargs)
+            for operation in operations:
+                operation.result = result
+        return result
+
+    def run(self, schema, document_ast, extensions, *args, **kwargs):
+        result = execute(schema, document_ast, *args, **kwargs)
+        if isinstance(result, ExecutionResult):
+            result = ExtendedExecutionResult.from_result(result, extensions)
+        return result
+
+
+class PersistedQueryNotFound(HttpQueryError):
+    def __init__(self):
+        # Clients register the full text when they see this message, so it is
+        # an ordinary (200) response rather than a failed request.
+        super(PersistedQueryNotFound, self).__init__(200, 'PersistedQueryNotFound')
+
+
+def apply_persisted_query(params, store):
+    """Resolve an Automatic Persisted Query request into a regular one.
+
+    A request carrying ``extensions.persistedQuery.sha256Hash`` and no query
+    is answered from ``store``. When the client also sends the query text,
+    the text is checked against the hash and registered.
+    """
+    if not isinstance(params, Mapping):
+        return params
+
+    extensions = params.get('extensions')
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            raise HttpQueryError(400, 'Extensions are invalid JSON.')
+
+    persisted = (extensions or {}).get('persistedQuery')
+    if not persisted:
+        return params
+    if persisted.get('version') != 1:
+        raise HttpQueryError(400, 'Unsupported persisted query version.')
+
+    digest = persisted.get('sha256Hash')
+    query = params.get('query')
+    if query:
+        if query_hash(query) != digest:
+            raise HttpQueryError(400, 'provided sha does not match query')
+        store.set(digest, query)
+        return params
+
+    query = store.get(digest)
+    if query is None:
+        raise PersistedQueryNotFound()
+    params = dict(params)
+    params['query'] = query
+    return params
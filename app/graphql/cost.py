@@ -0,0 +1,151 @@
+from graphql import GraphQLError
+from graphql.language import ast
+from graphql.type import (
+    GraphQLList, GraphQLNonNull, GraphQLObjectType, GraphQLInterfaceType
+)
+
+PAGINATION_ARGUMENTS = ('first', 'last')
+
+
+def unwrap(graphql_type):
+    is_list = False
+    while isinstance(graphql_type, (GraphQLNonNull, GraphQLList)):
+        is_list = is_list or isinstance(graphql_type, GraphQLList)
+        graphql_type = graphql_type.of_type
+    return graphql_type, is_list
+
+
+class QueryCostLimiter:
+    """Static depth and cost analysis of an operation, run before execution.
+
+    Resolving a field costs its weight (``weights['Type.field']``, otherwise
+    1 for object fields and 0 for scalars), and every item it is expected to
+    return costs its selection once more. Items are estimated from the
+    (capped) ``first`` or ``last`` argument of paginated fields, as
+    ``list_size`` for plain lists and as 1 otherwise; the ``edges`` of a
+    paginated field are not counted twice.
+    Introspection fields are free and do not add depth.
+    """
+
+    def __init__(self, max_depth, max_cost, list_size, page_size, max_page_size, weights=None):
+        self.max_depth = max_depth
+        self.max_cost = max_cost
+        self.list_size = list_size
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.weights = weights or {}
+
+    def check(self, schema, document_ast, operation_name=None, variables=None):
+        """Return the ``cost`` extension of the operation or raise ``GraphQLError``."""
+        operation, fragments = self.split_document(document_ast, operation_name)
+        if operation is None:
+            return None
+
+        root_type = {
+            'query': schema.get_query_type,
+            'mutation': schema.get_mutation_type,
+            'subscription': schema.get_subscription_type,
+        }[operation.operation]()
+        analysis = _Analysis(self, schema, fragments, variables or {})
+        cost, depth = analysis.selection_cost(root_type, operation.selection_set, 1)
+
+        if depth > self.max_depth:
+            raise GraphQLError(
+                f'query depth {depth} exceeds the maximum depth of {self.max_depth}'
+            )
+        if cost > self.max_cost:
+            raise GraphQLError(
+                f'query cost {cost} exceeds the maximum cost of {self.max_cost}'
+            )
+        return {'requestedQueryCost': cost, 'maximumAvailable': self.max_cost, 'depth': depth}
+
+    @staticmethod
+    def split_document(document_ast, operation_name):
+        operations, fragments = [], {}
+        for definition in document_ast.definitions:
+            if isinstance(definition, ast.OperationDefinition):
+                operations.append(definition)
+            elif isinstance(definition, ast.FragmentDefinition):
+                fragments[definition.name.value] = definition
+
+        if operation_name:
+            operations = [o for o in operations if o.name and o.name.value == operation_name]
+        # Unknown or ambiguous operations are reported by the executor.
+        return (operations[0] if len(operations) == 1 else None), fragments
+
+
+class _Analysis:
+    def __init__(self, limiter, schema, fragments, variables):
+        self.limiter = limiter
+        self.schema = schema
+        self.fragments = fragments
+        self.variables = variables
+
+    def selection_cost(self, parent_type, selection_set, depth, in_page=False, visited=()):
+        """Return ``(cost, depth)`` of ``selection_set`` nested at ``depth``."""
+        cost, max_depth = 0, depth - 1
+        if selection_set is None:
+            return cost, max_depth
+
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                field_cost, field_depth = self.field_cost(parent_type, selection, depth, in_page, visited)
+            else:
+                fragment, fragment_visited = selection, visited
+                if isinstance(selection, ast.FragmentSpread):
+                    name = selection.name.value
+                    fragment = self.fragments.get(name)
+                    if fragment is None or name in visited:
+                        continue
+                    fragment_visited = visited + (name,)
+                fragment_type = parent_type
+                if fragment.type_condition is not None:
+                    fragment_type = self.schema.get_type(fragment.type_condition.name.value) or parent_type
+                field_cost, field_depth = self.selection_cost(
+                    fragment_type, fragment.selection_set, depth, in_page, fragment_visited
+                )
+            cost += field_cost
+            max_depth = max(max_depth, field_depth)
+        return cost, max_depth
+
+    def field_cost(self, parent_type, field, depth, in_page, visited):
+        name = field.name.value
+        if name.startswith('__') or not isinstance(parent_type, (GraphQLObjectType, GraphQLInterfaceType)):
+            return 0, depth - 1
+        field_def = parent_type.fields.get(name)
+        if field_def is None:
+            return 0, depth - 1
+
+        field_type, is_list = unwrap(field_def.type)
+        is_composite = isinstance(field_type, (GraphQLObjectType, GraphQLInterfaceType))
+        weight = self.limiter.weights.get(f'{parent_type.name}.{name}', 1 if is_composite else 0)
+
+        page = self.page_argument(field_def, field)
+        if page is not None:
+            multiplier = page
+        elif is_list and not (in_page and name == 'edges'):
+            multiplier = self.limiter.list_size
+        else:
+            multiplier = 1
+
+        child_cost, child_depth = self.selection_cost(
+            field_type, field.selection_set, depth + 1, in_page=page is not None, visited=visited
+        )
+        return weight + multiplier * child_cost, max(depth, child_depth)
+
+    def page_argument(self, field_def, field):
+        if not any(a in field_def.args for a in PAGINATION_ARGUMENTS):
+            return None
+        for argument in field.arguments or []:
+            if argument.name.value in PAGINATION_ARGUMENTS:
+                value = self.value(argument.value)
+                if isinstance(value, int):
+                    return min(max(value, 0), self.limiter.max_page_size)
+        return self.limiter.page_size
+
+    def value(self, node):
+        if isinstance(node, ast.Variable):
+            return self.variables.get(node.name.value)
+        if isinstance(node, ast.IntValue):
+            return int(node.value)
+        return None
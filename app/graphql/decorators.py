@@ -1,8 +1,13 @@
+import math
 from functools import wraps
+from flask import request
 from flask_jwt_extended import (
-    verify_jwt_in_request, current_user
+    verify_jwt_in_request, get_jwt, get_jwt_identity, current_user
 )
-from flask_jwt_extended.exceptions import NoAuthorizationError
+from flask_jwt_extended.exceptions import JWTExtendedException, NoAuthorizationError
+from graphql import GraphQLError
+from jwt import PyJWTError
+from .. import rate_limiter
 
 
 def admin_required():
@@ -10,10 +15,48 @@ def admin_required():
         @wraps(fn)
         def decorator(*args, **kwargs):
             verify_jwt_in_request()
-            if not current_user.is_admin:
+            # Read from the signed claims, older tokens don't carry them.
+            claims = get_jwt()
+            is_admin = claims['is_admin'] if 'is_admin' in claims else current_user.is_admin
+            if not is_admin:
                 raise NoAuthorizationError('insufficient permission')
             return fn(*args, **kwargs)
 
         return decorator
 
     return wrapper
+
+
+def rate_limit_client():
+    """The authenticated user, or the client address for anonymous calls."""
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except (JWTExtendedException, PyJWTError):
+        identity = None
+    if identity is not None:
+        return f'user:{identity}'
+    return f'ip:{request.remote_addr}'
+
+
+def rate_limited(operation=None):
+    """Limit calls per client as configured for ``operation`` in ``FLCHAT_RATE_LIMITS``.
+
+    The operation defaults to the resolved field, e.g. ``Mutation.login``.
+    """
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(root, info, *args, **kwargs):
+            name = operation or f'{info.parent_type.name}.{info.field_name}'
+            retry_after = rate_limiter.hit(name, rate_limit_client())
+            if retry_after:
+                retry_after = math.ceil(retry_after * 1000) / 1000
+                raise GraphQLError(
+                    f'rate limit exceeded, retry in {retry_after} seconds',
+                    extensions={'code': 'RATE_LIMITED', 'retryAfter': retry_after}
+                )
+            return fn(root, info, *args, **kwargs)
+
+        return decorator
+
+    return wrapper
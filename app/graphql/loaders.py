@@ -0,0 +1,175 @@
+from collections import defaultdict
+
+from promise import Promise
+from promise.dataloader import DataLoader
+from sqlalchemy import select, union_all
+from sqlalchemy.orm.util import identity_key
+
+from .. import db
+from ..models import (
+    User as UserModel,
+    Message as MessageModel,
+    Conversation as ConversationModel,
+    Contact as ContactModel,
+    Participant as ParticipantModel,
+    participants,
+)
+from .pagination import page_size, page_query
+
+MESSAGE_ORDER = (MessageModel.sent_at, MessageModel.id)
+
+
+class UserLoader(DataLoader):
+    """Users by id, for ``Message.sender`` and ``Conversation.creator``."""
+
+    def batch_load_fn(self, keys):
+        # Rows already in the identity map (e.g. ``current_user``) are reused.
+        users = {}
+        for key in keys:
+            user = db.session.identity_map.get(identity_key(UserModel, key))
+            if user is not None:
+                users[key] = user
+
+        missing = [key for key in keys if key not in users]
+        if missing:
+            users.update(
+                (u.id, u) for u in UserModel.query.filter(UserModel.id.in_(missing))
+            )
+        return Promise.resolve([users.get(key) for key in keys])
+
+
+class MessageLoader(DataLoader):
+    """Messages by id, for ``Conversation.lastMessage``."""
+
+    def batch_load_fn(self, keys):
+        messages = {
+            m.id: m for m in MessageModel.query.filter(MessageModel.id.in_(keys))
+        }
+        return Promise.resolve([messages.get(key) for key in keys])
+
+
+class ConversationLoader(DataLoader):
+    """Conversations by id, for ``Change.conversation``."""
+
+    def batch_load_fn(self, keys):
+        conversations = {
+            c.id: c for c in ConversationModel.query.filter(ConversationModel.id.in_(keys))
+        }
+        return Promise.resolve([conversations.get(key) for key in keys])
+
+
+class ParticipantsLoader(DataLoader):
+    """Participating users by conversation id."""
+
+    def batch_load_fn(self, keys):
+        rows = db.session.query(participants.c.conversation_id, UserModel) \
+            .join(participants, participants.c.user_id == UserModel.id) \
+            .filter(participants.c.conversation_id.in_(keys)) \
+            .order_by(participants.c.conversation_id, UserModel.id)
+
+        users = defaultdict(list)
+        for conversation_id, user in rows:
+            users[conversation_id].append(user)
+        return Promise.resolve([users[key] for key in keys])
+
+
+class ParticipantLoader(DataLoader):
+    """Membership rows keyed by ``(conversation_id, user_id)``."""
+
+    def batch_load_fn(self, keys):
+        rows = {}
+        for user_id in {user_id for _, user_id in keys}:
+            conversation_ids = [c for c, u in keys if u == user_id]
+            rows.update(
+                ((p.conversation_id, p.user_id), p)
+                for p in ParticipantModel.query.filter(
+                    ParticipantModel.user_id == user_id,
+                    ParticipantModel.conversation_id.in_(conversation_ids)
+                )
+            )
+        return Promise.resolve([rows.get(key) for key in keys])
+
+
+class ContactsLoader(DataLoader):
+    """Contact rows by the user id on one side of the relation."""
+
+    def __init__(self, column, **kwargs):
+        super(ContactsLoader, self).__init__(**kwargs)
+        self.column = column
+
+    def batch_load_fn(self, keys):
+        contacts = defaultdict(list)
+        for contact in ContactModel.query.filter(self.column.in_(keys)):
+            contacts[getattr(contact, self.column.key)].append(contact)
+        return Promise.resolve([contacts[key] for key in keys])
+
+
+class MessagesLoader(DataLoader):
+    """Message pages keyed by ``(conversation_id, first, after, last, before)``.
+
+    Each key resolves to the rows :func:`.pagination.page_query` would fetch
+    for that conversation. Every conversation still gets its own index seek,
+    but all of them are sent as one ``UNION ALL`` statement per distinct set
+    of page arguments.
+    """
+
+    def batch_load_fn(self, keys):
+        groups = defaultdict(list)
+        for conversation_id, *args in keys:
+            groups[tuple(args)].append(conversation_id)
+
+        pages = {}
+        for args, conversation_ids in groups.items():
+            for conversation_id, nodes in self.load_pages(conversation_ids, *args):
+                pages[(conversation_id,) + args] = nodes
+        return Promise.resolve([pages[key] for key in keys])
+
+    def load_pages(self, conversation_ids, first, after, last, before):
+        size = page_size(first, last)
+        backward = last is not None
+
+        branches = [
+            select(
+                page_query(
+                    MessageModel.query.filter_by(conversation_id=conversation_id),
+                    MESSAGE_ORDER, size, after, before, backward=backward
+                ).subquery()
+            )
+            for conversation_id in conversation_ids
+        ]
+        statement = branches[0] if len(branches) == 1 else union_all(*branches)
+
+        messages = defaultdict(list)
+        for message in db.session.query(MessageModel).from_statement(statement):
+            messages[message.conversation_id].append(message)
+
+        for conversation_id in conversation_ids:
+            yield conversation_id, sorted(
+                messages[conversation_id],
+                key=lambda m: (m.sent_at, m.id),
+                reverse=backward
+            )
+
+
+class Loaders:
+    def __init__(self):
+        self.user = UserLoader()
+        self.participants = ParticipantsLoader()
+        self.participant = ParticipantLoader()
+        self.conversation = ConversationLoader()
+        self.message = MessageLoader()
+        self.messages = MessagesLoader()
+        self.contacts_added = ContactsLoader(ContactModel.adder_id)
+        self.contacts_adders = ContactsLoader(ContactModel.added_id)
+
+
+def get_loaders(info):
+    """Return the loaders of the current execution, creating them on first use.
+
+    Loaders are kept on the execution context (the Flask request for HTTP
+    queries) so their caches never outlive a single request.
+    """
+    loaders = getattr(info.context, 'loaders', None)
+    if loaders is None:
+        loaders = info.context.loaders = Loaders()
+    return loaders
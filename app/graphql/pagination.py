@@ -0,0 +1,155 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+import graphene as gp
+from flask import current_app
+from graphql import GraphQLError
+from sqlalchemy import DateTime, tuple_
+
+from .. import db
+
+CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(values):
+    values = [
+        v.strftime(CURSOR_DATETIME_FORMAT) if isinstance(v, datetime) else v
+        for v in values
+    ]
+    raw = json.dumps(values, separators=(',', ':'))
+    return urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_value(value, column):
+    if isinstance(column.type, DateTime):
+        return datetime.strptime(value, CURSOR_DATETIME_FORMAT)
+    # Checked here, the database would fail on a mismatch mid-transaction.
+    python_type = column.type.python_type
+    if python_type is float and isinstance(value, int):
+        value = float(value)
+    if isinstance(value, bool) or not isinstance(value, python_type):
+        raise TypeError(value)
+    return value
+
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError(cursor)
+        return tuple(decode_value(v, c) for v, c in zip(values, columns))
+    except (ValueError, TypeError, UnicodeError):
+        raise GraphQLError('invalid cursor')
+
+
+def cursor_for(node, columns):
+    return encode_cursor([getattr(node, c.key) for c in columns])
+
+
+def page_size(first=None, last=None):
+    if first is not None and last is not None:
+        raise GraphQLError('use either first or last, not both')
+    size = first if first is not None else last
+    if size is None:
+        return current_app.config['FLCHAT_PAGE_SIZE']
+    if size < 0:
+        raise GraphQLError('page size must not be negative')
+    return min(size, current_app.config['FLCHAT_MAX_PAGE_SIZE'])
+
+
+def seek(query, columns, after=None, before=None, descending=False):
+    """Restrict ``query`` to the rows strictly between two cursors.
+
+    ``columns`` must identify a row uniquely (end with the primary key) and
+    be covered by an index in that order, so the database can seek straight
+    to the cursor instead of skipping over every row in front of it.
+    """
+    keys = tuple_(*columns)
+    if after:
+        value = tuple_(*decode_cursor(after, columns))
+        query = query.filter(keys < value if descending else keys > value)
+    if before:
+        value = tuple_(*decode_cursor(before, columns))
+        query = query.filter(keys > value if descending else keys < value)
+    return query
+
+
+def order(query, columns, descending=False):
+    return query.order_by(*[c.desc() if descending else c.asc() for c in columns])
+
+
+def paginate(
+        query, columns, connection_type,
+        first=None, after=None, last=None, before=None,
+        descending=False
+):
+    """Keyset-paginate ``query`` into a Relay ``connection_type``.
+
+    Rows are ordered by ``columns`` (descending when ``descending``) and the
+    edge cursors are the opaque encoding of those column values.
+    """
+    size = page_size(first, last)
+    query = page_query(query, columns, size, after, before, descending, backward=last is not None)
+    return connection_from_page(
+        connection_type, query.all(), columns, size, after, before, backward=last is not None
+    )
+
+
+def page_query(query, columns, size, after=None, before=None, descending=False, backward=False):
+    """Return ``query`` narrowed to one page plus a lookahead row.
+
+    Backward pages are read in reverse order so the ``LIMIT`` keeps the rows
+    nearest to the ``before`` cursor.
+    """
+    query = seek(query, columns, after, before, descending)
+    query = order(query, columns, descending != backward)
+    return query.limit(size + 1)
+
+
+def connection_from_page(connection_type, nodes, columns, size, after=None, before=None, backward=False):
+    """Build a connection from the rows fetched by :func:`page_query`."""
+    has_more = len(nodes) > size
+    nodes = nodes[:size]
+    if backward:
+        nodes.reverse()
+
+    return build_connection(
+        connection_type, nodes, columns,
+        has_previous_page=has_more if backward else bool(after),
+        has_next_page=bool(before) if backward else has_more,
+    )
+
+
+def build_connection(connection_type, nodes, columns, has_previous_page, has_next_page):
+    edges = [
+        connection_type.Edge(node=node, cursor=cursor_for(node, columns))
+        for node in nodes
+    ]
+    return connection_type(
+        edges=edges,
+        page_info=gp.relay.PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=has_previous_page,
+            has_next_page=has_next_page,
+        )
+    )
+
+
+def estimated_count(query):
+    """Return the planner's row estimate for ``query``, or ``None``.
+
+    Unlike ``COUNT(*)`` this never reads the rows, but it is only as exact
+    as the table statistics. Only Postgres provides one.
+    """
+    dialect = db.engine.dialect
+    if dialect.name != 'postgresql':
+        return None
+    compiled = query.order_by(None).statement.compile(dialect=dialect)
+    plan = db.session.connection().exec_driver_sql(
+        f'EXPLAIN (FORMAT JSON) {compiled.string}', compiled.params
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
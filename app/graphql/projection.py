@@ -0,0 +1,46 @@
+from graphene.utils.str_converters import to_camel_case
+from graphql.language import ast
+from sqlalchemy import inspect
+from sqlalchemy.orm import load_only
+
+
+def selected_fields(info, path=('edges', 'node')):
+    """Return the names of the fields selected below ``path`` of the current field."""
+    selection_sets = [field.selection_set for field in info.field_asts]
+    for name in path:
+        selection_sets = [
+            field.selection_set for field in iter_fields(info, selection_sets)
+            if field.name.value == name
+        ]
+    return {field.name.value for field in iter_fields(info, selection_sets)}
+
+
+def iter_fields(info, selection_sets):
+    for selection_set in selection_sets:
+        if selection_set is None:
+            continue
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                yield selection
+            elif isinstance(selection, ast.FragmentSpread):
+                fragment = info.fragments[selection.name.value]
+                yield from iter_fields(info, [fragment.selection_set])
+            else:
+                yield from iter_fields(info, [selection.selection_set])
+
+
+def projection(model, fields, always=()):
+    """Return a ``load_only`` option for the columns behind GraphQL ``fields``.
+
+    Relationships contribute the local columns they are loaded by, the
+    primary key and ``always`` (e.g. the keyset columns) are always loaded.
+    """
+    mapper = inspect(model)
+    keys = {c.key for c in mapper.primary_key} | set(always)
+    for attr in mapper.column_attrs:
+        if to_camel_case(attr.key) in fields:
+            keys.add(attr.key)
+    for relationship in mapper.relationships:
+        if to_camel_case(relationship.key) in fields:
+            keys.update(c.key for c in relationship.local_columns if c.key in mapper.columns)
+    return load_only(*sorted(keys))
@@ -1,31 +1,151 @@
 import graphene as gp
 from graphql import GraphQLError
 from graphene_sqlalchemy import SQLAlchemyObjectType
+from sqlalchemy import Float, column, inspect
+from sqlalchemy.orm import joinedload, lazyload
+from flask import current_app
 from flask_jwt_extended import (
     create_access_token,
     create_refresh_token,
     jwt_required,
-    get_jwt_identity,
     current_user,
 )
 from ..models import (
     User as UserModel,
     Message as MessageModel,
     Conversation as ConversationModel,
+    Contact as ContactModel,
+    Participant as ParticipantModel,
+    Change as ChangeModel,
+    InboxEntry as InboxEntryModel,
+    fan_out_on_write,
 )
 
-from .. import db
-from .decorators import admin_required
+from .. import db, group_committer
+from ..models import ChangeCounter, participants
+from ..pubsub import conversation_channel, inbox_channel
+from .decorators import admin_required, rate_limited
+from .loaders import get_loaders, MESSAGE_ORDER
+from .pagination import (
+    page_size, paginate, page_query, order, connection_from_page,
+    decode_cursor, encode_cursor, estimated_count,
+)
+from .projection import selected_fields, projection
+from ..search import search_available, search_messages
+
+CHANGE_ORDER = (ChangeModel.seq,)
+INBOX_ORDER = (ConversationModel.updated_at, ConversationModel.id)
+# Same values as INBOX_ORDER, so cursors work with either inbox fan-out.
+INBOX_ENTRY_ORDER = (InboxEntryModel.updated_at, InboxEntryModel.conversation_id)
+SEARCH_ORDER = (column('score', Float), MessageModel.id)
+USER_ORDER = (UserModel.id,)
+CONVERSATION_ORDER = (ConversationModel.id,)
+
+
+def admin_listing(info, query, model, columns, connection_type, first, after, last, before):
+    """Page ``query`` loading only the columns the selection asks for."""
+    options = projection(model, selected_fields(info), [c.key for c in columns])
+    connection = paginate(
+        query.options(options, lazyload('*')), columns, connection_type,
+        first, after, last, before
+    )
+    if 'totalCount' in selected_fields(info, path=()):
+        connection.total_count = estimated_count(query)
+    return connection
+
+
+def inbox_query(user_id):
+    """Conversations of ``user_id`` read from the inbox table."""
+    return ConversationModel.query.join(
+        InboxEntryModel, InboxEntryModel.conversation_id == ConversationModel.id
+    ).filter(InboxEntryModel.user_id == user_id)
+
+
+def viewer_id(info):
+    """Id of the authenticated user the operation is executed for."""
+    user_id = getattr(info.context, 'user_id', None)
+    if user_id is None:
+        user_id = current_user.id
+    return user_id
 
 
 class Conversation(SQLAlchemyObjectType):
     class Meta:
         model = ConversationModel
 
+    messages = gp.relay.ConnectionField(lambda: MessageConnection)
+    unread_count = gp.Int()
+
+    def resolve_messages(root, info, first=None, after=None, last=None, before=None):
+        size = page_size(first, last)
+        return get_loaders(info).messages.load((root.id, first, after, last, before)).then(
+            lambda nodes: connection_from_page(
+                MessageConnection, nodes, MESSAGE_ORDER, size,
+                after, before, backward=last is not None
+            )
+        )
+
+    def resolve_participants(root, info):
+        return get_loaders(info).participants.load(root.id)
+
+    def resolve_creator(root, info):
+        return get_loaders(info).user.load(root.creator_id)
+
+    def resolve_unread_count(root, info):
+        return get_loaders(info).participant.load((root.id, viewer_id(info))).then(
+            lambda participant: participant.unread_count if participant else None
+        )
+
+    def resolve_last_message(root, info):
+        if root.last_message_id is None:
+            return None
+        if 'last_message' not in inspect(root).unloaded:
+            return root.last_message
+        return get_loaders(info).message.load(root.last_message_id)
+
 
 class Message(SQLAlchemyObjectType):
     class Meta:
         model = MessageModel
+        exclude_fields = ('client_message_id',)
+
+    def resolve_sender(root, info):
+        if root.sender_id is None:
+            return None
+        return get_loaders(info).user.load(root.sender_id)
+
+
+class MessageConnection(gp.relay.Connection):
+    class Meta:
+        node = Message
+
+
+class MessageSearchResult(gp.ObjectType):
+    message = gp.Field(Message)
+    highlight = gp.String()
+    rank = gp.Float()
+
+
+class MessageSearchConnection(gp.relay.Connection):
+    class Meta:
+        node = MessageSearchResult
+
+
+class CountableConnection(gp.relay.Connection):
+    class Meta:
+        abstract = True
+
+    total_count = gp.Int(description='Estimated from planner statistics, null where unavailable.')
+
+
+class ConversationConnection(CountableConnection):
+    class Meta:
+        node = Conversation
+
+
+class Contact(SQLAlchemyObjectType):
+    class Meta:
+        model = ContactModel
 
 
 class User(SQLAlchemyObjectType):
@@ -33,6 +153,49 @@ class User(SQLAlchemyObjectType):
         model = UserModel
         exclude_fields = ('password_hash',)
 
+    def resolve_contacts_added(root, info):
+        return get_loaders(info).contacts_added.load(root.id)
+
+    def resolve_contacts_adders(root, info):
+        return get_loaders(info).contacts_adders.load(root.id)
+
+
+class UserConnection(CountableConnection):
+    class Meta:
+        node = User
+
+
+class Change(SQLAlchemyObjectType):
+    class Meta:
+        model = ChangeModel
+        only_fields = ('seq', 'kind', 'created_at')
+
+    seq = gp.Int()
+    conversation = gp.Field(Conversation)
+    message = gp.Field(Message)
+    user = gp.Field(User, description='The sender of a message or the contact added.')
+
+    def resolve_conversation(root, info):
+        if root.conversation_id is None:
+            return None
+        return get_loaders(info).conversation.load(root.conversation_id)
+
+    def resolve_message(root, info):
+        if root.message_id is None:
+            return None
+        return get_loaders(info).message.load(root.message_id)
+
+    def resolve_user(root, info):
+        if root.subject_id is None:
+            return None
+        return get_loaders(info).user.load(root.subject_id)
+
+
+class SyncPayload(gp.ObjectType):
+    changes = gp.List(Change)
+    token = gp.String(description='Pass as since to continue after these changes.')
+    has_more = gp.Boolean()
+
 
 class CreateUser(gp.Mutation):
     class Arguments:
@@ -46,6 +209,7 @@ class CreateUser(gp.Mutation):
     success = gp.Boolean()
     user = gp.Field(lambda: User)
 
+    @rate_limited()
     def mutate(
             root_value, info,
             email, password, password_confirm,
@@ -137,6 +301,7 @@ class Login(gp.Mutation):
     access_token = gp.String()
     refresh_token = gp.String()
 
+    @rate_limited()
     def mutate(root_value, info, email, password):
         user = UserModel.query.filter_by(email=email).first()
 
@@ -144,8 +309,8 @@ class Login(gp.Mutation):
             raise GraphQLError('invalid email')
 
         return Login(
-            access_token=create_access_token(email),
-            refresh_token=create_refresh_token(email),
+            access_token=create_access_token(user),
+            refresh_token=create_refresh_token(user),
         )
 
 
@@ -154,28 +319,99 @@ class RefreshToken(gp.Mutation):
 
     @jwt_required(refresh=True)
     def mutate(root_value, _):
-        user = get_jwt_identity()
-        return RefreshToken(access_token=create_access_token(user))
+        # Reissued with the current claims, not the ones of the refresh token.
+        return RefreshToken(access_token=create_access_token(current_user))
 
 
 class SendMessage(gp.Mutation):
     class Arguments:
         destination = gp.String()
         message = gp.String()
+        client_message_id = gp.String(
+            description='Idempotency key, a retry with the same key returns the original message.'
+        )
 
     conversation = gp.Field(lambda: Conversation)
+    message = gp.Field(lambda: Message)
 
     @jwt_required()
-    def mutate(root_value, info, message, destination=None):
+    @rate_limited()
+    def mutate(root_value, info, message, destination=None, client_message_id=None):
         sender = current_user
+        if client_message_id:
+            if len(client_message_id) > MessageModel.client_message_id.type.length:
+                raise GraphQLError('clientMessageId is too long')
+            sent = sender.find_sent_message(client_message_id)
+            if sent is not None:
+                return SendMessage(conversation=sent.conversation, message=sent)
+
         if '@' in destination:
             receiver = UserModel.query.filter_by(email=destination).first()
             c = sender.start_personal_chat(receiver)
-            sender.send_message(c, message)
+            m = group_committer.send_message(sender, c, message, client_message_id)
         elif destination.isnumeric():
             c = sender.start_multiperson_chat(int(destination))
-            sender.send_message(c, message)
-        return SendMessage(conversation=c)
+            m = group_committer.send_message(sender, c, message, client_message_id)
+        return SendMessage(conversation=c, message=m)
+
+
+def resolve_destinations(sender, destinations):
+    """Map ``sendMessage`` destinations to conversations with set-based lookups."""
+    emails = {d for d in destinations if '@' in d}
+    mpc_ids = {int(d) for d in destinations if d.isnumeric()}
+    invalid = set(destinations) - emails - {str(i) for i in mpc_ids}
+    if invalid:
+        raise GraphQLError(f'invalid destination {sorted(invalid)[0]}')
+
+    conversations = {}
+    if emails:
+        users = UserModel.query.filter(UserModel.email.in_(emails)).all()
+        missing = emails - {u.email for u in users}
+        if missing:
+            raise GraphQLError(f'user {sorted(missing)[0]} does not exist')
+        chats = sender.personal_chats_with(users)
+        conversations.update((u.email, chats[u.id]) for u in users)
+    if mpc_ids:
+        found = ConversationModel.query.filter(ConversationModel.id.in_(mpc_ids)).all()
+        conversations.update((str(c.id), c) for c in found)
+        for mpc_id in mpc_ids - {c.id for c in found}:
+            conversations[str(mpc_id)] = sender.start_multiperson_chat(mpc_id)
+    return conversations
+
+
+class MessageInput(gp.InputObjectType):
+    destination = gp.String(required=True)
+    message = gp.String(required=True)
+    client_id = gp.String()
+
+
+class SentMessage(gp.ObjectType):
+    client_id = gp.String()
+    message = gp.Field(lambda: Message)
+    conversation = gp.Field(lambda: Conversation)
+
+
+class SendMessages(gp.Mutation):
+    class Arguments:
+        items = gp.List(gp.NonNull(MessageInput), required=True)
+
+    results = gp.List(SentMessage)
+
+    @jwt_required()
+    @rate_limited()
+    def mutate(root_value, info, items):
+        if len(items) > current_app.config['FLCHAT_MAX_SEND_BATCH']:
+            raise GraphQLError('too many messages')
+
+        sender = current_user
+        conversations = resolve_destinations(sender, [i.destination for i in items])
+        messages = sender.send_messages(
+            [(conversations[i.destination], i.message) for i in items]
+        )
+        return SendMessages(results=[
+            SentMessage(client_id=i.client_id, message=m, conversation=conversations[i.destination])
+            for i, m in zip(items, messages)
+        ])
 
 
 class CreateMPC(gp.Mutation):
@@ -193,29 +429,56 @@ class CreateMPC(gp.Mutation):
 class AddToMPC(gp.Mutation):
     class Arguments:
         email = gp.String()
+        emails = gp.List(gp.String)
         mpc_id = gp.Int()
 
     conversation = gp.Field(lambda: Conversation)
 
     @jwt_required()
-    def mutate(root_value, info, email, mpc_id):
+    def mutate(root_value, info, mpc_id, email=None, emails=None):
         mpc = ConversationModel.query.get(mpc_id)
         if not mpc:
             raise GraphQLError('conversation does not exist')
 
         if current_user != mpc.creator:
             raise GraphQLError('you are not the creator')
-        user = UserModel.query.filter_by(email=email).first()
-        if not user:
+        emails = set(emails or []) | ({email} if email else set())
+        users = UserModel.query.filter(UserModel.email.in_(emails)).all() if emails else []
+        if not users or len(users) != len(emails):
             raise GraphQLError('user does not exist')
 
-        if mpc.title.startswith('pc'):
+        if mpc.kind == ConversationModel.PERSONAL:
             mpc = current_user.start_multiperson_chat()
 
-        mpc.add_user_to_mpc(user)
+        mpc.add_users_to_mpc(users)
         return AddToMPC(conversation=mpc)
 
 
+class MarkRead(gp.Mutation):
+    class Arguments:
+        conversation_id = gp.Int(required=True)
+        up_to = gp.Int()
+
+    conversation = gp.Field(lambda: Conversation)
+
+    @jwt_required()
+    def mutate(root_value, info, conversation_id, up_to=None):
+        participant = ParticipantModel.query.get((conversation_id, current_user.id))
+        if not participant:
+            raise GraphQLError('conversation does not exist')
+
+        conversation = participant.conversation
+        if up_to is None:
+            up_to = conversation.last_message_id
+        elif not conversation.messages.filter_by(id=up_to).first():
+            raise GraphQLError('message does not exist')
+
+        if up_to is not None:
+            participant.mark_read(up_to)
+            db.session.commit()
+        return MarkRead(conversation=conversation)
+
+
 class AddContact(gp.Mutation):
     class Arguments:
         email = gp.String()
@@ -235,13 +498,34 @@ class Query(gp.ObjectType):
     hello = gp.String()
     me = gp.Field(User)
     my_chats = gp.List(Conversation)
+    my_inbox = gp.relay.ConnectionField(ConversationConnection)
     my_contacts = gp.List(User)
+    sync = gp.Field(
+        SyncPayload,
+        since=gp.String(description='Token of the last sync, omit for the current token only.'),
+        limit=gp.Int()
+    )
+    search_messages = gp.relay.ConnectionField(
+        MessageSearchConnection,
+        query=gp.String(required=True),
+        conversation_id=gp.Int()
+    )
     my_personal_chats = gp.List(Conversation)
     my_multi_chats = gp.List(Conversation)
     user = gp.Field(User, email=gp.String())
-    users = gp.List(User)
+    users = gp.relay.ConnectionField(
+        UserConnection,
+        email=gp.String(),
+        is_admin=gp.Boolean(),
+        is_active=gp.Boolean()
+    )
     conversation = gp.Field(Conversation, title=gp.String())
-    conversations = gp.List(Conversation)
+    conversations = gp.relay.ConnectionField(
+        ConversationConnection,
+        title=gp.String(),
+        kind=gp.String(),
+        creator_id=gp.Int()
+    )
 
     def resolve_hello(root_value, info):
         return 'hello'
@@ -252,35 +536,138 @@ class Query(gp.ObjectType):
 
     @jwt_required()
     def resolve_my_chats(root_value, info):
+        if fan_out_on_write():
+            return order(inbox_query(current_user.id), INBOX_ENTRY_ORDER, descending=True).all()
         return current_user.participates.all()
 
+    @jwt_required()
+    def resolve_my_inbox(root_value, info, first=None, after=None, last=None, before=None):
+        options = joinedload(ConversationModel.last_message).joinedload(MessageModel.sender)
+        if fan_out_on_write():
+            size = page_size(first, last)
+            query = page_query(
+                inbox_query(current_user.id).options(options), INBOX_ENTRY_ORDER, size,
+                after, before, descending=True, backward=last is not None
+            )
+            return connection_from_page(
+                ConversationConnection, query.all(), INBOX_ORDER, size,
+                after, before, backward=last is not None
+            )
+
+        query = current_user.participates.options(options)
+        return paginate(
+            query, INBOX_ORDER, ConversationConnection,
+            first, after, last, before, descending=True
+        )
+
+    @jwt_required()
+    def resolve_search_messages(
+            root_value, info, query, conversation_id=None,
+            first=None, after=None, last=None, before=None
+    ):
+        if last is not None or before:
+            raise GraphQLError('search results can only be paged forward')
+        if not search_available():
+            raise GraphQLError('full-text search is not available')
+        size = page_size(first)
+        hits = search_messages(
+            current_user.id, query, size,
+            after=decode_cursor(after, SEARCH_ORDER) if after else None,
+            conversation_id=conversation_id
+        )
+
+        edges = [
+            MessageSearchConnection.Edge(
+                node=MessageSearchResult(
+                    message=hit.message, highlight=hit.highlight, rank=-hit.score
+                ),
+                cursor=encode_cursor([hit.score, hit.message.id])
+            )
+            for hit in hits[:size]
+        ]
+        return MessageSearchConnection(
+            edges=edges,
+            page_info=gp.relay.PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=bool(after),
+                has_next_page=len(hits) > size,
+            )
+        )
+
+    @jwt_required()
+    def resolve_sync(root_value, info, since=None, limit=None):
+        if since is None:
+            # Taken before a full download, so nothing after it is missed.
+            head = db.session.query(ChangeCounter.seq).filter_by(user_id=current_user.id).scalar()
+            return SyncPayload(changes=[], token=encode_cursor([head]), has_more=False)
+
+        seq, = decode_cursor(since, CHANGE_ORDER)
+        size = page_size(limit)
+        changes = ChangeModel.query.filter(
+            ChangeModel.user_id == current_user.id, ChangeModel.seq > seq
+        ).order_by(ChangeModel.seq).limit(size + 1).all()
+        has_more = len(changes) > size
+        changes = changes[:size]
+        return SyncPayload(
+            changes=changes,
+            token=encode_cursor([changes[-1].seq]) if changes else since,
+            has_more=has_more,
+        )
+
     @jwt_required()
     def resolve_my_contacts(root_value, info):
         return current_user.contacts
 
     @jwt_required()
     def resolve_my_personal_chats(root_value, info):
-        return current_user.participates.filter(ConversationModel.title.startswith('pc')).all()
+        return current_user.participates.filter_by(kind=ConversationModel.PERSONAL).all()
 
     @jwt_required()
     def resolve_my_multi_chats(root_value, info):
-        return current_user.participates.filter(ConversationModel.title.startswith('mpc')).all()
+        return current_user.participates.filter_by(kind=ConversationModel.MULTIPERSON).all()
 
     @admin_required()
     def resolve_user(root_value, info, email):
         return UserModel.query.filter_by(email=email).first()
 
     @admin_required()
-    def resolve_users(root_value, info):
-        return UserModel.query.all()
+    def resolve_users(
+            root_value, info, email=None, is_admin=None, is_active=None,
+            first=None, after=None, last=None, before=None
+    ):
+        query = UserModel.query
+        if email:
+            query = query.filter(UserModel.email.startswith(email, autoescape=True))
+        if is_admin is not None:
+            query = query.filter_by(is_admin=is_admin)
+        if is_active is not None:
+            query = query.filter_by(is_active=is_active)
+        return admin_listing(
+            info, query, UserModel, USER_ORDER, UserConnection,
+            first, after, last, before
+        )
 
     @admin_required()
     def resolve_conversation(root_value, info, title):
         return ConversationModel.query.filter_by(title=title).first()
 
     @admin_required()
-    def resolve_conversations(root_value, info):
-        return ConversationModel.query.all()
+    def resolve_conversations(
+            root_value, info, title=None, kind=None, creator_id=None,
+            first=None, after=None, last=None, before=None
+    ):
+        query = ConversationModel.query
+        if title:
+            query = query.filter(ConversationModel.title.startswith(title, autoescape=True))
+        if kind:
+            query = query.filter_by(kind=kind)
+        if creator_id is not None:
+            query = query.filter_by(creator_id=creator_id)
+        return admin_listing(
+            info, query, ConversationModel, CONVERSATION_ORDER, ConversationConnection,
+            first, after, last, before
+        )
 
 
 class Mutation(gp.ObjectType):
@@ -290,12 +677,36 @@ class Mutation(gp.ObjectType):
     delete_user = DeleteUser.Field()
     update_user = UpdateUser.Field()
     send_message = SendMessage.Field()
+    send_messages = SendMessages.Field()
     add_to_mpc = AddToMPC.Field()
     create_mpc = CreateMPC.Field()
     add_contact = AddContact.Field()
+    mark_read = MarkRead.Field()
+
+
+class Subscription(gp.ObjectType):
+    message_added = gp.Field(Message, conversation_id=gp.Int(required=True))
+    inbox_updated = gp.Field(Conversation)
+
+    def resolve_message_added(root_value, info, conversation_id):
+        is_participant = db.session.query(participants).filter_by(
+            conversation_id=conversation_id, user_id=info.context.user_id
+        ).first()
+        if not is_participant:
+            raise GraphQLError('conversation does not exist')
+
+        return info.context.observe(conversation_channel(conversation_id)).map(
+            lambda event: MessageModel.query.get(event['message_id'])
+        )
+
+    def resolve_inbox_updated(root_value, info):
+        return info.context.observe(inbox_channel(info.context.user_id)).map(
+            lambda event: ConversationModel.query.get(event['conversation_id'])
+        )
 
 
 schema = gp.Schema(
     query=Query,
-    mutation=Mutation
+    mutation=Mutation,
+    subscription=Subscription
 )
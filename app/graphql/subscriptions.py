@@ -0,0 +1,202 @@
+"""Server side of the ``graphql-ws`` protocol (subscriptions-transport-ws).
+
+One :class:`SubscriptionConnection` serves one WebSocket. Client frames and
+pub/sub events are funnelled through a single queue and handled on the
+connection's own thread, so subscription payloads are resolved with the
+same app context and database session as the rest of the connection.
+"""
+import json
+import queue
+import threading
+
+from flask import current_app
+from flask_jwt_extended import decode_token
+from graphql import GraphQLError
+from graphql.error import format_error
+from graphql.execution import ExecutionResult
+from promise import is_thenable
+from rx import Observable
+
+from .. import db, pubsub
+from ..models import user_lookup_callback
+
+GQL_CONNECTION_INIT = 'connection_init'
+GQL_CONNECTION_ACK = 'connection_ack'
+GQL_CONNECTION_ERROR = 'connection_error'
+GQL_CONNECTION_KEEP_ALIVE = 'ka'
+GQL_CONNECTION_TERMINATE = 'connection_terminate'
+GQL_START = 'start'
+GQL_DATA = 'data'
+GQL_ERROR = 'error'
+GQL_COMPLETE = 'complete'
+GQL_STOP = 'stop'
+
+CLOSED = object()
+
+
+class SubscriptionContext:
+    """Execution context of every operation started on one connection."""
+
+    def __init__(self, user_id, events):
+        self.user_id = user_id
+        self.events = events
+        self.loaders = None
+
+    def observe(self, channel):
+        """Return an observable of the pub/sub events sent to ``channel``.
+
+        Events are queued for the connection thread instead of being pushed
+        to the observer directly by the (foreign) publishing thread.
+        """
+        def subscribe(observer):
+            return pubsub.subscribe(
+                channel, lambda payload: self.events.put((observer, payload))
+            )
+
+        return Observable.create(subscribe)
+
+
+class SubscriptionConnection:
+    def __init__(self, ws, schema):
+        self.ws = ws
+        self.schema = schema
+        self.events = queue.Queue()
+        self.context = None
+        self.operations = {}
+
+    def run(self):
+        reader = threading.Thread(target=self.read, daemon=True)
+        reader.start()
+
+        keepalive = current_app.config['FLCHAT_SUBSCRIPTION_KEEPALIVE']
+        try:
+            while True:
+                try:
+                    item = self.events.get(timeout=keepalive)
+                except queue.Empty:
+                    if self.context:
+                        self.send(GQL_CONNECTION_KEEP_ALIVE)
+                    continue
+                if item is CLOSED or not self.process(item):
+                    break
+        finally:
+            self.unsubscribe_all()
+
+    def read(self):
+        try:
+            while True:
+                self.events.put(self.ws.receive())
+        except Exception:
+            self.events.put(CLOSED)
+
+    def process(self, item):
+        try:
+            if isinstance(item, tuple):
+                observer, payload = item
+                observer.on_next(payload)
+                return True
+            return self.handle_message(item)
+        finally:
+            # The connection lives for hours, never keep a transaction (or
+            # stale identity map) open while waiting for the next event.
+            db.session.remove()
+
+    def handle_message(self, raw):
+        try:
+            message = json.loads(raw)
+            op_type = message.get('type')
+        except (TypeError, ValueError, AttributeError):
+            self.send(GQL_CONNECTION_ERROR, payload={'message': 'invalid message'})
+            return True
+
+        if op_type == GQL_CONNECTION_INIT:
+            return self.on_connection_init(message.get('payload') or {})
+        if op_type == GQL_CONNECTION_TERMINATE:
+            return False
+        if op_type == GQL_START:
+            self.on_start(message.get('id'), message.get('payload') or {})
+        elif op_type == GQL_STOP:
+            self.unsubscribe(message.get('id'))
+        else:
+            self.send(GQL_ERROR, message.get('id'), {'message': f'unknown message type {op_type}'})
+        return True
+
+    def on_connection_init(self, payload):
+        token = payload.get('authToken') or payload.get('Authorization', '')
+        if token.startswith('Bearer '):
+            token = token[len('Bearer '):]
+        try:
+            user = user_lookup_callback(None, decode_token(token))
+        except Exception:
+            user = None
+        if user is None:
+            self.send(GQL_CONNECTION_ERROR, payload={'message': 'invalid token'})
+            return False
+
+        self.context = SubscriptionContext(user.id, self.events)
+        self.send(GQL_CONNECTION_ACK)
+        return True
+
+    def on_start(self, op_id, payload):
+        if self.context is None:
+            self.send(GQL_ERROR, op_id, {'message': 'connection is not initialized'})
+            return
+        self.unsubscribe(op_id)
+
+        result = self.schema.execute(
+            payload.get('query'),
+            variable_values=payload.get('variables'),
+            operation_name=payload.get('operationName'),
+            context_value=self.context,
+            allow_subscriptions=True,
+            backend=current_app.extensions['graphql_backend'],
+        )
+
+        if isinstance(result, ExecutionResult):
+            self.send_result(op_id, result)
+            self.send(GQL_COMPLETE, op_id)
+            return
+
+        self.operations[op_id] = result.subscribe(
+            on_next=lambda r: self.send_result(op_id, r),
+            on_error=lambda e: self.send(GQL_ERROR, op_id, format_error(e)),
+            on_completed=lambda: self.send(GQL_COMPLETE, op_id),
+        )
+
+    def unsubscribe(self, op_id):
+        subscription = self.operations.pop(op_id, None)
+        if subscription is not None:
+            subscription.dispose()
+
+    def unsubscribe_all(self):
+        for op_id in list(self.operations):
+            self.unsubscribe(op_id)
+
+    def send_result(self, op_id, result):
+        # Fields below the subscription root may resolve through DataLoaders,
+        # which graphql-core leaves as pending promises in subscription data.
+        data = result.data
+        errors = list(result.errors or [])
+        if data:
+            for key, value in list(data.items()):
+                if is_thenable(value):
+                    try:
+                        data[key] = value.get()
+                    except Exception as e:
+                        data[key] = None
+                        errors.append(e if isinstance(e, GraphQLError) else GraphQLError(str(e)))
+        # Loader caches must not carry data over to the next event.
+        self.context.loaders = None
+
+        payload = {'data': data}
+        if errors:
+            payload['errors'] = [format_error(e) for e in errors]
+        self.send(GQL_DATA, op_id, payload)
+
+    def send(self, op_type, op_id=None, payload=None):
+        message = {'type': op_type}
+        if op_id is not None:
+            message['id'] = op_id
+        if payload is not None:
+            message['payload'] = payload
+        self.ws.send(json.dumps(message))
@@ -1,11 +1,108 @@
+import threading
+
+from flask import Response, abort, current_app, request, stream_with_context
+from flask_jwt_extended import current_user, jwt_required
 from . import graphql
+from ..export import FORMATS, export_conversation
+from ..models import Participant
+from .backend import CachedDocumentBackend, LRUCache, apply_persisted_query
+from .cost import QueryCostLimiter
 from .schema import schema
+from .subscriptions import SubscriptionConnection
 from flask_graphql import GraphQLView
 
+
+@graphql.record_once
+def init_document_cache(state):
+    config = state.app.config
+    state.app.extensions['graphql_backend'] = CachedDocumentBackend(
+        config['FLCHAT_DOCUMENT_CACHE_SIZE'],
+        limiter=QueryCostLimiter(
+            max_depth=config['FLCHAT_MAX_QUERY_DEPTH'],
+            max_cost=config['FLCHAT_MAX_QUERY_COST'],
+            list_size=config['FLCHAT_QUERY_LIST_SIZE'],
+            page_size=config['FLCHAT_PAGE_SIZE'],
+            max_page_size=config['FLCHAT_MAX_PAGE_SIZE'],
+            weights=config['FLCHAT_QUERY_COST_WEIGHTS'],
+        ),
+        instruments=[
+            state.app.extensions[name] for name in ('metrics', 'tracing')
+            if name in state.app.extensions
+        ]
+    )
+    state.app.extensions['graphql_persisted_queries'] = LRUCache(
+        config['FLCHAT_PERSISTED_QUERY_CACHE_SIZE']
+    )
+
+
+class FLChatGraphQLView(GraphQLView):
+    def get_backend(self):
+        return current_app.extensions['graphql_backend']
+
+    def parse_body(self):
+        data = super(FLChatGraphQLView, self).parse_body()
+        if request.method == 'GET':
+            data = request.args.to_dict()
+
+        store = current_app.extensions['graphql_persisted_queries']
+        if isinstance(data, list):
+            return [apply_persisted_query(params, store) for params in data]
+        return apply_persisted_query(data, store)
+
+
 graphql.add_url_rule(
     '/graphql',
-    view_func=GraphQLView.as_view(
+    view_func=FLChatGraphQLView.as_view(
         'graphql',
         schema=schema,
     )
 )
+
+
+@graphql.route('/conversations/<int:conversation_id>/export')
+@jwt_required()
+def export(conversation_id):
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        abort(400)
+    if Participant.query.get((conversation_id, current_user.id)) is None:
+        abort(404)
+
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    filename = f'conversation-{conversation_id}.{fmt}' + ('.gz' if compress else '')
+    return Response(
+        stream_with_context(export_conversation(conversation_id, fmt, compress)),
+        mimetype='application/gzip' if compress else FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+
+if Sock is not None:
+    sock = Sock()
+    # Mount the WebSocket routes on this blueprint instead of the private
+    # one flask-sock would register on the app.
+    sock.bp = graphql
+
+    @graphql.record_once
+    def init_socket_limit(state):
+        state.app.extensions['graphql_sockets'] = threading.BoundedSemaphore(
+            state.app.config['FLCHAT_MAX_SUBSCRIPTION_SOCKETS']
+        )
+
+    @sock.route('/graphql', endpoint='graphql_ws')
+    def graphql_ws(ws):
+        # A socket holds its worker thread until it closes, past the cap the
+        # HTTP requests of this worker would have no thread left.
+        sockets = current_app.extensions['graphql_sockets']
+        if not sockets.acquire(blocking=False):
+            ws.close(reason=1013, message='too many subscriptions')
+            return
+        try:
+            SubscriptionConnection(ws, schema).run()
+        finally:
+            sockets.release()
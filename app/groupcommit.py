@@ -0,0 +1,172 @@
+"""Group commit of sent messages.
+
+With ``FLCHAT_GROUP_COMMIT`` on, messages sent concurrently within a worker
+are handed to one committer thread, which writes whatever arrived within
+``FLCHAT_GROUP_COMMIT_INTERVAL_MS`` of the first, or at most
+``FLCHAT_GROUP_COMMIT_MAX_BATCH`` messages, in a single transaction. Under
+bursts the database syncs its log once per batch rather than once per
+message. Each sender waits for the commit of its batch and only then gets
+its message back, so nothing is reported as sent before it is durable.
+A message whose sender gave up waiting is not committed later, unless the
+committer had already picked it up; then the sender waits for it after all.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from sqlalchemy.exc import IntegrityError
+
+from .asgi import run_blocking
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    __slots__ = ('sender_id', 'conversation_id', 'text', 'client_message_id', 'future')
+
+    def __init__(self, sender_id, conversation_id, text, client_message_id):
+        self.sender_id = sender_id
+        self.conversation_id = conversation_id
+        self.text = text
+        self.client_message_id = client_message_id
+        self.future = Future()
+
+
+class GroupCommitter:
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config['FLCHAT_GROUP_COMMIT']
+        self.interval = app.config['FLCHAT_GROUP_COMMIT_INTERVAL_MS'] / 1000
+        self.max_batch = app.config['FLCHAT_GROUP_COMMIT_MAX_BATCH']
+        self.timeout = app.config['FLCHAT_GROUP_COMMIT_TIMEOUT']
+
+    def send_message(self, sender, conv, text, client_message_id=None):
+        """Send like ``sender.send_message``, through the committer when enabled."""
+        if not self.enabled or sender.id is None or conv.id is None:
+            return sender.send_message(conv, text, client_message_id)
+
+        from . import db
+        from .models import Message
+
+        # The committer must never wait on locks held by the caller.
+        db.session.commit()
+        pending = _Pending(sender.id, conv.id, text, client_message_id)
+        self.start()
+        self.queue.put(pending)
+        try:
+            message_id = run_blocking(self.wait, pending)
+        except IntegrityError:
+            sent = sender.find_sent_message(client_message_id) if client_message_id else None
+            if sent is None:
+                raise
+            return sent
+        return Message.query.get(message_id)
+
+    def wait(self, pending):
+        try:
+            return pending.future.result(self.timeout)
+        except TimeoutError:
+            # Withdrawn so a retry can't duplicate it, unless it is being
+            # committed already.
+            if pending.future.cancel():
+                raise
+            return pending.future.result(self.timeout)
+
+    def start(self):
+        # Deferred to first use, so CLI commands never start the thread.
+        # Started again should it ever have died.
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name='flchat-group-commit', daemon=True
+                )
+                self.thread.start()
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            try:
+                with self.app.app_context():
+                    self.flush(batch)
+            except Exception as e:
+                # E.g. the rollback of a dead connection, the thread lives on.
+                logger.exception('committer failed on a batch of %d messages', len(batch))
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+
+    def collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self, batch):
+        from . import db
+
+        # Skips messages whose senders stopped waiting.
+        batch = [p for p in batch if p.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            self.commit(batch)
+            return
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) == 1:
+                batch[0].future.set_exception(e)
+                return
+            logger.exception('group commit of %d messages failed', len(batch))
+
+        # Retry one by one, so a single bad message fails alone.
+        for pending in batch:
+            try:
+                self.commit([pending])
+            except Exception as e:
+                db.session.rollback()
+                pending.future.set_exception(e)
+
+    def commit(self, batch):
+        from . import db
+        from .models import Conversation, User, publish_messages, stage_messages
+
+        users = User.query.filter(User.id.in_({p.sender_id for p in batch})).all()
+        conversations = Conversation.query.filter(
+            Conversation.id.in_({p.conversation_id for p in batch})
+        ).all()
+        users = {u.id: u for u in users}
+        conversations = {c.id: c for c in conversations}
+
+        messages = stage_messages([
+            (users[p.sender_id], conversations[p.conversation_id], p.text, p.client_message_id)
+            for p in batch
+        ])
+        events = [(msg.conversation_id, msg.id) for msg in messages]
+        db.session.commit()
+
+        try:
+            publish_messages(events)
+        except Exception:
+            logger.exception('publishing %d messages failed', len(events))
+        for pending, (_, message_id) in zip(batch, events):
+            pending.future.set_result(message_id)
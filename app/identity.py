@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+IDENTITY_CHANNEL = 'identity'
+
+
+class IdentityCache:
+    """Per-process cache of the users that authenticated tokens resolve to.
+
+    Only plain column snapshots are kept, never ORM instances, so nothing is
+    shared between sessions. Entries live at most ``FLCHAT_IDENTITY_CACHE_TTL``
+    seconds and the cache holds at most ``FLCHAT_IDENTITY_CACHE_SIZE`` users.
+
+    Changed users are dropped as soon as the change is committed, in this
+    process directly and in the other workers through the ``identity``
+    pub/sub channel; the TTL bounds staleness should an event get lost.
+    """
+
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.maxsize = 0
+        self.ttl = 0
+        self.pubsub = None
+        self.subscribed = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, pubsub=None):
+        self.maxsize = app.config['FLCHAT_IDENTITY_CACHE_SIZE']
+        self.ttl = app.config['FLCHAT_IDENTITY_CACHE_TTL']
+        self.pubsub = pubsub
+        self.subscribed = False
+        self.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get(self, user_id):
+        self.subscribe()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            expires, snapshot = entry
+            if expires < time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return snapshot
+
+    def set(self, user_id, snapshot):
+        if not self.maxsize:
+            return
+        with self.lock:
+            self.entries[user_id] = (time.monotonic() + self.ttl, snapshot)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id, broadcast=False):
+        with self.lock:
+            self.entries.pop(user_id, None)
+        if broadcast and self.pubsub is not None:
+            self.pubsub.publish(IDENTITY_CHANNEL, {'user_id': user_id})
+
+    def subscribe(self):
+        # Deferred to first use, so CLI commands never start a listener.
+        if self.subscribed or self.pubsub is None:
+            return
+        self.subscribed = True
+        self.pubsub.subscribe(
+            IDENTITY_CHANNEL, lambda payload: self.invalidate(payload['user_id'])
+        )
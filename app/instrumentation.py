@@ -0,0 +1,68 @@
+"""Plumbing shared by the GraphQL instruments of :mod:`app.metrics` and
+:mod:`app.tracing`.
+
+Both keep the running operation in :data:`state`, see SQL statements
+through the one pair of ``Engine`` listeners below and wrap resolvers
+with :func:`resolve`.
+"""
+from graphql.type import GraphQLObjectType, GraphQLInterfaceType, GraphQLUnionType, get_named_type
+from promise import Promise, is_thenable
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.local import Local
+
+COMPOSITE_TYPES = (GraphQLObjectType, GraphQLInterfaceType, GraphQLUnionType)
+
+# Per request (and greenlet, in ASGI mode) state of the running operation.
+state = Local()
+
+# Called as ``listener(conn, cursor, statement, parameters, executemany)``.
+before_statement = []
+after_statement = []
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    for listener in before_statement:
+        listener(conn, cursor, statement, parameters, executemany)
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    for listener in after_statement:
+        listener(conn, cursor, statement, parameters, executemany)
+
+
+def is_composite(info):
+    return isinstance(get_named_type(info.return_type), COMPOSITE_TYPES)
+
+
+def resolve(next, root, info, args, finish):
+    """Call the resolver ``next``, then ``finish(error)`` once its value is there.
+
+    ``error`` is ``None`` on success. Returned promises are waited for.
+    """
+    try:
+        result = next(root, info, **args)
+    except Exception as e:
+        finish(e)
+        raise
+
+    if not is_thenable(result):
+        finish(None)
+        return result
+
+    def resolved(value):
+        finish(None)
+        return value
+
+    def rejected(error):
+        finish(error)
+        raise error
+
+    return Promise.resolve(result).then(resolved, rejected)
+
+
+class Operation:
+    """Yielded by the instruments' ``operation()``, the block sets ``result``."""
+    result = None
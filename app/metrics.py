@@ -0,0 +1,161 @@
+"""Prometheus metrics of GraphQL operations and resolvers.
+
+Per operation name and per resolver (``Type.field``) this records latency,
+the number of SQL statements executed and the number of errors. Resolvers
+of scalar fields are only measured on the root types, timing every leaf
+value would cost more than it tells.
+
+Metrics are served on ``/metrics``. Under gunicorn, set
+``PROMETHEUS_MULTIPROC_DIR`` to a directory shared by the workers (see
+``boot.sh`` and ``gunicorn.conf.py``) so every scrape sees all of them.
+
+Operation names come from client documents, each process labels at most
+``FLCHAT_METRICS_MAX_OPERATIONS`` of them and counts the rest as ``other``.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response
+
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+from .instrumentation import Operation, before_statement, is_composite, resolve, state
+
+ROOT_TYPES = ('Query', 'Mutation', 'Subscription')
+
+
+def count_statement(conn, cursor, statement, parameters, executemany):
+    counts = getattr(state, 'statements', None)
+    if counts is None:
+        return
+    counts['operation'] += 1
+    field = getattr(state, 'field', None)
+    if field is not None:
+        counts[field] = counts.get(field, 0) + 1
+
+
+before_statement.append(count_statement)
+
+
+class MetricsMiddleware:
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def resolve(self, next, root, info, **args):
+        if getattr(state, 'statements', None) is None or not self.measured(info):
+            return next(root, info, **args)
+
+        field = f'{info.parent_type.name}.{info.field_name}'
+        outer, state.field = getattr(state, 'field', None), field
+        start = time.perf_counter()
+
+        def finish(error):
+            self.metrics.observe_resolver(field, time.perf_counter() - start, error=error is not None)
+
+        try:
+            return resolve(next, root, info, args, finish)
+        finally:
+            state.field = outer
+
+    @staticmethod
+    def measured(info):
+        return info.parent_type.name in ROOT_TYPES or is_composite(info)
+
+
+class Metrics:
+    def __init__(self, app=None):
+        self.enabled = False
+        self.middleware = MetricsMiddleware(self)
+        self.lock = threading.Lock()
+        self.operations = set()
+        self.max_operations = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = prometheus_client is not None and app.config['FLCHAT_METRICS_ENABLED']
+        if not self.enabled:
+            return
+        self.max_operations = app.config['FLCHAT_METRICS_MAX_OPERATIONS']
+        self.create_metrics()
+        app.extensions['metrics'] = self
+        app.add_url_rule('/metrics', 'metrics', self.export)
+
+    def create_metrics(self):
+        if hasattr(self, 'operation_seconds'):
+            return
+        self.operation_seconds = prometheus_client.Histogram(
+            'flchat_graphql_operation_seconds', 'GraphQL operation latency', ['operation']
+        )
+        self.operation_statements = prometheus_client.Counter(
+            'flchat_graphql_operation_sql_statements', 'SQL statements run by operations', ['operation']
+        )
+        self.operation_errors = prometheus_client.Counter(
+            'flchat_graphql_operation_errors', 'Errors returned by operations', ['operation']
+        )
+        self.resolver_seconds = prometheus_client.Histogram(
+            'flchat_graphql_resolver_seconds', 'GraphQL resolver latency', ['field']
+        )
+        self.resolver_statements = prometheus_client.Counter(
+            'flchat_graphql_resolver_sql_statements', 'SQL statements run by resolvers', ['field']
+        )
+        self.resolver_errors = prometheus_client.Counter(
+            'flchat_graphql_resolver_errors', 'Errors raised by resolvers', ['field']
+        )
+
+    @contextmanager
+    def operation(self, name):
+        """Measure the operation executed in the block.
+
+        The block reports its errors by setting ``result`` on the yielded
+        object to the ``ExecutionResult``.
+        """
+        if not self.enabled or getattr(state, 'statements', None) is not None:
+            yield Operation()
+            return
+
+        name = self.operation_label(name)
+        operation = Operation()
+        state.statements = {'operation': 0}
+        start = time.perf_counter()
+        try:
+            yield operation
+        finally:
+            statements, state.statements = state.statements, None
+            self.operation_seconds.labels(name).observe(time.perf_counter() - start)
+            self.operation_statements.labels(name).inc(statements.pop('operation'))
+            for field, count in statements.items():
+                self.resolver_statements.labels(field).inc(count)
+            errors = getattr(operation.result, 'errors', None)
+            if errors:
+                self.operation_errors.labels(name).inc(len(errors))
+
+    def operation_label(self, name):
+        if name in self.operations:
+            return name
+        with self.lock:
+            if len(self.operations) < self.max_operations:
+                self.operations.add(name)
+                return name
+        return 'other'
+
+    def observe_resolver(self, field, seconds, error=False):
+        self.resolver_seconds.labels(field).observe(seconds)
+        if error:
+            self.resolver_errors.labels(field).inc()
+
+    def export(self):
+        registry = prometheus_client.REGISTRY
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.environ.get('prometheus_multiproc_dir'):
+            registry = prometheus_client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        return Response(
+            prometheus_client.generate_latest(registry),
+            mimetype=prometheus_client.CONTENT_TYPE_LATEST
+        )
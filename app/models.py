@@ -1,6 +1,13 @@
+from flask import current_app
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
-from . import db, jwt
+from collections import Counter, defaultdict
+from sqlalchemy import DDL, event, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, make_transient_to_detached, object_session
+from sqlalchemy.orm.util import identity_key
+from datetime import datetime, timedelta
+from . import db, jwt, pubsub, identity_cache
+from .asgi import run_blocking
 
 
 class Contact(db.Model):
@@ -9,19 +16,80 @@ class Contact(db.Model):
     added_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
-participants = db.Table(
-    'participants',
-    db.Column('conversation_id', db.Integer, db.ForeignKey('conversation.id')),
-    db.Column('user_id', db.Integer, db.ForeignKey('user.id'))
-)
+class PersonalChat(db.Model):
+    user_low_id = db.Column(
+        db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True
+    )
+    user_high_id = db.Column(
+        db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True
+    )
+    conversation_id = db.Column(
+        db.Integer, db.ForeignKey('conversation.id'), nullable=False, unique=True
+    )
+
+    conversation = db.relationship('Conversation')
+
+    @staticmethod
+    def pair(user, other):
+        return tuple(sorted((user.id, other.id)))
+
+    @staticmethod
+    def find_conversation(low, high):
+        return Conversation.query.join(PersonalChat).filter(
+            PersonalChat.user_low_id == low,
+            PersonalChat.user_high_id == high
+        ).first()
+
+
+class Participant(db.Model):
+    __tablename__ = 'participants'
+    __table_args__ = (
+        db.Index('ix_participants_user_id_conversation_id', 'user_id', 'conversation_id'),
+    )
+
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    last_read_message_id = db.Column(db.Integer, db.ForeignKey('message.id'))
+    unread_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    conversation = db.relationship('Conversation', overlaps='participants,participates')
+    user = db.relationship('User', overlaps='participants,participates')
+
+    def mark_read(self, message_id):
+        """Move the read cursor forward to ``message_id`` and recount."""
+        if self.last_read_message_id is not None and message_id <= self.last_read_message_id:
+            return
+        self.last_read_message_id = message_id
+        self.unread_count = Message.query.filter(
+            Message.conversation_id == self.conversation_id,
+            Message.id > message_id,
+            Message.sender_id != self.user_id
+        ).count()
+
+
+# Membership rows are also written through the many-to-many relationships.
+participants = Participant.__table__
 
 
 class Conversation(db.Model):
+    PERSONAL = 'pc'
+    MULTIPERSON = 'mpc'
+    PREVIEW_LENGTH = 100
+
+    __table_args__ = (
+        db.Index('ix_conversation_updated_at_id', 'updated_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     creator_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     title = db.Column(db.String(), default=f'conversation-{creator_id}')
+    kind = db.Column(db.String(3), nullable=False, default=MULTIPERSON, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_message_id = db.Column(db.Integer, db.ForeignKey(
+        'message.id', use_alter=True, name='fk_conversation_last_message_id'
+    ))
+    last_message_preview = db.Column(db.String(PREVIEW_LENGTH))
 
     creator = db.relationship(
         'User', back_populates='conversations'
@@ -31,33 +99,180 @@ class Conversation(db.Model):
         back_populates='participates', lazy='dynamic'
     )
     messages = db.relationship(
-        'Message', back_populates='conversation', lazy='dynamic'
+        'Message', back_populates='conversation', lazy='dynamic',
+        foreign_keys='Message.conversation_id'
+    )
+    last_message = db.relationship(
+        'Message', foreign_keys=[last_message_id], post_update=True
     )
 
     def __repr__(self):
         return f'<CONV {self.title}>'
 
-    def add_user_to_mpc(self, user):
-        self.participants.append(user)
+    def participant(self, user):
+        return Participant.query.get((self.id, user.id))
 
-        db.session.add(self)
+    def add_user_to_mpc(self, user):
+        self.add_users_to_mpc([user])
+
+    def add_users_to_mpc(self, users):
+        """Add every user in ``users`` who is not a member yet, in one transaction.
+
+        Returns the ids of the users that were added.
+        """
+        db.session.add_all([self] + list(users))
+        if self.id is None or any(u.id is None for u in users):
+            db.session.flush()
+
+        ids = list(dict.fromkeys(u.id for u in users))
+        existing = {
+            user_id for user_id, in db.session.query(Participant.user_id).filter(
+                Participant.conversation_id == self.id, Participant.user_id.in_(ids)
+            )
+        } if ids else set()
+        added = [user_id for user_id in ids if user_id not in existing]
+        if added:
+            # New members start with the current history marked as read.
+            db.session.execute(participants.insert(), [
+                {'conversation_id': self.id, 'user_id': user_id,
+                 'last_read_message_id': self.last_message_id}
+                for user_id in added
+            ])
+            record_joins(self.id)
+            add_to_inboxes(self, added)
         db.session.commit()
+        return added
+
+
+class InboxEntry(db.Model):
+    """A conversation in a user's inbox, kept in step with the conversation's
+    ``updated_at`` while ``FLCHAT_INBOX_FANOUT`` is ``write``.
+
+    Listing an inbox is then a range scan of one user's entries in
+    ``ix_inbox_user_id_updated_at_conversation_id``, however many
+    conversations the user takes part in.
+    """
+    __tablename__ = 'inbox'
+
+    user_id = db.Column(
+        db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True
+    )
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), primary_key=True)
+    updated_at = db.Column(db.DateTime)
+
+    user = db.relationship('User')
+    conversation = db.relationship('Conversation')
+
+
+db.Index(
+    'ix_inbox_user_id_updated_at_conversation_id', InboxEntry.user_id,
+    InboxEntry.updated_at.desc(), InboxEntry.conversation_id.desc()
+)
+inbox = InboxEntry.__table__
+
+
+def fan_out_on_write():
+    return current_app.config['FLCHAT_INBOX_FANOUT'] == 'write'
 
 
 class Message(db.Model):
+    __table_args__ = (
+        db.Index('ix_message_conversation_id_sent_at_id', 'conversation_id', 'sent_at', 'id'),
+        # Only messages sent with a key still in use are indexed.
+        db.Index(
+            'ix_message_sender_id_client_message_id', 'sender_id', 'client_message_id',
+            unique=True,
+            postgresql_where=db.text('client_message_id IS NOT NULL'),
+            sqlite_where=db.text('client_message_id IS NOT NULL'),
+        ),
+        db.Index(
+            'ix_message_client_message_id_sent_at', 'sent_at',
+            postgresql_where=db.text('client_message_id IS NOT NULL'),
+            sqlite_where=db.text('client_message_id IS NOT NULL'),
+        ),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'))
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     sent_at = db.Column(db.DateTime, default=datetime.utcnow)
     message = db.Column(db.Text, nullable=False)
+    # Idempotency key of the sender's client, see User.send_message.
+    client_message_id = db.Column(db.String(64))
 
-    conversation = db.relationship('Conversation', back_populates='messages')
+    conversation = db.relationship(
+        'Conversation', back_populates='messages', foreign_keys=[conversation_id]
+    )
     sender = db.relationship('User', back_populates='messages')
 
     def __repr__(self):
         return f'<MSG: {self.message[:20]}>'
 
 
+class ChangeCounter(db.Model):
+    """Last entry of a user's change log, created along with the user.
+
+    Kept off the ``user`` row, which every request reads and references.
+    """
+    user_id = db.Column(
+        db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True
+    )
+    seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+
+class Change(db.Model):
+    """An entry of a user's change log, read by the ``sync`` query.
+
+    ``seq`` counts up per user without gaps, see :func:`record_changes`.
+    """
+    MESSAGE = 'message'
+    MEMBER = 'member'
+    CONTACT = 'contact'
+
+    user_id = db.Column(
+        db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True
+    )
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    kind = db.Column(db.String(8), nullable=False)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'))
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id'))
+    # The sender of a message or the contact added.
+    subject_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# Full-text index of message bodies, queried by app/search.py. The indexes
+# are maintained by the database itself, so bulk inserts stay searchable.
+# They are not mapped, migrations/env.py keeps autogenerate off them.
+SEARCH_CONFIG = 'simple'
+
+for statement in (
+    "ALTER TABLE message ADD COLUMN search_vector tsvector "
+    f"GENERATED ALWAYS AS (to_tsvector('{SEARCH_CONFIG}', message)) STORED",
+    "CREATE INDEX ix_message_search_vector ON message USING gin (search_vector)",
+):
+    event.listen(Message.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+for statement in (
+    "CREATE VIRTUAL TABLE message_fts USING fts5("
+    "message, content='message', content_rowid='id')",
+    "CREATE TRIGGER message_fts_insert AFTER INSERT ON message BEGIN "
+    "INSERT INTO message_fts (rowid, message) VALUES (new.id, new.message); END",
+    "CREATE TRIGGER message_fts_delete AFTER DELETE ON message BEGIN "
+    "INSERT INTO message_fts (message_fts, rowid, message) "
+    "VALUES ('delete', old.id, old.message); END",
+    "CREATE TRIGGER message_fts_update AFTER UPDATE OF message ON message BEGIN "
+    "INSERT INTO message_fts (message_fts, rowid, message) "
+    "VALUES ('delete', old.id, old.message); "
+    "INSERT INTO message_fts (rowid, message) VALUES (new.id, new.message); END",
+):
+    event.listen(Message.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(
+    Message.__table__, 'after_drop',
+    DDL('DROP TABLE IF EXISTS message_fts').execute_if(dialect='sqlite')
+)
+
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     phone = db.Column(db.String(16), unique=True)
@@ -104,10 +319,10 @@ class User(db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = run_blocking(generate_password_hash, password)
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return run_blocking(check_password_hash, self.password_hash, password)
 
     def is_contact(self, user):
         if user.id is None:
@@ -118,6 +333,8 @@ class User(db.Model):
         if not self.is_contact(user):
             contact = Contact(adder=self, added=user)
             db.session.add(contact)
+            db.session.flush()
+            record_changes([(self.id, Change.CONTACT, None, None, user.id)])
             db.session.commit()
 
     @property
@@ -125,26 +342,45 @@ class User(db.Model):
         return [x.added for x in self.contacts_added]
 
     def create_chat(self, pc=True):
+        kind = Conversation.PERSONAL if pc else Conversation.MULTIPERSON
+        now = datetime.utcnow()
         conversation = Conversation(
-            title=f'{"pc" if pc else "mpc"}-{self.first_name}',
+            title=f'{kind}-{self.first_name}',
+            kind=kind,
             creator=self,
-            participants=[self]
+            participants=[self],
+            created_at=now,
+            updated_at=now
         )
+        if fan_out_on_write():
+            db.session.add(InboxEntry(user=self, conversation=conversation, updated_at=now))
         return conversation
 
     def start_personal_chat(self, target):
-        conversation = Conversation.query.filter(
-            Conversation.participants.contains(self),
-            Conversation.participants.contains(target),
-            Conversation.title.startswith("pc")
-        ).first()
+        if self.id is None or target.id is None:
+            db.session.flush()
+        low, high = PersonalChat.pair(self, target)
+        conversation = PersonalChat.find_conversation(low, high)
 
         if not conversation:
             conversation = self.create_chat()
             conversation.participants.append(target)
             conversation.title += f' to {target.first_name}'
             db.session.add(conversation)
-            db.session.commit()
+            db.session.add(PersonalChat(
+                user_low_id=low, user_high_id=high, conversation=conversation
+            ))
+            try:
+                db.session.flush()
+                record_joins(conversation.id)
+                add_to_inboxes(conversation, [target.id])
+                db.session.commit()
+            except IntegrityError:
+                # Someone else started this chat first, use theirs.
+                db.session.rollback()
+                conversation = PersonalChat.find_conversation(low, high)
+                if conversation is None:
+                    raise
         return conversation
 
     def start_multiperson_chat(self, mpc_id=0, name=None, targets=None):
@@ -154,28 +390,324 @@ class User(db.Model):
             conversation = self.create_chat(pc=False)
             if name:
                 conversation.title += f' {name}'
-            if targets:
-                for target in targets:
-                    conversation.add_user_to_mpc(target)
             db.session.add(conversation)
-            db.session.commit()
+            db.session.flush()
+            record_joins(conversation.id)
+            conversation.add_users_to_mpc(targets or [])
         return conversation
 
-    def send_message(self, conv, message):
-        msg = Message(sender=self, conversation=conv, message=message)
-        conv.updated_at = datetime.utcnow()
+    def personal_chats_with(self, targets):
+        """Return ``{target id: conversation}`` for all ``targets`` at once.
+
+        Existing chats are found with one query, missing ones are started.
+        """
+        if any(u.id is None for u in [self] + list(targets)):
+            db.session.flush()
+        pairs = {PersonalChat.pair(self, target): target for target in targets}
+        chats = {}
+        if pairs:
+            existing = PersonalChat.query.options(joinedload(PersonalChat.conversation)).filter(
+                tuple_(PersonalChat.user_low_id, PersonalChat.user_high_id).in_(list(pairs))
+            )
+            for chat in existing:
+                chats[pairs[(chat.user_low_id, chat.user_high_id)].id] = chat.conversation
+        for target in pairs.values():
+            if target.id not in chats:
+                chats[target.id] = self.start_personal_chat(target)
+        return chats
+
+    def send_message(self, conv, message, client_message_id=None):
+        """Send ``message`` to ``conv``.
+
+        A ``client_message_id`` the sender used before is not sent again,
+        the message first sent with it is returned instead.
+        """
+        try:
+            return self.send_messages([(conv, message, client_message_id)])[0]
+        except IntegrityError:
+            db.session.rollback()
+            sent = self.find_sent_message(client_message_id) if client_message_id else None
+            if sent is None:
+                raise
+            return sent
+
+    def find_sent_message(self, client_message_id):
+        return Message.query.filter_by(
+            sender_id=self.id, client_message_id=client_message_id
+        ).first()
+
+    def send_messages(self, items):
+        """Send ``(conversation, text)`` pairs in a single transaction.
 
-        db.session.add(conv)
-        db.session.add(msg)
+        Items may carry the client message id as a third element.
+        """
+        messages = stage_messages([(self,) + tuple(item) for item in items])
+        events = [(msg.conversation_id, msg.id) for msg in messages]
         db.session.commit()
 
+        publish_messages(events)
+        if len(messages) > 1:
+            # Reload the expired rows together rather than one by one on access.
+            Message.query.filter(Message.id.in_([m for _, m in events])).all()
+        return messages
+
+
+def stage_messages(items):
+    """Add ``(sender, conversation, text)`` messages to the session, in order.
+
+    Items may carry the client message id as a fourth element. Conversation
+    summaries and read state are updated along, the caller commits. Returns
+    the flushed messages.
+    """
+    now = datetime.utcnow()
+    messages = [
+        Message(
+            sender=item[0], conversation=item[1], message=item[2], sent_at=now,
+            client_message_id=item[3] if len(item) > 3 else None
+        )
+        for item in items
+    ]
+    db.session.add_all(messages)
+
+    # Inbox summary, so listing chats never has to look at message rows.
+    sent = {}
+    for msg in messages:
+        conv = msg.conversation
+        conv.updated_at = now
+        conv.last_message = msg
+        conv.last_message_preview = msg.message[:Conversation.PREVIEW_LENGTH]
+        sent.setdefault(conv, []).append(msg)
+    db.session.flush()
+
+    if fan_out_on_write():
+        InboxEntry.query.filter(InboxEntry.conversation_id.in_([conv.id for conv in sent])).update(
+            {InboxEntry.updated_at: now}, synchronize_session=False
+        )
+
+    for conv, batch in sent.items():
+        senders = {msg.sender_id for msg in batch}
+        # Counters are bumped in the database, concurrent senders don't race.
+        Participant.query.filter(
+            Participant.conversation_id == conv.id,
+            Participant.user_id.notin_(senders)
+        ).update(
+            {Participant.unread_count: Participant.unread_count + len(batch)},
+            synchronize_session=False
+        )
+        for sender_id in senders:
+            # Senders have read up to their own last message.
+            last = max(i for i, msg in enumerate(batch) if msg.sender_id == sender_id)
+            unread = sum(1 for msg in batch[last + 1:] if msg.sender_id != sender_id)
+            Participant.query.filter_by(conversation_id=conv.id, user_id=sender_id).update(
+                {Participant.last_read_message_id: batch[last].id, Participant.unread_count: unread},
+                synchronize_session=False
+            )
+
+    members = defaultdict(list)
+    for conversation_id, user_id in db.session.query(
+            participants.c.conversation_id, participants.c.user_id
+    ).filter(participants.c.conversation_id.in_([conv.id for conv in sent])):
+        members[conversation_id].append(user_id)
+    record_changes([
+        (user_id, Change.MESSAGE, msg.conversation_id, msg.id, msg.sender_id)
+        for msg in messages for user_id in members[msg.conversation_id]
+    ])
+    return messages
+
+
+def record_changes(changes):
+    """Append ``(user id, kind, conversation id, message id, subject id)`` changes
+    to the users' change logs, in order. The caller commits.
+
+    Sequence numbers are taken from each user's :class:`ChangeCounter`, which
+    stays locked until the commit. Changes of a user therefore commit in the
+    order of their numbers, and a client that synced up to a number never
+    misses a change that commits later with a lower one.
+
+    A message costs one counter update and one log entry per member, and
+    concurrent sends sharing a member wait on its counter until the first
+    commits. ``benchmarks/micro.py`` measures sends to a group.
+    """
+    if not changes:
+        return
+    counts = Counter(change[0] for change in changes)
+    counters = ChangeCounter.__table__
+
+    # Locked in user order, so concurrent fan-outs to overlapping members
+    # don't deadlock.
+    seqs = dict(db.session.execute(
+        select(counters.c.user_id, counters.c.seq)
+        .where(counters.c.user_id.in_(list(counts)))
+        .order_by(counters.c.user_id)
+        .with_for_update()
+    ).fetchall())
+    by_count = defaultdict(list)
+    for user_id, count in counts.items():
+        by_count[count].append(user_id)
+    for count, user_ids in by_count.items():
+        db.session.execute(
+            counters.update().where(counters.c.user_id.in_(user_ids))
+            .values(seq=counters.c.seq + count)
+        )
+
+    now = datetime.utcnow()
+    rows = []
+    for user_id, kind, conversation_id, message_id, subject_id in changes:
+        seqs[user_id] += 1
+        rows.append({
+            'user_id': user_id, 'seq': seqs[user_id], 'kind': kind,
+            'conversation_id': conversation_id, 'message_id': message_id,
+            'subject_id': subject_id, 'created_at': now,
+        })
+    db.session.execute(Change.__table__.insert(), rows)
+
+
+def record_joins(conversation_id):
+    """Log a change of a conversation's members to each of its members.
+
+    One entry per member however many joined, clients refetch the members.
+    """
+    members = [
+        user_id for user_id, in db.session.query(participants.c.user_id)
+        .filter(participants.c.conversation_id == conversation_id)
+        .order_by(participants.c.user_id)
+    ]
+    record_changes([
+        (member, Change.MEMBER, conversation_id, None, None) for member in members
+    ])
+
+
+def add_to_inboxes(conversation, user_ids):
+    """Put ``conversation`` into the inboxes of ``user_ids`` when fanning out on write.
+
+    Users that have it already, like the creator of a chat with themselves,
+    are skipped.
+    """
+    if not user_ids or not fan_out_on_write():
+        return
+    existing = {
+        user_id for user_id, in db.session.query(inbox.c.user_id).filter(
+            inbox.c.conversation_id == conversation.id, inbox.c.user_id.in_(user_ids)
+        )
+    }
+    missing = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in existing]
+    if missing:
+        db.session.execute(inbox.insert(), [
+            {'user_id': user_id, 'conversation_id': conversation.id,
+             'updated_at': conversation.updated_at}
+            for user_id in missing
+        ])
+
+
+def rebuild_inbox():
+    """Refill the inbox table from the memberships, in one transaction.
+
+    Needed whenever ``FLCHAT_INBOX_FANOUT`` is switched to ``write``, the
+    table is not maintained otherwise. Returns the number of entries.
+    """
+    conversation = Conversation.__table__
+    db.session.execute(inbox.delete())
+    result = db.session.execute(inbox.insert().from_select(
+        ['user_id', 'conversation_id', 'updated_at'],
+        select(participants.c.user_id, participants.c.conversation_id, conversation.c.updated_at)
+        .join_from(participants, conversation, participants.c.conversation_id == conversation.c.id)
+    ))
+    db.session.commit()
+    return result.rowcount
+
+
+def publish_messages(events):
+    """Notify subscribers of committed ``(conversation id, message id)`` pairs."""
+    pubsub.publish_messages(events)
+
+
+def expire_client_message_ids(ttl, batch_size=1000):
+    """Forget the idempotency keys of messages sent more than ``ttl`` seconds ago.
+
+    Keys are cleared ``batch_size`` messages per transaction, so the cleanup
+    never holds many row locks at once. Returns the number of keys cleared.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=ttl)
+    cleared = 0
+    while True:
+        ids = [id for id, in db.session.query(Message.id).filter(
+            Message.client_message_id.isnot(None), Message.sent_at < cutoff
+        ).limit(batch_size)]
+        if ids:
+            Message.query.filter(Message.id.in_(ids)).update(
+                {Message.client_message_id: None}, synchronize_session=False
+            )
+            db.session.commit()
+            cleared += len(ids)
+        if len(ids) < batch_size:
+            return cleared
+
+
+@event.listens_for(User, 'after_insert')
+def create_change_counter(mapper, connection, target):
+    connection.execute(ChangeCounter.__table__.insert().values(user_id=target.id))
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def user_changed(mapper, connection, target):
+    identity_cache.invalidate(target.id)
+    object_session(target).info.setdefault('changed_users', set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def users_committed(session):
+    # Dropped again now that the change is visible, and in the other workers.
+    for user_id in session.info.pop('changed_users', ()):
+        identity_cache.invalidate(user_id, broadcast=True)
+
+
+@event.listens_for(Session, 'after_rollback')
+def users_rolled_back(session):
+    session.info.pop('changed_users', None)
+
 
 @jwt.user_identity_loader
 def user_identity_lookup(user):
-    return user
+    # Tokens identify users by id, emails can change.
+    return user.id if isinstance(user, User) else user
+
+
+@jwt.additional_claims_loader
+def user_claims(user):
+    if not isinstance(user, User):
+        return {}
+    return {'is_admin': bool(user.is_admin), 'is_active': bool(user.is_active)}
 
 
 @jwt.user_lookup_loader
 def user_lookup_callback(_jwt_header, jwt_data):
     identity = jwt_data["sub"]
-    return User.query.filter_by(email=identity).one_or_none()
+    if isinstance(identity, str):
+        # Tokens issued before user ids were used as the identity.
+        user = User.query.filter_by(email=identity).one_or_none()
+    else:
+        user = load_user(identity)
+    if user is None or user.is_active is False:
+        return None
+    return user
+
+
+def load_user(user_id):
+    """Return the user ``user_id`` through the identity cache."""
+    user = db.session.identity_map.get(identity_key(User, user_id))
+    if user is not None:
+        return user
+
+    snapshot = identity_cache.get(user_id)
+    if snapshot is None:
+        user = User.query.get(user_id)
+        if user is not None:
+            identity_cache.set(user_id, {
+                c.key: getattr(user, c.key) for c in User.__mapper__.column_attrs
+            })
+        return user
+
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
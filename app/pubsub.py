@@ -0,0 +1,227 @@
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+
+from flask import has_app_context
+from sqlalchemy import text
+
+from .asgi import run_blocking
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_CHANNEL = 'messages'
+INBOX_PREFIX = 'inbox.'
+# Keeps a batch of message events below the 8000 bytes NOTIFY payload limit.
+MESSAGES_PER_EVENT = 200
+
+
+def conversation_channel(conversation_id):
+    return f'conversation.{conversation_id}'
+
+
+def inbox_channel(user_id):
+    return f'{INBOX_PREFIX}{user_id}'
+
+
+class MemoryBroker:
+    """Delivers events to the subscribers of this process only.
+
+    Callbacks run on the publishing thread, i.e. the request thread or the
+    group committer, so they should hand the payload over (e.g. put it on a
+    queue) and return. Only :meth:`PubSub.dispatch_messages` reads from the
+    database there: one lookup of the subscribed members per message batch.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(list)
+
+    def subscribe(self, channel, callback):
+        with self.lock:
+            self.subscribers[channel].append(callback)
+
+        def unsubscribe():
+            with self.lock:
+                callbacks = self.subscribers.get(channel, [])
+                if callback in callbacks:
+                    callbacks.remove(callback)
+                if not callbacks:
+                    self.subscribers.pop(channel, None)
+
+        return unsubscribe
+
+    def channels(self):
+        with self.lock:
+            return list(self.subscribers)
+
+    def publish(self, channel, payload):
+        self.dispatch(channel, payload)
+
+    def dispatch(self, channel, payload):
+        with self.lock:
+            callbacks = list(self.subscribers.get(channel, ()))
+        for callback in callbacks:
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception('subscriber of %s failed', channel)
+
+
+class PostgresBroker(MemoryBroker):
+    """Relays events between processes through Postgres ``LISTEN/NOTIFY``.
+
+    Every process keeps one dedicated listening connection, opened on the
+    first subscription, and dispatches the notifications it receives to its
+    local subscribers. Publishing never delivers locally on its own, the
+    notification comes back through the listener like any other.
+    """
+
+    notify_channel = 'flchat_events'
+    poll_interval = 5
+    retry_interval = 5
+
+    def __init__(self, app):
+        super(PostgresBroker, self).__init__()
+        self.app = app
+        self.listener = None
+
+    @property
+    def engine(self):
+        from . import db
+        with self.app.app_context():
+            return db.engine
+
+    def subscribe(self, channel, callback):
+        self.start_listener()
+        return super(PostgresBroker, self).subscribe(channel, callback)
+
+    def publish(self, channel, payload):
+        # Notifies through the synchronous engine, off the event loop under ASGI.
+        run_blocking(self.notify, json.dumps({'channel': channel, 'payload': payload}))
+
+    def notify(self, message):
+        with self.engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT').execute(
+                text('SELECT pg_notify(:channel, :message)'),
+                channel=self.notify_channel, message=message
+            )
+
+    def start_listener(self):
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(
+                    target=self.listen, name='flchat-pubsub', daemon=True
+                )
+                self.listener.start()
+
+    def listen(self):
+        while True:
+            try:
+                self.listen_once()
+            except Exception:
+                logger.exception('pubsub listener failed, reconnecting')
+                time.sleep(self.retry_interval)
+
+    def listen_once(self):
+        raw = self.engine.raw_connection()
+        raw.detach()
+        connection = raw.connection
+        connection.set_isolation_level(0)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {self.notify_channel}')
+            while True:
+                if select.select([connection], [], [], self.poll_interval) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    notify = connection.notifies.pop(0)
+                    event = json.loads(notify.payload)
+                    self.dispatch(event['channel'], event['payload'])
+        finally:
+            connection.close()
+
+
+class PubSub:
+    """Pub/sub of the app on top of a broker.
+
+    New messages travel as one event per batch on ``MESSAGES_CHANNEL``,
+    the receiving process fans them out to its local conversation and
+    inbox subscribers, looking up only the members subscribed there. The
+    lookup runs on the broker's dispatching thread, which is the publishing
+    one with the memory broker.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.broker = None
+        self.lock = threading.Lock()
+        self.fanning_out = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.fanning_out = False
+        if app.config['FLCHAT_PUBSUB_BROKER'] == 'postgres':
+            self.broker = PostgresBroker(app)
+        else:
+            self.broker = MemoryBroker()
+
+    def subscribe(self, channel, callback):
+        if channel != MESSAGES_CHANNEL:
+            self.fan_out_messages()
+        return self.broker.subscribe(channel, callback)
+
+    def fan_out_messages(self):
+        with self.lock:
+            if self.fanning_out:
+                return
+            self.fanning_out = True
+        self.broker.subscribe(MESSAGES_CHANNEL, self.dispatch_messages)
+
+    def publish_messages(self, events):
+        """Notify subscribers of committed ``(conversation id, message id)`` pairs."""
+        for start in range(0, len(events), MESSAGES_PER_EVENT):
+            self.publish(MESSAGES_CHANNEL, {'messages': events[start:start + MESSAGES_PER_EVENT]})
+
+    def dispatch_messages(self, payload):
+        events = payload['messages']
+        for conversation_id, message_id in events:
+            self.broker.dispatch(conversation_channel(conversation_id), {'message_id': message_id})
+
+        users = [
+            int(channel[len(INBOX_PREFIX):])
+            for channel in self.broker.channels() if channel.startswith(INBOX_PREFIX)
+        ]
+        if not users:
+            return
+        for conversation_id, user_id in self.members({c for c, _ in events}, users):
+            self.broker.dispatch(inbox_channel(user_id), {'conversation_id': conversation_id})
+
+    def members(self, conversation_ids, user_ids):
+        from . import db
+        from .models import participants
+
+        def query():
+            return db.session.query(participants.c.conversation_id, participants.c.user_id).filter(
+                participants.c.conversation_id.in_(conversation_ids),
+                participants.c.user_id.in_(user_ids)
+            ).all()
+
+        if has_app_context():
+            return query()
+        # The Postgres listener thread runs outside of any request.
+        with self.app.app_context():
+            return query()
+
+    def publish(self, channel, payload):
+        # Events are published after the data is committed, a broker outage
+        # must not turn an already stored message into a failed request.
+        try:
+            self.broker.publish(channel, payload)
+        except Exception:
+            logger.exception('could not publish to %s', channel)
@@ -0,0 +1,149 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PRUNE_INTERVAL = 1000
+
+
+def refill(tokens, stamp, now, rate, burst):
+    """Take a token from a bucket last seen at ``stamp`` with ``tokens`` left.
+
+    Returns the tokens left, the time the bucket is full again and how many
+    seconds to wait before a token is available, 0 when one was taken.
+    """
+    if tokens is None:
+        tokens = burst
+    else:
+        tokens = min(burst, tokens + (now - stamp) * rate)
+    if tokens >= 1:
+        tokens -= 1
+        retry_after = 0
+    else:
+        retry_after = (1 - tokens) / rate
+    return tokens, now + (burst - tokens) / rate, retry_after
+
+
+class MemoryStore:
+    """Buckets of this process only, for development and tests."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.takes = 0
+
+    def take(self, key, rate, burst, now):
+        with self.lock:
+            tokens, stamp, _ = self.buckets.get(key, (None, now, None))
+            tokens, full_at, retry_after = refill(tokens, stamp, now, rate, burst)
+            self.buckets[key] = (tokens, now, full_at)
+
+            self.takes += 1
+            if self.takes % PRUNE_INTERVAL == 0:
+                # A full bucket behaves like a missing one.
+                self.buckets = {k: v for k, v in self.buckets.items() if v[2] > now}
+            return retry_after
+
+
+class SQLiteStore:
+    """Buckets in a SQLite file, shared by all workers on the host.
+
+    Every take is one ``BEGIN IMMEDIATE`` transaction, which serializes the
+    workers on the file's write lock for the few microseconds it lasts.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.takes = 0
+        # Not kept for later: the app may be created before the workers fork.
+        connection = sqlite3.connect(path, timeout=5, isolation_level=None)
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS buckets ('
+                'key TEXT PRIMARY KEY, tokens REAL NOT NULL, '
+                'stamp REAL NOT NULL, full_at REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_buckets_full_at ON buckets (full_at)')
+        finally:
+            connection.close()
+
+    def connect(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def take(self, key, rate, burst, now):
+        connection = self.connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                'SELECT tokens, stamp FROM buckets WHERE key = ?', (key,)
+            ).fetchone()
+            tokens, stamp = row if row else (None, now)
+            tokens, full_at, retry_after = refill(tokens, stamp, now, rate, burst)
+            connection.execute(
+                'INSERT OR REPLACE INTO buckets (key, tokens, stamp, full_at) VALUES (?, ?, ?, ?)',
+                (key, tokens, now, full_at)
+            )
+
+            self.takes += 1
+            if self.takes % PRUNE_INTERVAL == 0:
+                connection.execute('DELETE FROM buckets WHERE full_at < ?', (now,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return retry_after
+
+
+class RateLimiter:
+    """Token buckets per operation and client.
+
+    ``FLCHAT_RATE_LIMITS`` maps operations to ``(requests, seconds)``: a
+    client may burst up to ``requests`` calls, refilled at ``requests`` per
+    ``seconds``. ``FLCHAT_RATE_LIMIT_STORE`` is ``memory`` or the path of a
+    SQLite file, which all gunicorn workers on the host share. Nothing is
+    limited with ``FLCHAT_RATE_LIMITS_ENABLED`` off.
+    """
+
+    def __init__(self, app=None):
+        self.limits = {}
+        self.store = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.limits = dict(app.config['FLCHAT_RATE_LIMITS']) \
+            if app.config['FLCHAT_RATE_LIMITS_ENABLED'] else {}
+        store = app.config['FLCHAT_RATE_LIMIT_STORE']
+        if store == 'memory':
+            self.store = MemoryStore()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(store)), exist_ok=True)
+            self.store = SQLiteStore(store)
+
+    def hit(self, operation, client):
+        """Count a call of ``operation`` by ``client``.
+
+        Returns 0 if the call is allowed, otherwise the seconds until it
+        would be. Calls are let through should the store fail.
+        """
+        limit = self.limits.get(operation)
+        if not limit:
+            return 0
+        requests, seconds = limit
+        try:
+            return self.store.take(
+                f'{operation}:{client}', requests / seconds, requests, time.time()
+            )
+        except sqlite3.Error:
+            logger.exception('rate limit store failed, letting %s through', operation)
+            return 0
@@ -0,0 +1,88 @@
+"""Full-text search over the messages a user can read.
+
+Postgres matches against the generated ``message.search_vector`` column
+(GIN indexed), SQLite against the ``message_fts`` FTS5 table. Both are set
+up in :mod:`app.models` and by the migrations.
+
+Hits are ordered by ``score`` (lower is better) and then message id, so a
+``(score, id)`` pair is a stable keyset cursor.
+"""
+import re
+from collections import namedtuple
+
+from sqlalchemy import and_, func, literal_column, tuple_
+from sqlalchemy.sql import column, table
+
+from . import db
+from .models import Message, participants, SEARCH_CONFIG
+
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_STOP = '</mark>'
+
+SearchHit = namedtuple('SearchHit', 'message score highlight')
+
+TERM = re.compile(r'\w+', re.UNICODE)
+
+
+def search_terms(text):
+    """Split user input into plain words, operators are never interpreted."""
+    return TERM.findall(text or '')
+
+
+def postgres_match(terms):
+    vector = literal_column('message.search_vector')
+    query = func.plainto_tsquery(SEARCH_CONFIG, ' '.join(terms))
+    score = -func.ts_rank_cd(vector, query)
+    highlight = func.ts_headline(
+        SEARCH_CONFIG, Message.message, query,
+        f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, HighlightAll=true'
+    )
+    return db.session.query(Message, score, highlight).filter(vector.op('@@')(query)), score
+
+
+def sqlite_match(terms):
+    fts = table('message_fts', column('rowid'))
+    index = literal_column('message_fts')
+    score = func.bm25(index)
+    highlight = func.highlight(index, 0, HIGHLIGHT_START, HIGHLIGHT_STOP)
+    query = db.session.query(Message, score, highlight) \
+        .join(fts, fts.c.rowid == Message.id) \
+        .filter(index.op('MATCH')(' '.join(f'"{t}"' for t in terms)))
+    return query, score
+
+
+BACKENDS = {
+    'postgresql': postgres_match,
+    'sqlite': sqlite_match,
+}
+
+
+def search_available():
+    return db.engine.dialect.name in BACKENDS
+
+
+def search_messages(user_id, text, size, after=None, conversation_id=None):
+    """Return up to ``size + 1`` hits for ``text`` in the chats of ``user_id``.
+
+    ``after`` is the ``(score, id)`` of the last hit of the previous page.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return []
+
+    match = BACKENDS.get(db.engine.dialect.name)
+    if match is None:
+        raise NotImplementedError('full-text search is not available on this database')
+    query, score = match(terms)
+
+    query = query.join(participants, and_(
+        participants.c.conversation_id == Message.conversation_id,
+        participants.c.user_id == user_id
+    ))
+    if conversation_id is not None:
+        query = query.filter(Message.conversation_id == conversation_id)
+    if after is not None:
+        query = query.filter(tuple_(score, Message.id) > tuple_(*after))
+
+    query = query.order_by(score, Message.id).limit(size + 1)
+    return [SearchHit(*row) for row in query]
@@ -0,0 +1,233 @@
+"""Bulk generation of synthetic users, contacts, chats and messages.
+
+Rows are generated in dependency order and written in batches straight to
+the tables, with ``COPY`` on Postgres and ``executemany`` elsewhere; the
+ORM and its per-object commits are bypassed entirely. Every user shares a
+single precomputed password hash.
+
+Contacts per user and messages per chat follow a Pareto distribution with
+the configured mean, so a few users and chats are far busier than the
+rest. Personal chats are started for a share of the contact pairs, groups
+draw their members uniformly.
+"""
+import csv
+import io
+import random
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+from werkzeug.security import generate_password_hash
+
+from .models import Contact, Conversation, Message, PersonalChat, User, participants
+
+SeedSpec = namedtuple('SeedSpec', [
+    'users', 'contacts', 'personal_chats', 'groups', 'group_size',
+    'messages', 'max_messages', 'skew', 'days', 'password',
+])
+
+WORDS = (
+    'hello hi hey morning evening tonight tomorrow meeting lunch coffee call '
+    'later soon thanks sure okay project deadline report review deploy release '
+    'weekend holiday trip photo link doc update question answer idea plan'
+).split()
+
+COLUMNS = OrderedDict([
+    (User.__table__, ('id', 'email', 'first_name', 'is_active', 'is_admin', 'created_at', 'password_hash')),
+    (Contact.__table__, ('adder_id', 'added_id', 'added_at')),
+    (Conversation.__table__, ('id', 'creator_id', 'title', 'kind', 'created_at', 'updated_at')),
+    (PersonalChat.__table__, ('user_low_id', 'user_high_id', 'conversation_id')),
+    (Message.__table__, ('id', 'conversation_id', 'sender_id', 'sent_at', 'message')),
+    (participants, ('conversation_id', 'user_id', 'last_read_message_id', 'unread_count')),
+])
+
+
+def skewed(rng, mean, alpha, cap):
+    """A Pareto distributed count with mean about ``mean``, at most ``cap``."""
+    if mean <= 0 or cap <= 0:
+        return 0
+    scale = mean * (alpha - 1) / alpha
+    return min(cap, int(round(scale * rng.paretovariate(alpha))))
+
+
+class BulkLoader:
+    """Buffer rows per table and write them in foreign key order."""
+
+    def __init__(self, connection, batch_size):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.copy = connection.dialect.name == 'postgresql'
+        self.pending = OrderedDict((table, []) for table in COLUMNS)
+        self.counts = OrderedDict((table.name, 0) for table in COLUMNS)
+
+    def add(self, table, row):
+        rows = self.pending[table]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # Flushing every table at once keeps referenced rows ahead of the
+        # rows referencing them.
+        for table, rows in self.pending.items():
+            if rows:
+                self.write(table, COLUMNS[table], rows)
+                self.counts[table.name] += len(rows)
+                rows.clear()
+
+    def write(self, table, columns, rows):
+        if not self.copy:
+            self.connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+            return
+
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        preparer = self.connection.dialect.identifier_preparer
+        statement = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+            preparer.format_table(table), ', '.join(preparer.quote(c) for c in columns)
+        )
+        cursor = self.connection.connection.cursor()
+        try:
+            cursor.copy_expert(statement, buffer)
+        finally:
+            cursor.close()
+
+
+class Seeder:
+    def __init__(self, connection, spec, rng=None, batch_size=10000):
+        self.spec = spec
+        self.rng = rng or random.Random()
+        self.loader = BulkLoader(connection, batch_size)
+        self.connection = connection
+        self.now = datetime.utcnow()
+        self.start = self.now - timedelta(days=spec.days)
+        self.password_hash = generate_password_hash(spec.password)
+
+        def next_id(table):
+            return (connection.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+
+        self.first_user_id = next_id(User.__table__)
+        self.first_conversation_id = self.next_conversation_id = next_id(Conversation.__table__)
+        self.next_message_id = next_id(Message.__table__)
+
+    def run(self):
+        self.seed_users()
+        self.seed_contacts()
+        self.seed_groups()
+        self.loader.flush()
+        self.update_summaries()
+        if self.connection.dialect.name == 'postgresql':
+            self.reset_sequences()
+        return self.loader.counts
+
+    def user_id(self, index):
+        return self.first_user_id + index
+
+    def random_time(self, after):
+        return after + (self.now - after) * self.rng.random()
+
+    def seed_users(self):
+        for i in range(self.spec.users):
+            user_id = self.user_id(i)
+            self.loader.add(User.__table__, (
+                user_id, f'seed{user_id}@flchat.test', f'seed{user_id}',
+                True, False, self.random_time(self.start), self.password_hash,
+            ))
+
+    def seed_contacts(self):
+        count = self.spec.users
+        for i in range(count):
+            k = skewed(self.rng, self.spec.contacts, self.spec.skew, count - 1)
+            others = [j for j in self.rng.sample(range(count), min(count, k + 1)) if j != i][:k]
+            for j in others:
+                self.loader.add(Contact.__table__, (
+                    self.user_id(i), self.user_id(j), self.random_time(self.start)
+                ))
+                # Only the lower id of a pair starts the chat, so every pair
+                # is considered once however many sides added each other.
+                if i < j and self.rng.random() < self.spec.personal_chats:
+                    self.seed_conversation(Conversation.PERSONAL, [i, j])
+
+    def seed_groups(self):
+        low, high = self.spec.group_size
+        for n in range(self.spec.groups):
+            size = min(self.spec.users, self.rng.randint(low, high))
+            if size < 2:
+                continue
+            members = self.rng.sample(range(self.spec.users), size)
+            self.seed_conversation(Conversation.MULTIPERSON, members, n)
+
+    def seed_conversation(self, kind, members, n=None):
+        conversation_id = self.next_conversation_id
+        self.next_conversation_id += 1
+        member_ids = [self.user_id(m) for m in members]
+        creator = member_ids[0]
+        if kind == Conversation.PERSONAL:
+            title = f'pc-seed{creator} to seed{member_ids[1]}'
+        else:
+            title = f'mpc-seed{creator} group{n}'
+        created_at = self.random_time(self.start)
+        self.loader.add(Conversation.__table__, (
+            conversation_id, creator, title, kind, created_at, created_at
+        ))
+        if kind == Conversation.PERSONAL:
+            self.loader.add(PersonalChat.__table__, (
+                min(member_ids), max(member_ids), conversation_id
+            ))
+
+        # Every member has read up to the last message they sent.
+        count = skewed(self.rng, self.spec.messages, self.spec.skew, self.spec.max_messages)
+        times = sorted(self.random_time(created_at) for _ in range(count))
+        last_sent = {}
+        for position, sent_at in enumerate(times):
+            sender = self.rng.choice(member_ids)
+            last_sent[sender] = (position, self.next_message_id)
+            self.loader.add(Message.__table__, (
+                self.next_message_id, conversation_id, sender, sent_at, self.text()
+            ))
+            self.next_message_id += 1
+
+        for user_id in member_ids:
+            position, message_id = last_sent.get(user_id, (-1, None))
+            self.loader.add(participants, (
+                conversation_id, user_id, message_id, count - position - 1
+            ))
+
+    def text(self):
+        return ' '.join(self.rng.choices(WORDS, k=self.rng.randint(2, 20)))
+
+    def update_summaries(self):
+        """Point the seeded conversations at their last message."""
+        conversation, message = Conversation.__table__, Message.__table__
+        seeded = conversation.c.id >= self.first_conversation_id
+        self.connection.execute(conversation.update().where(seeded).values(
+            last_message_id=select(func.max(message.c.id))
+            .where(message.c.conversation_id == conversation.c.id)
+            .scalar_subquery()
+        ))
+        last = message.c.id == conversation.c.last_message_id
+        self.connection.execute(
+            conversation.update()
+            .where(seeded, conversation.c.last_message_id.isnot(None))
+            .values(
+                updated_at=select(message.c.sent_at).where(last).scalar_subquery(),
+                last_message_preview=select(
+                    func.substr(message.c.message, 1, Conversation.PREVIEW_LENGTH)
+                ).where(last).scalar_subquery(),
+            )
+        )
+
+    def reset_sequences(self):
+        # COPY bypasses the id sequences, move them past the seeded ids.
+        for table in (User.__table__, Conversation.__table__, Message.__table__):
+            name = self.connection.dialect.identifier_preparer.format_table(table)
+            self.connection.exec_driver_sql(
+                f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), "
+                f"(SELECT max(id) FROM {name}))"
+            )
+
+
+def seed(connection, spec, random_seed=None, batch_size=10000):
+    """Generate data as described by ``spec``; returns the rows written per table."""
+    return Seeder(connection, spec, random.Random(random_seed), batch_size).run()
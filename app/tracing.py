@@ -0,0 +1,250 @@
+"""Per-request traces of GraphQL operations.
+
+A trace holds a span per resolver with the SQL statements it ran, their
+redacted parameters, timings and the row counts reported by the driver.
+Statements belong to the resolver that started last: lazy loads run while
+graphql completes the value a resolver returned, after the resolver itself.
+Statements run before the first resolver stay on the trace.
+
+A statement repeated ``FLCHAT_N_PLUS_ONE_THRESHOLD`` times in one
+operation is reported as an N+1, with the resolvers that issued it.
+
+``FLCHAT_TRACE_MODE`` selects what is traced:
+
+``off``
+    nothing, only slow operations are logged with their duration.
+``sample``
+    a ``FLCHAT_TRACE_SAMPLE_RATE`` fraction of the operations.
+``debug``
+    every operation; the trace is returned in the ``trace`` response
+    extension.
+
+Operations slower than ``FLCHAT_SLOW_REQUEST_MS`` are written, with their
+trace if they have one, as JSON lines to the rotating ``FLCHAT_SLOW_LOG``.
+"""
+import json
+import logging
+import random
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+from flask import current_app
+
+from .instrumentation import Operation, after_statement, before_statement, is_composite, resolve, state
+
+TRACE_MODES = ('off', 'sample', 'debug')
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 3)
+
+
+def redact(parameters):
+    """Replace every parameter value by the name of its type."""
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    return type(parameters).__name__
+
+
+class Span:
+    __slots__ = ('field', 'path', 'start', 'end', 'statements', 'error', 'composite')
+
+    def __init__(self, field, path, start, composite):
+        self.field = field
+        self.path = path
+        self.start = start
+        self.end = None
+        self.statements = []
+        self.error = None
+        self.composite = composite
+
+
+class Trace:
+    def __init__(self, operation):
+        self.operation = operation
+        self.start = time.perf_counter()
+        self.end = None
+        self.spans = []
+        self.statements = []
+        self.current = None
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def add_statement(self, statement, parameters, executemany):
+        record = {
+            'statement': statement,
+            'parameters': None if executemany else redact(parameters),
+            'executemany': len(parameters) if executemany else None,
+            'startMs': milliseconds(time.perf_counter() - self.start),
+            'durationMs': None,
+            'rows': None,
+        }
+        span = self.current
+        (span.statements if span else self.statements).append(record)
+        return record
+
+    def n_plus_one(self, threshold):
+        counts = OrderedDict()
+        for span, record in self.all_statements():
+            entry = counts.setdefault(record['statement'], {'count': 0, 'resolvers': []})
+            entry['count'] += 1
+            if span is not None and span.field not in entry['resolvers']:
+                entry['resolvers'].append(span.field)
+        return [
+            dict(statement=statement, **entry)
+            for statement, entry in counts.items()
+            if entry['count'] >= threshold
+        ]
+
+    def all_statements(self):
+        for record in self.statements:
+            yield None, record
+        for span in self.spans:
+            for record in span.statements:
+                yield span, record
+
+    def to_dict(self, n_plus_one_threshold):
+        spans = sorted(
+            (s for s in self.spans if s.composite or s.statements or s.error),
+            key=lambda s: s.start
+        )
+        return {
+            'operation': self.operation,
+            'durationMs': milliseconds(self.duration),
+            'resolvers': [{
+                'path': span.path,
+                'field': span.field,
+                'startMs': milliseconds(span.start - self.start),
+                'durationMs': milliseconds((span.end or self.end) - span.start),
+                'error': span.error,
+                'sql': span.statements,
+            } for span in spans],
+            'sql': self.statements,
+            'nPlusOne': self.n_plus_one(n_plus_one_threshold),
+        }
+
+
+def start_statement(conn, cursor, statement, parameters, executemany):
+    trace = getattr(state, 'trace', None)
+    if trace is None:
+        return
+    conn.info.setdefault('flchat_trace', []).append(
+        (trace.add_statement(statement, parameters, executemany), time.perf_counter())
+    )
+
+
+def end_statement(conn, cursor, statement, parameters, executemany):
+    pending = conn.info.get('flchat_trace')
+    if not pending:
+        return
+    record, start = pending.pop()
+    record['durationMs'] = milliseconds(time.perf_counter() - start)
+    record['rows'] = cursor.rowcount if cursor.rowcount >= 0 else None
+
+
+before_statement.append(start_statement)
+after_statement.append(end_statement)
+
+
+class TracingMiddleware:
+    def resolve(self, next, root, info, **args):
+        trace = getattr(state, 'trace', None)
+        if trace is None:
+            return next(root, info, **args)
+
+        span = Span(
+            f'{info.parent_type.name}.{info.field_name}',
+            '.'.join(str(p) for p in info.path),
+            time.perf_counter(),
+            is_composite(info),
+        )
+        trace.spans.append(span)
+        trace.current = span
+
+        def finish(error):
+            span.end = time.perf_counter()
+            if error is not None:
+                span.error = str(error)
+
+        return resolve(next, root, info, args, finish)
+
+
+class Tracer:
+    def __init__(self, app=None):
+        self.middleware = TracingMiddleware()
+        self.logger = logging.getLogger('flchat.slow')
+        self.logger.propagate = False
+        self.handlers = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config['FLCHAT_TRACE_MODE'] not in TRACE_MODES:
+            raise ValueError(f"unknown FLCHAT_TRACE_MODE {app.config['FLCHAT_TRACE_MODE']}")
+        app.extensions['tracing'] = self
+
+    def sampled(self, config):
+        mode = config['FLCHAT_TRACE_MODE']
+        if mode == 'debug':
+            return True
+        return mode == 'sample' and random.random() < config['FLCHAT_TRACE_SAMPLE_RATE']
+
+    @contextmanager
+    def operation(self, name):
+        """Trace the operation executed in the block if it is sampled.
+
+        The block hands the ``ExecutionResult`` over by setting ``result``
+        on the yielded object.
+        """
+        config = current_app.config
+        if getattr(state, 'trace', None) is not None:
+            yield Operation()
+            return
+
+        operation = Operation()
+        trace = Trace(name)
+        traced = self.sampled(config)
+        if traced:
+            state.trace = trace
+        try:
+            yield operation
+        finally:
+            state.trace = None
+            trace.end = time.perf_counter()
+            self.finish(config, trace, operation.result, traced)
+
+    def finish(self, config, trace, result, traced):
+        threshold = config['FLCHAT_N_PLUS_ONE_THRESHOLD']
+        data = trace.to_dict(threshold) if traced else None
+        if data is not None and config['FLCHAT_TRACE_MODE'] == 'debug':
+            extensions = getattr(result, 'extensions', None)
+            if isinstance(extensions, dict):
+                extensions['trace'] = data
+
+        slow = config['FLCHAT_SLOW_REQUEST_MS']
+        if slow is not None and config['FLCHAT_SLOW_LOG'] and trace.duration * 1000 >= slow:
+            self.log_slow(config, data or {
+                'operation': trace.operation,
+                'durationMs': milliseconds(trace.duration),
+            })
+
+    def log_slow(self, config, data):
+        path = config['FLCHAT_SLOW_LOG']
+        handler = self.handlers.get(path)
+        if handler is None:
+            handler = RotatingFileHandler(
+                path, maxBytes=config['FLCHAT_SLOW_LOG_MAX_BYTES'],
+                backupCount=config['FLCHAT_SLOW_LOG_BACKUPS'], delay=True
+            )
+            self.handlers[path] = handler
+        record = self.logger.makeRecord(
+            self.logger.name, logging.WARNING, __file__, 0,
+            json.dumps(data, default=str), None, None
+        )
+        handler.handle(record)
@@ -0,0 +1,46 @@
+"""Compare two benchmark result files and flag regressions::
+
+    python -m benchmarks.compare baseline.json current.json --threshold 10
+
+Exits with status 1 when a benchmark's ``--metric`` grew by more than
+``--threshold`` percent, or shrank by more for ``throughput``.
+"""
+import argparse
+import json
+import sys
+
+
+def compare(baseline, current, metric='p50', threshold=10.0):
+    """Yield ``(name, before, after, change in percent, regressed)`` per benchmark."""
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name, {}).get(metric)
+        after = result.get(metric)
+        if before is None or after is None:
+            continue
+        change = (after - before) / before * 100 if before else 0.0
+        regressed = -change > threshold if metric == 'throughput' else change > threshold
+        yield name, before, after, change, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('baseline', type=argparse.FileType('r'))
+    parser.add_argument('current', type=argparse.FileType('r'))
+    parser.add_argument('--metric', default='p50', help='summary field to compare, e.g. p95')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed growth in percent')
+    args = parser.parse_args(argv)
+
+    baseline, current = json.load(args.baseline), json.load(args.current)
+    if baseline['kind'] != current['kind']:
+        parser.error(f"cannot compare {baseline['kind']} with {current['kind']} results")
+
+    regressions = 0
+    for name, before, after, change, regressed in compare(baseline, current, args.metric, args.threshold):
+        regressions += regressed
+        flag = '  REGRESSION' if regressed else ''
+        print(f'{name:50} {before:10.3f} {after:10.3f} {change:+8.1f}%{flag}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Throughput of sendMessage with and without group commit.
+
+``--threads`` senders, like the threads of one gunicorn worker, each send
+``--messages`` messages to their own personal chat, once committing every
+message on its own and once through the group committer::
+
+    python -m benchmarks.group_commit --database postgresql://... -o group_commit.json
+
+The database defaults to a temporary SQLite file; the gain is largest on
+databases that sync their log to disk on every commit.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from app import create_app, db, group_committer
+from app.models import User
+from .results import summarize, write_results
+
+
+def populate(threads):
+    users = [
+        User(email=f'sender{i}@bench.test', password_hash='-', first_name=f'sender{i}')
+        for i in range(2 * threads)
+    ]
+    db.session.add_all(users)
+    db.session.commit()
+    return [
+        (users[2 * i].id, users[2 * i].start_personal_chat(users[2 * i + 1]).id)
+        for i in range(threads)
+    ]
+
+
+def sender(app, user_id, conversation_id, messages, samples, lock, barrier):
+    from app.models import Conversation
+    with app.app_context():
+        user = User.query.get(user_id)
+        conversation = Conversation.query.get(conversation_id)
+        db.session.commit()
+        barrier.wait()
+        own = []
+        for i in range(messages):
+            start = time.perf_counter()
+            group_committer.send_message(user, conversation, f'message {i}')
+            own.append(time.perf_counter() - start)
+        with lock:
+            samples.extend(own)
+
+
+def run_mode(app, chats, messages, enabled):
+    app.config['FLCHAT_GROUP_COMMIT'] = group_committer.enabled = enabled
+    samples, lock = [], threading.Lock()
+    barrier = threading.Barrier(len(chats) + 1)
+    threads = [
+        threading.Thread(
+            target=sender,
+            args=(app, user_id, conversation_id, messages, samples, lock, barrier)
+        )
+        for user_id, conversation_id in chats
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return summarize(samples, time.perf_counter() - start)
+
+
+def run(threads, messages, database=None):
+    path = None
+    if database is None:
+        fd, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        database = f'sqlite:///{path}'
+
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database
+    try:
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            chats = populate(threads)
+            results = {
+                'direct': run_mode(app, chats, messages, False),
+                'group_commit': run_mode(app, chats, messages, True),
+            }
+            db.session.remove()
+            db.drop_all()
+    finally:
+        group_committer.enabled = False
+        if path:
+            os.unlink(path)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--threads', type=int, default=16, help='concurrent senders')
+    parser.add_argument('--messages', type=int, default=200, help='messages per sender')
+    parser.add_argument('--database', default=None, help='SQLAlchemy database URL')
+    parser.add_argument('-o', '--output', default='-', help='JSON result file')
+    args = parser.parse_args(argv)
+
+    results = run(args.threads, args.messages, args.database)
+    write_results(
+        args.output, 'group_commit', results,
+        threads=args.threads, messages=args.messages,
+        database=(args.database or 'sqlite').split('://')[0]
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""HTTP load generator for a running FLChat server.
+
+Registers ``--users`` accounts (once, they are reused by later runs), then
+``--concurrency`` clients send a weighted mix of logins, sendMessage
+mutations and inbox reads to ``/api/graphql`` for ``--duration`` seconds::
+
+    python -m benchmarks.load --url http://localhost:8000 --duration 60 \\
+        --mix login=1,sendMessage=4,inbox=5 -o load.json
+
+Latency percentiles and throughput are reported per operation and overall.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from .results import summarize, write_results
+
+PASSWORD = 'benchmark-password'
+
+REGISTER = '''mutation Register($email: String, $password: String) {
+  register(email: $email, password: $password, passwordConfirm: $password, firstName: "bench") {
+    success
+  }
+}'''
+LOGIN = '''mutation Login($email: String, $password: String) {
+  login(email: $email, password: $password) { accessToken }
+}'''
+SEND_MESSAGE = '''mutation SendMessage($destination: String, $message: String) {
+  sendMessage(destination: $destination, message: $message) { conversation { id } }
+}'''
+INBOX = '''query Inbox {
+  myInbox(first: 20) {
+    edges { node { id title unreadCount lastMessage { message sentAt } } }
+  }
+}'''
+
+
+class GraphQLClient:
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip('/') + '/api/graphql'
+        self.timeout = timeout
+
+    def execute(self, query, variables=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = 'Bearer ' + token
+        request = urllib.request.Request(
+            self.url, json.dumps({'query': query, 'variables': variables or {}}).encode(),
+            headers
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return {'errors': [{'message': f'HTTP {e.code}'}]}
+
+
+class VirtualUser:
+    def __init__(self, client, email, peers):
+        self.client = client
+        self.email = email
+        self.peers = peers
+        self.token = None
+
+    def login(self):
+        response = self.client.execute(LOGIN, {'email': self.email, 'password': PASSWORD})
+        self.token = ((response.get('data') or {}).get('login') or {}).get('accessToken')
+        return response
+
+    def send_message(self):
+        return self.client.execute(SEND_MESSAGE, {
+            'destination': random.choice(self.peers),
+            'message': f'load test message from {self.email}',
+        }, self.token)
+
+    def inbox(self):
+        return self.client.execute(INBOX, token=self.token)
+
+
+OPERATIONS = {
+    'login': VirtualUser.login,
+    'sendMessage': VirtualUser.send_message,
+    'inbox': VirtualUser.inbox,
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f'unknown operation {name}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def prepare(client, count, prefix):
+    emails = [f'{prefix}{i}@bench.test' for i in range(count)]
+    users = []
+    for i, email in enumerate(emails):
+        client.execute(REGISTER, {'email': email, 'password': PASSWORD})
+        # A handful of steady peers, like a real contact list.
+        peers = [emails[(i + k) % count] for k in range(1, min(count, 6))]
+        user = VirtualUser(client, email, peers or [email])
+        response = user.login()
+        if 'errors' in response:
+            raise SystemExit(
+                f"cannot log in as {email}: {response['errors'][0]['message']}"
+                ' (run the server with FLCHAT_RATE_LIMITS_ENABLED=0)'
+            )
+        users.append(user)
+    return users
+
+
+def worker(users, mix, deadline, samples, errors, lock):
+    names, weights = list(mix), list(mix.values())
+    user = random.choice(users)
+    while time.monotonic() < deadline:
+        name = random.choices(names, weights)[0]
+        start = time.perf_counter()
+        response = OPERATIONS[name](user)
+        elapsed = time.perf_counter() - start
+        with lock:
+            samples[name].append(elapsed)
+            if 'errors' in response:
+                errors[name] += 1
+        if name == 'login':
+            user = random.choice(users)
+
+
+def run(url, users, concurrency, duration, mix, prefix='load'):
+    client = GraphQLClient(url)
+    virtual_users = prepare(client, users, prefix)
+
+    samples = {name: [] for name in mix}
+    errors = {name: 0 for name in mix}
+    lock = threading.Lock()
+    start = time.monotonic()
+    threads = [
+        threading.Thread(
+            target=worker,
+            args=(virtual_users, mix, start + duration, samples, errors, lock),
+            daemon=True
+        )
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    results = {}
+    for name in mix:
+        results[name] = dict(summarize(samples[name], elapsed), errors=errors[name])
+    results['all'] = dict(
+        summarize([s for name in mix for s in samples[name]], elapsed),
+        errors=sum(errors.values())
+    )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default='http://localhost:8000', help='server base URL')
+    parser.add_argument('--users', type=int, default=50, help='accounts to spread the load on')
+    parser.add_argument('--concurrency', type=int, default=10, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run')
+    parser.add_argument(
+        '--mix', type=parse_mix, default='login=1,sendMessage=4,inbox=5',
+        help='operation weights, e.g. login=1,sendMessage=4,inbox=5'
+    )
+    parser.add_argument('--prefix', default='load', help='email prefix of the accounts')
+    parser.add_argument('-o', '--output', default='-', help='JSON result file')
+    args = parser.parse_args(argv)
+
+    results = run(args.url, args.users, args.concurrency, args.duration, args.mix, args.prefix)
+    write_results(
+        args.output, 'load', results,
+        url=args.url, users=args.users, concurrency=args.concurrency,
+        duration=args.duration, mix=args.mix
+    )
+
+
+if __name__ == '__main__':
+    main()
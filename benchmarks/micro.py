@@ -0,0 +1,126 @@
+"""Microbenchmarks of the model methods and list resolvers.
+
+Every benchmark runs against a fresh database holding a user with ``size``
+contacts, a personal chat with each and a group with all of them, for each
+of the given sizes::
+
+    python -m benchmarks.micro --sizes 10,100,1000 --repeat 50 -o micro.json
+
+The database defaults to an in-memory SQLite one, pass ``--database`` to
+measure against Postgres.
+"""
+import argparse
+import time
+
+from flask_jwt_extended import create_access_token
+
+from app import create_app, db
+from app.models import Contact, User
+from .results import summarize, write_results
+
+LIST_QUERIES = {
+    'myChats': '{ myChats { id title } }',
+    'myContacts': '{ myContacts { id email } }',
+}
+
+
+def measure(fn, repeat, setup=None):
+    """Time ``repeat`` calls of ``fn`` with the arguments ``setup(i)`` returns."""
+    samples = []
+    for i in range(repeat):
+        args = (setup(i) if setup else None) or ()
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def create_users(prefix, count):
+    users = [
+        User(email=f'{prefix}{i}@bench.test', password_hash='-', first_name=f'{prefix}{i}')
+        for i in range(count)
+    ]
+    db.session.add_all(users)
+    db.session.commit()
+    return users
+
+
+def populate(size):
+    """A user with ``size`` contacts, each of them in a personal chat with it."""
+    owner = create_users('owner', 1)[0]
+    peers = create_users('peer', size)
+    db.session.add_all([Contact(adder=owner, added=peer) for peer in peers])
+    db.session.commit()
+    for peer in peers:
+        owner.start_personal_chat(peer)
+    return owner, peers
+
+
+def run_size(app, size, repeat):
+    db.drop_all()
+    db.create_all()
+    owner, peers = populate(size)
+    chat = owner.start_personal_chat(peers[0])
+    group = owner.start_multiperson_chat(name='benchmark', targets=peers)
+    fresh = create_users('fresh', 2 * repeat)
+    results = {}
+
+    results['send_message'] = measure(lambda: owner.send_message(chat, 'benchmark'), repeat)
+    # Logs the message to all ``size + 1`` members, see record_changes.
+    results['send_message.group'] = measure(lambda: owner.send_message(group, 'benchmark'), repeat)
+    results['start_personal_chat.existing'] = measure(
+        lambda: owner.start_personal_chat(peers[-1]), repeat
+    )
+    results['start_personal_chat.new'] = measure(
+        owner.start_personal_chat, repeat, setup=lambda i: (fresh[i],)
+    )
+    results['is_contact'] = measure(lambda: owner.is_contact(peers[-1]), repeat)
+    results['add_contact'] = measure(
+        owner.add_contact, repeat, setup=lambda i: (fresh[repeat + i],)
+    )
+
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer ' + create_access_token(owner)}
+    for name, query in LIST_QUERIES.items():
+        def request():
+            response = client.post('/api/graphql', json={'query': query}, headers=headers)
+            assert 'errors' not in response.get_json(), response.get_json()
+
+        # Every request of a server starts with an empty session.
+        results[name] = measure(request, repeat, setup=lambda i: db.session.expunge_all())
+
+    return {f'{name}[size={size}]': summarize(samples) for name, samples in results.items()}
+
+
+def run(sizes, repeat, database='sqlite://'):
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database
+    with app.app_context():
+        results = {}
+        try:
+            for size in sizes:
+                results.update(run_size(app, size, repeat))
+        finally:
+            db.session.remove()
+            db.drop_all()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='10,100,1000', help='comma separated data sizes')
+    parser.add_argument('--repeat', type=int, default=50, help='samples per benchmark')
+    parser.add_argument('--database', default='sqlite://', help='SQLAlchemy database URL')
+    parser.add_argument('-o', '--output', default='-', help='JSON result file')
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    results = run(sizes, args.repeat, args.database)
+    write_results(
+        args.output, 'micro', results,
+        sizes=sizes, repeat=args.repeat, database=args.database.split('://')[0]
+    )
+
+
+if __name__ == '__main__':
+    main()
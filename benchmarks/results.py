@@ -0,0 +1,70 @@
+"""Summaries of timing samples and the JSON files runs are saved to."""
+import datetime
+import json
+import platform
+import subprocess
+import sys
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(samples, p):
+    """The ``p``-th percentile of sorted ``samples``, linearly interpolated."""
+    if not samples:
+        return None
+    rank = (len(samples) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(samples) - 1)
+    return samples[low] + (samples[high] - samples[low]) * (rank - low)
+
+
+def summarize(samples, elapsed=None):
+    """Summarize durations in seconds as milliseconds.
+
+    With the wall clock ``elapsed`` seconds the samples were taken in, the
+    throughput in operations per second is added.
+    """
+    samples = sorted(samples)
+    summary = {'count': len(samples)}
+    if samples:
+        summary.update({
+            'min': samples[0] * 1000,
+            'mean': sum(samples) / len(samples) * 1000,
+            'max': samples[-1] * 1000,
+        })
+        for p in PERCENTILES:
+            summary[f'p{p}'] = percentile(samples, p) * 1000
+    if elapsed:
+        summary['throughput'] = len(samples) / elapsed
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, kind, results, **meta):
+    """Write ``results`` with the metadata needed to compare runs."""
+    document = {
+        'kind': kind,
+        'meta': dict(
+            meta,
+            revision=git_revision(),
+            python=sys.version.split()[0],
+            platform=platform.platform(),
+            created_at=datetime.datetime.utcnow().isoformat() + 'Z',
+        ),
+        'results': results,
+    }
+    if path == '-':
+        json.dump(document, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(path, 'w') as f:
+            json.dump(document, f, indent=2)
+    return document
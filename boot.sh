@@ -11,5 +11,22 @@ while true; do
     sleep 5
 done
 
-exec gunicorn -b 0.0.0.0:8000 FLChat:app
+# Workers share their metrics through this directory, see app/metrics.py
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/flchat-metrics}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+if [[ -n "$FLCHAT_ASGI" ]]; then
+    # Async mode, see app/asgi.py. Subscriptions need the WSGI app.
+    exec uvicorn --factory app.asgi:create_asgi_app --host 0.0.0.0 --port 8000 \
+        --workers ${WEB_CONCURRENCY:-1}
+fi
+
+# Every open WebSocket subscription holds one of a worker's threads. Past
+# FLCHAT_MAX_SUBSCRIPTION_SOCKETS (half the threads by default) a worker
+# closes new sockets with 1013, so its HTTP requests keep the other threads.
+# Raise GUNICORN_THREADS or WEB_CONCURRENCY for more concurrent subscribers.
+GUNICORN_THREADS=${GUNICORN_THREADS:-32}
+export FLCHAT_MAX_SUBSCRIPTION_SOCKETS=${FLCHAT_MAX_SUBSCRIPTION_SOCKETS:-$((GUNICORN_THREADS / 2))}
+exec gunicorn -c gunicorn.conf.py -b 0.0.0.0:8000 --threads $GUNICORN_THREADS FLChat:app
 
@@ -7,6 +7,66 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     JWT_TOKEN_LOCATION = ['headers', 'cookies']
     SSL_REDIRECT = False
+    FLCHAT_PAGE_SIZE = 50
+    FLCHAT_MAX_PAGE_SIZE = 100
+    FLCHAT_PUBSUB_BROKER = os.environ.get('FLCHAT_PUBSUB_BROKER') or 'memory'
+    FLCHAT_SUBSCRIPTION_KEEPALIVE = 25
+    # WebSockets a worker serves at once, each holds a worker thread while
+    # open and later ones are closed with 1013, see boot.sh
+    FLCHAT_MAX_SUBSCRIPTION_SOCKETS = int(os.environ.get('FLCHAT_MAX_SUBSCRIPTION_SOCKETS') or 16)
+    FLCHAT_DOCUMENT_CACHE_SIZE = 1000
+    FLCHAT_PERSISTED_QUERY_CACHE_SIZE = 10000
+    FLCHAT_MAX_QUERY_DEPTH = 12
+    FLCHAT_MAX_QUERY_COST = 10000
+    FLCHAT_QUERY_LIST_SIZE = 20
+    FLCHAT_MAX_SEND_BATCH = 500
+    FLCHAT_IDENTITY_CACHE_SIZE = 10000
+    FLCHAT_IDENTITY_CACHE_TTL = 60
+    # Derived from SQLALCHEMY_DATABASE_URI when unset, see app/asgi.py
+    FLCHAT_ASYNC_DATABASE_URI = os.environ.get('ASYNC_DATABASE_URL')
+    # Served on /metrics when prometheus_client is installed
+    FLCHAT_METRICS_ENABLED = os.environ.get('FLCHAT_METRICS_ENABLED', '1') != '0'
+    FLCHAT_METRICS_MAX_OPERATIONS = 500
+    # off, sample or debug, see app/tracing.py. debug returns the SQL of every
+    # operation to the client, only opt in through the environment locally.
+    FLCHAT_TRACE_MODE = os.environ.get('FLCHAT_TRACE_MODE') or 'off'
+    FLCHAT_TRACE_SAMPLE_RATE = float(os.environ.get('FLCHAT_TRACE_SAMPLE_RATE') or 0.01)
+    FLCHAT_N_PLUS_ONE_THRESHOLD = 3
+    FLCHAT_SLOW_REQUEST_MS = 1000
+    FLCHAT_SLOW_LOG = os.environ.get('FLCHAT_SLOW_LOG')
+    FLCHAT_SLOW_LOG_MAX_BYTES = 10 * 1024 * 1024
+    FLCHAT_SLOW_LOG_BACKUPS = 5
+    # memory, or a SQLite file shared by the workers, see app/ratelimit.py
+    FLCHAT_RATE_LIMIT_STORE = os.environ.get('FLCHAT_RATE_LIMIT_STORE') or 'memory'
+    # Proxies in front of the app whose X-Forwarded-For/-Proto are trusted,
+    # rate limits key anonymous clients on the forwarded address
+    FLCHAT_PROXY_HOPS = int(os.environ.get('FLCHAT_PROXY_HOPS') or 0)
+    # Turn off for load tests from a single address
+    FLCHAT_RATE_LIMITS_ENABLED = os.environ.get('FLCHAT_RATE_LIMITS_ENABLED', '1') != '0'
+    # (requests, seconds) per client
+    FLCHAT_RATE_LIMITS = {
+        'Mutation.login': (10, 60),
+        'Mutation.register': (5, 3600),
+        'Mutation.sendMessage': (60, 60),
+        'Mutation.sendMessages': (10, 60),
+    }
+    # Batch concurrent sendMessage commits, see app/groupcommit.py
+    FLCHAT_GROUP_COMMIT = os.environ.get('FLCHAT_GROUP_COMMIT', '0') != '0'
+    FLCHAT_GROUP_COMMIT_INTERVAL_MS = 5
+    FLCHAT_GROUP_COMMIT_MAX_BATCH = 200
+    FLCHAT_GROUP_COMMIT_TIMEOUT = 10
+    # Seconds a sendMessage clientMessageId deduplicates retries, cleared
+    # in batches by `flask expire-message-keys`
+    FLCHAT_CLIENT_MESSAGE_ID_TTL = int(os.environ.get('FLCHAT_CLIENT_MESSAGE_ID_TTL', 7 * 24 * 3600))
+    FLCHAT_CLIENT_MESSAGE_ID_BATCH = 1000
+    # read lists inboxes from the memberships, write keeps an inbox table per
+    # user; run `flask rebuild-inbox` when switching to write
+    FLCHAT_INBOX_FANOUT = os.environ.get('FLCHAT_INBOX_FANOUT') or 'read'
+    FLCHAT_QUERY_COST_WEIGHTS = {
+        'Mutation.login': 10,
+        'Mutation.register': 10,
+        'Mutation.updateUser': 10,
+    }
 
     @staticmethod
     def init_app(app):
@@ -31,6 +91,11 @@ class ProductionConfig(Config):
     database_name = 'flchat'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SSL_REDIRECT = True if os.environ.get('DYNO') else False
+    # Heroku's router is the one proxy in front of a dyno
+    FLCHAT_PROXY_HOPS = int(os.environ.get('FLCHAT_PROXY_HOPS') or (1 if os.environ.get('DYNO') else 0))
+    FLCHAT_PUBSUB_BROKER = os.environ.get('FLCHAT_PUBSUB_BROKER') or 'postgres'
+    FLCHAT_RATE_LIMIT_STORE = os.environ.get('FLCHAT_RATE_LIMIT_STORE') or \
+        '/tmp/flchat/ratelimit.sqlite3'
 
 
 config = {
@@ -0,0 +1,8 @@
+import os
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of dead workers from the shared metrics directory.
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -25,6 +25,24 @@ config.set_main_option(
     str(current_app.extensions['migrate'].db.engine.url).replace('%', '%%'))
 target_metadata = current_app.extensions['migrate'].db.metadata
 
+# Full-text search objects are created by raw DDL (see app/models.py and
+# revision e41a8c63d7f5), they are not in the metadata.
+SEARCH_COLUMNS = {'search_vector'}
+SEARCH_INDEXES = {'ix_message_search_vector'}
+SEARCH_TABLE_PREFIX = 'message_fts'
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Keep autogenerate from dropping the full-text search objects."""
+    if type_ == 'table':
+        return not name.startswith(SEARCH_TABLE_PREFIX)
+    if type_ == 'column':
+        return name not in SEARCH_COLUMNS
+    if type_ == 'index':
+        return name not in SEARCH_INDEXES
+    return True
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -45,7 +63,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=target_metadata, literal_binds=True
+        url=url, target_metadata=target_metadata, literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -77,6 +96,7 @@ def run_migrations_online():
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -0,0 +1,37 @@
+"""conversation kind
+
+Revision ID: 1a014bc20d34
+Revises: 53405f0a52a2
+Create Date: 2026-10-18 10:03:17.902145
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1a014bc20d34'
+down_revision = '53405f0a52a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('conversation', sa.Column('kind', sa.String(length=3), nullable=True))
+    # Until now the kind was only encoded in the title prefix.
+    op.execute(
+        "UPDATE conversation SET kind = CASE "
+        "WHEN title LIKE 'pc%' THEN 'pc' ELSE 'mpc' END"
+    )
+    op.alter_column('conversation', 'kind', existing_type=sa.String(length=3), nullable=False)
+    op.create_index(op.f('ix_conversation_kind'), 'conversation', ['kind'], unique=False)
+    op.create_index(
+        'ix_participants_user_id_conversation_id', 'participants',
+        ['user_id', 'conversation_id'], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_participants_user_id_conversation_id', table_name='participants')
+    op.drop_index(op.f('ix_conversation_kind'), table_name='conversation')
+    op.drop_column('conversation', 'kind')
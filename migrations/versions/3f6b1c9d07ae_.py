@@ -0,0 +1,36 @@
+"""per-user inbox table
+
+Revision ID: 3f6b1c9d07ae
+Revises: ed20264e724b
+Create Date: 2026-10-18 16:05:37.219548
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6b1c9d07ae'
+down_revision = 'ed20264e724b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('inbox',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('conversation_id', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['conversation_id'], ['conversation.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'conversation_id')
+    )
+    op.create_index(
+        'ix_inbox_user_id_updated_at_conversation_id', 'inbox',
+        ['user_id', sa.text('updated_at DESC'), sa.text('conversation_id DESC')], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_inbox_user_id_updated_at_conversation_id', table_name='inbox')
+    op.drop_table('inbox')
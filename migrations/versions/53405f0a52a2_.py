@@ -0,0 +1,27 @@
+"""message history keyset index
+
+Revision ID: 53405f0a52a2
+Revises: 5810c2e7a782
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '53405f0a52a2'
+down_revision = '5810c2e7a782'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_message_conversation_id_sent_at_id', 'message',
+        ['conversation_id', 'sent_at', 'id'], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_message_conversation_id_sent_at_id', table_name='message')
@@ -0,0 +1,43 @@
+"""personal chat pairs
+
+Revision ID: 60cbd7296434
+Revises: 1a014bc20d34
+Create Date: 2026-10-18 10:41:55.270318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '60cbd7296434'
+down_revision = '1a014bc20d34'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('personal_chat',
+    sa.Column('user_low_id', sa.Integer(), nullable=False),
+    sa.Column('user_high_id', sa.Integer(), nullable=False),
+    sa.Column('conversation_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['conversation_id'], ['conversation.id'], ),
+    sa.ForeignKeyConstraint(['user_high_id'], ['user.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_low_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_low_id', 'user_high_id'),
+    sa.UniqueConstraint('conversation_id')
+    )
+    # Existing duplicates of a pair keep the oldest conversation.
+    op.execute(
+        "INSERT INTO personal_chat (user_low_id, user_high_id, conversation_id) "
+        "SELECT p1.user_id, p2.user_id, MIN(p1.conversation_id) "
+        "FROM participants p1 "
+        "JOIN participants p2 ON p2.conversation_id = p1.conversation_id "
+        "AND p2.user_id > p1.user_id "
+        "JOIN conversation c ON c.id = p1.conversation_id AND c.kind = 'pc' "
+        "GROUP BY p1.user_id, p2.user_id"
+    )
+
+
+def downgrade():
+    op.drop_table('personal_chat')
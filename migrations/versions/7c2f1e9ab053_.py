@@ -0,0 +1,43 @@
+"""conversation inbox summary
+
+Revision ID: 7c2f1e9ab053
+Revises: 60cbd7296434
+Create Date: 2026-10-18 11:12:40.518302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2f1e9ab053'
+down_revision = '60cbd7296434'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('conversation', sa.Column('last_message_id', sa.Integer(), nullable=True))
+    op.add_column('conversation', sa.Column('last_message_preview', sa.String(length=100), nullable=True))
+    op.create_foreign_key(
+        'fk_conversation_last_message_id', 'conversation', 'message',
+        ['last_message_id'], ['id']
+    )
+    op.execute(
+        "UPDATE conversation SET last_message_id = ("
+        "SELECT m.id FROM message m WHERE m.conversation_id = conversation.id "
+        "ORDER BY m.sent_at DESC, m.id DESC LIMIT 1)"
+    )
+    op.execute(
+        "UPDATE conversation SET last_message_preview = ("
+        "SELECT substr(m.message, 1, 100) FROM message m "
+        "WHERE m.id = conversation.last_message_id)"
+    )
+    op.create_index('ix_conversation_updated_at_id', 'conversation', ['updated_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_conversation_updated_at_id', table_name='conversation')
+    op.drop_constraint('fk_conversation_last_message_id', 'conversation', type_='foreignkey')
+    op.drop_column('conversation', 'last_message_preview')
+    op.drop_column('conversation', 'last_message_id')
@@ -0,0 +1,37 @@
+"""message client ids
+
+Revision ID: 8dc828d30906
+Revises: e41a8c63d7f5
+Create Date: 2026-10-18 14:07:41.316502
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8dc828d30906'
+down_revision = 'e41a8c63d7f5'
+branch_labels = None
+depends_on = None
+
+KEYED = sa.text('client_message_id IS NOT NULL')
+
+
+def upgrade():
+    op.add_column('message', sa.Column('client_message_id', sa.String(length=64), nullable=True))
+    op.create_index(
+        'ix_message_sender_id_client_message_id', 'message',
+        ['sender_id', 'client_message_id'], unique=True,
+        postgresql_where=KEYED, sqlite_where=KEYED
+    )
+    op.create_index(
+        'ix_message_client_message_id_sent_at', 'message', ['sent_at'], unique=False,
+        postgresql_where=KEYED, sqlite_where=KEYED
+    )
+
+
+def downgrade():
+    op.drop_index('ix_message_client_message_id_sent_at', table_name='message')
+    op.drop_index('ix_message_sender_id_client_message_id', table_name='message')
+    op.drop_column('message', 'client_message_id')
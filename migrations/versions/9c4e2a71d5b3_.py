@@ -0,0 +1,38 @@
+"""change counters off the user table
+
+Revision ID: 9c4e2a71d5b3
+Revises: 3f6b1c9d07ae
+Create Date: 2026-10-18 18:12:43.507916
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4e2a71d5b3'
+down_revision = '3f6b1c9d07ae'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_counter',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.execute('INSERT INTO change_counter (user_id, seq) SELECT id, change_seq FROM "user"')
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('change_seq')
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.add_column(sa.Column('change_seq', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        'UPDATE "user" SET change_seq = '
+        '(SELECT seq FROM change_counter WHERE change_counter.user_id = "user".id)'
+    )
+    op.drop_table('change_counter')
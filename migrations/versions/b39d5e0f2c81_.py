@@ -0,0 +1,65 @@
+"""participant read state
+
+Revision ID: b39d5e0f2c81
+Revises: 7c2f1e9ab053
+Create Date: 2026-10-18 11:47:03.226914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b39d5e0f2c81'
+down_revision = '7c2f1e9ab053'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The old association table had no key and may hold duplicate rows, so
+    # it is rebuilt instead of altered.
+    op.create_table('participants_new',
+    sa.Column('conversation_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('last_read_message_id', sa.Integer(), nullable=True),
+    sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['conversation_id'], ['conversation.id'], ),
+    sa.ForeignKeyConstraint(['last_read_message_id'], ['message.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('conversation_id', 'user_id')
+    )
+    # Existing history counts as read.
+    op.execute(
+        "INSERT INTO participants_new (conversation_id, user_id, last_read_message_id) "
+        "SELECT DISTINCT p.conversation_id, p.user_id, c.last_message_id "
+        "FROM participants p JOIN conversation c ON c.id = p.conversation_id "
+        "WHERE p.user_id IS NOT NULL"
+    )
+    op.drop_index('ix_participants_user_id_conversation_id', table_name='participants')
+    op.drop_table('participants')
+    op.rename_table('participants_new', 'participants')
+    op.create_index(
+        'ix_participants_user_id_conversation_id', 'participants',
+        ['user_id', 'conversation_id'], unique=False
+    )
+
+
+def downgrade():
+    op.create_table('participants_old',
+    sa.Column('conversation_id', sa.Integer(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['conversation_id'], ['conversation.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], )
+    )
+    op.execute(
+        "INSERT INTO participants_old (conversation_id, user_id) "
+        "SELECT conversation_id, user_id FROM participants"
+    )
+    op.drop_index('ix_participants_user_id_conversation_id', table_name='participants')
+    op.drop_table('participants')
+    op.rename_table('participants_old', 'participants')
+    op.create_index(
+        'ix_participants_user_id_conversation_id', 'participants',
+        ['user_id', 'conversation_id'], unique=False
+    )
@@ -0,0 +1,60 @@
+"""message full-text search
+
+Revision ID: e41a8c63d7f5
+Revises: b39d5e0f2c81
+Create Date: 2026-10-18 12:31:55.840127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41a8c63d7f5'
+down_revision = 'b39d5e0f2c81'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # Generated columns need Postgres 12.
+        op.execute(
+            "ALTER TABLE message ADD COLUMN search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('simple', message)) STORED"
+        )
+        op.execute("CREATE INDEX ix_message_search_vector ON message USING gin (search_vector)")
+    elif dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE message_fts USING fts5("
+            "message, content='message', content_rowid='id')"
+        )
+        op.execute(
+            "CREATE TRIGGER message_fts_insert AFTER INSERT ON message BEGIN "
+            "INSERT INTO message_fts (rowid, message) VALUES (new.id, new.message); END"
+        )
+        op.execute(
+            "CREATE TRIGGER message_fts_delete AFTER DELETE ON message BEGIN "
+            "INSERT INTO message_fts (message_fts, rowid, message) "
+            "VALUES ('delete', old.id, old.message); END"
+        )
+        op.execute(
+            "CREATE TRIGGER message_fts_update AFTER UPDATE OF message ON message BEGIN "
+            "INSERT INTO message_fts (message_fts, rowid, message) "
+            "VALUES ('delete', old.id, old.message); "
+            "INSERT INTO message_fts (rowid, message) VALUES (new.id, new.message); END"
+        )
+        op.execute("INSERT INTO message_fts (message_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.drop_index('ix_message_search_vector', table_name='message')
+        op.drop_column('message', 'search_vector')
+    elif dialect == 'sqlite':
+        op.execute("DROP TRIGGER message_fts_update")
+        op.execute("DROP TRIGGER message_fts_delete")
+        op.execute("DROP TRIGGER message_fts_insert")
+        op.execute("DROP TABLE message_fts")
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from sqlalchemy import event
+from app import create_app, db, pubsub
+from app.asgi import FLChatASGI, async_database_uri
+from app.pubsub import PostgresBroker
+
+try:
+    import aiosqlite
+    from sqlalchemy.ext.asyncio import create_async_engine
+except ImportError:
+    aiosqlite = None
+
+
+@unittest.skipIf(aiosqlite is None, 'aiosqlite is not installed')
+class ASGITestCase(unittest.TestCase):
+    def setUp(self):
+        # Every aiosqlite connection to sqlite:// would get its own database.
+        fd, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+
+        self.app = create_app('testing')
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{self.path}'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.engine = create_async_engine(async_database_uri(f'sqlite:///{self.path}'))
+        self.asgi = FLChatASGI(self.app, self.engine)
+        self.statements = []
+        event.listen(self.engine.sync_engine, 'before_cursor_execute', self.count)
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.engine.dispose())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        os.remove(self.path)
+
+    def count(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    async def request(self, query, token=None):
+        body = json.dumps({'query': query}).encode('utf-8')
+        headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        if token:
+            headers.append((b'authorization', f'Bearer {token}'.encode()))
+        scope = {
+            'type': 'http', 'method': 'POST', 'path': '/api/graphql',
+            'query_string': b'', 'headers': headers, 'http_version': '1.1',
+        }
+        received = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return received.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        await self.asgi(scope, receive, send)
+        self.assertEqual(sent[0]['status'], 200)
+        return json.loads(b''.join(m.get('body', b'') for m in sent[1:]))
+
+    def test_graphql_over_asgi(self):
+        register = r'''
+            mutation { register (email: "%s", firstName: "a", password: "pw", passwordConfirm: "pw") { success } }
+        '''
+        response = self.loop.run_until_complete(asyncio.gather(*[
+            self.request(register % f'user{i}@test.com') for i in range(3)
+        ]))
+        self.assertTrue(all(r['data']['register']['success'] for r in response))
+
+        response = self.loop.run_until_complete(self.request(
+            'mutation { login (email: "user1@test.com", password: "pw") { accessToken } }'
+        ))
+        token = response['data']['login']['accessToken']
+        response = self.loop.run_until_complete(self.request('{ me { email } }', token))
+        self.assertEqual(response['data']['me']['email'], 'user1@test.com')
+        # Everything went through the asyncio engine.
+        self.assertTrue(any(s.startswith('INSERT INTO user') for s in self.statements))
+
+    def test_notifications_leave_the_event_loop(self):
+        self.loop.run_until_complete(self.request(
+            'mutation { register (email: "user@test.com", firstName: "a", password: "pw", passwordConfirm: "pw") '
+            '{ success } }'
+        ))
+        response = self.loop.run_until_complete(self.request(
+            'mutation { login (email: "user@test.com", password: "pw") { accessToken } }'
+        ))
+        token = response['data']['login']['accessToken']
+
+        threads = []
+        broker = PostgresBroker(self.app)
+        with mock.patch.object(pubsub, 'broker', broker), \
+                mock.patch.object(broker, 'notify', lambda message: threads.append(threading.current_thread())):
+            response = self.loop.run_until_complete(self.request(
+                'mutation { updateUser (firstName: "b") { success } }', token
+            ))
+        self.assertTrue(response['data']['updateUser']['success'])
+        # The identity cache invalidation was broadcast from a worker thread.
+        self.assertTrue(threads)
+        self.assertNotIn(threading.current_thread(), threads)
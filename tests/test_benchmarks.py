@@ -0,0 +1,34 @@
+import unittest
+from benchmarks import group_commit, micro
+from benchmarks.compare import compare
+from benchmarks.results import percentile, summarize
+
+
+class BenchmarksTestCase(unittest.TestCase):
+    def test_summarize(self):
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2.5)
+        summary = summarize([0.004, 0.001, 0.002, 0.003], elapsed=2)
+        self.assertEqual(summary['count'], 4)
+        self.assertAlmostEqual(summary['min'], 1)
+        self.assertAlmostEqual(summary['p50'], 2.5)
+        self.assertAlmostEqual(summary['p99'], 3.97)
+        self.assertEqual(summary['throughput'], 2)
+
+    def test_compare(self):
+        baseline = {'results': {'a': {'p50': 10}, 'b': {'p50': 10}}}
+        current = {'results': {'a': {'p50': 10.5}, 'b': {'p50': 12}, 'c': {'p50': 1}}}
+        self.assertEqual(
+            [(name, regressed) for name, _, _, _, regressed in compare(baseline, current)],
+            [('a', False), ('b', True)]
+        )
+
+    def test_micro_benchmarks_run(self):
+        results = micro.run([3], repeat=2)
+        for name in ('send_message', 'send_message.group', 'start_personal_chat.new',
+                     'add_contact', 'myChats', 'myContacts'):
+            self.assertEqual(results[f'{name}[size=3]']['count'], 2)
+
+    def test_group_commit_benchmark_runs(self):
+        results = group_commit.run(threads=3, messages=4)
+        self.assertEqual(results['direct']['count'], 12)
+        self.assertEqual(results['group_commit']['count'], 12)
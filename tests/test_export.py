@@ -0,0 +1,61 @@
+import csv
+import gzip
+import io
+import json
+import unittest
+from flask_jwt_extended import create_access_token
+from app import create_app, db
+from app.export import CHUNK_SIZE, export_conversation
+from app.models import User
+
+
+class ExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(email='user@test.com', password_hash='-', first_name='user')
+        self.friend = User(email='friend@test.com', password_hash='-', first_name='friend')
+        self.stranger = User(email='stranger@test.com', password_hash='-', first_name='stranger')
+        db.session.add_all([self.user, self.friend, self.stranger])
+        self.chat = self.user.start_personal_chat(self.friend)
+        self.user.send_messages([(self.chat, f'message {i}, "quoted"') for i in range(3000)])
+        self.url = f'/api/conversations/{self.chat.id}/export'
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def get(self, user, query=''):
+        return self.client.get(
+            self.url + query,
+            headers={'Authorization': 'Bearer ' + create_access_token(user)}
+        )
+
+    def test_export_is_streamed_in_chunks(self):
+        chunks = list(export_conversation(self.chat.id))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(c) < 2 * CHUNK_SIZE for c in chunks))
+
+        rows = [json.loads(line) for line in b''.join(chunks).decode('utf-8').splitlines()]
+        self.assertEqual(len(rows), 3000)
+        self.assertEqual(rows[0]['message'], 'message 0, "quoted"')
+        self.assertEqual(rows[-1]['sender_email'], 'user@test.com')
+
+    def test_csv_gzip_endpoint(self):
+        response = self.get(self.friend, '?format=csv&gzip=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/gzip')
+
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.data).decode('utf-8'))))
+        self.assertEqual(len(rows), 3000)
+        self.assertEqual(rows[2999]['message'], 'message 2999, "quoted"')
+
+    def test_export_requires_participation(self):
+        self.assertEqual(self.get(self.stranger).status_code, 404)
+        self.assertEqual(self.get(self.user, '?format=xml').status_code, 400)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
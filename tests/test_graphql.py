@@ -1,6 +1,14 @@
+import json
 import unittest
-from app import create_app, db
-from app.models import User
+from contextlib import contextmanager
+from unittest import mock
+from sqlalchemy import event
+from flask_jwt_extended import create_access_token
+from app import create_app, db, rate_limiter, search
+from config import TestingConfig
+from app.graphql.backend import LRUCache, query_hash
+from app.graphql.pagination import encode_cursor
+from app.models import User, InboxEntry, rebuild_inbox
 
 
 class ClientTestCase(unittest.TestCase):
@@ -132,3 +140,789 @@ class ClientTestCase(unittest.TestCase):
         self.assertEqual(self.test_last_name, response_data['lastName'])
         self.assertTrue(response_data['isActive'])
         self.assertFalse(response_data['isAdmin'])
+
+
+class GraphQLTestCase(unittest.TestCase):
+    """An app with an empty database and a test client."""
+    endpoint = '/api/graphql'
+    config = {}
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config.update(self.config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    @contextmanager
+    def count_statements(self):
+        """Collect the SQL statements run in the block into the yielded list."""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+class MessageHistoryTestCase(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.user1 = User(email='user1@test.com', password='test123', first_name='user1')
+        self.user2 = User(email='user2@test.com', password='test123', first_name='user2')
+        db.session.add_all([self.user1, self.user2])
+        db.session.commit()
+
+        self.conversation = self.user1.start_personal_chat(self.user2)
+        for i in range(7):
+            self.user1.send_message(self.conversation, f'message {i}')
+
+        self.access_token = create_access_token(self.user1)
+
+    def get_messages(self, arguments):
+        response = self.client.post(
+            self.endpoint, json={
+                'query':
+                    fr'''
+                    query {{
+                        myChats {{
+                            messages ({arguments}) {{
+                                edges {{ cursor node {{ message }} }}
+                                pageInfo {{
+                                    hasNextPage hasPreviousPage
+                                    startCursor endCursor
+                                }}
+                            }}
+                        }}
+                    }}
+                    '''
+            }, headers={'Authorization': 'Bearer ' + self.access_token}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['data']['myChats'][0]['messages']
+
+    def test_forward_pagination(self):
+        page = self.get_messages('first: 3')
+        self.assertEqual(
+            [e['node']['message'] for e in page['edges']],
+            ['message 0', 'message 1', 'message 2']
+        )
+        self.assertTrue(page['pageInfo']['hasNextPage'])
+
+        page = self.get_messages(f'first: 5, after: "{page["pageInfo"]["endCursor"]}"')
+        self.assertEqual(
+            [e['node']['message'] for e in page['edges']],
+            ['message 3', 'message 4', 'message 5', 'message 6']
+        )
+        self.assertFalse(page['pageInfo']['hasNextPage'])
+        self.assertTrue(page['pageInfo']['hasPreviousPage'])
+
+    def test_backward_pagination(self):
+        page = self.get_messages('last: 2')
+        self.assertEqual(
+            [e['node']['message'] for e in page['edges']],
+            ['message 5', 'message 6']
+        )
+        self.assertTrue(page['pageInfo']['hasPreviousPage'])
+
+        page = self.get_messages(f'last: 10, before: "{page["pageInfo"]["startCursor"]}"')
+        self.assertEqual(len(page['edges']), 5)
+        self.assertEqual(page['edges'][-1]['node']['message'], 'message 4')
+        self.assertFalse(page['pageInfo']['hasPreviousPage'])
+
+
+class BatchingTestCase(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.user = User(email='user@test.com', password='test123', first_name='user')
+        db.session.add(self.user)
+        db.session.commit()
+        self.access_token = create_access_token(self.user)
+        self.targets = 0
+
+    def add_chats(self, count):
+        for _ in range(count):
+            self.targets += 1
+            target = User(
+                email=f'target{self.targets}@test.com',
+                password_hash='-', first_name=f'target{self.targets}'
+            )
+            db.session.add(target)
+            c = self.user.start_personal_chat(target)
+            self.user.send_message(c, 'hi')
+            target.send_message(c, 'hello')
+            self.user.add_contact(target)
+            target.add_contact(self.user)
+
+    def listing_statements(self):
+        with self.count_statements() as statements:
+            response = self.client.post(
+                self.endpoint, json={
+                    'query':
+                        r'''
+                        query {
+                            me {
+                                contactsAdded { added { email } }
+                                contactsAdders { adder { email } }
+                            }
+                            myChats {
+                                creator { email }
+                                participants { email }
+                                messages { edges { node { sender { email } } } }
+                            }
+                        }
+                        '''
+                }, headers={'Authorization': 'Bearer ' + self.access_token}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()['data']
+        self.assertEqual(len(data['myChats']), self.targets)
+        for chat in data['myChats']:
+            self.assertEqual(chat['creator']['email'], 'user@test.com')
+            self.assertEqual(len(chat['participants']), 2)
+            self.assertEqual(len(chat['messages']['edges']), 2)
+        self.assertEqual(len(data['me']['contactsAdded']), self.targets)
+        return len(statements)
+
+    def test_statements_do_not_grow_with_rows(self):
+        self.add_chats(2)
+        small = self.listing_statements()
+        self.add_chats(3)
+        self.assertEqual(small, self.listing_statements())
+
+
+class InboxTestCase(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.user = User(email='user@test.com', password_hash='-', first_name='user')
+        db.session.add(self.user)
+        self.chats = []
+        for i in range(4):
+            target = User(email=f'target{i}@test.com', password_hash='-', first_name=f'target{i}')
+            db.session.add(target)
+            c = self.user.start_personal_chat(target)
+            target.send_message(c, f'hello {i}')
+            self.chats.append(c)
+        # Activity moves the first chat back to the top.
+        self.user.send_message(self.chats[0], 'again')
+        self.access_token = create_access_token(self.user)
+
+    def get_inbox(self, arguments):
+        with self.count_statements() as statements:
+            response = self.client.post(
+                self.endpoint, json={
+                    'query':
+                        fr'''
+                        query {{
+                            myInbox ({arguments}) {{
+                                edges {{
+                                    node {{
+                                        lastMessagePreview
+                                        lastMessage {{ sender {{ email }} }}
+                                    }}
+                                }}
+                                pageInfo {{ hasNextPage endCursor }}
+                            }}
+                        }}
+                        '''
+                }, headers={'Authorization': 'Bearer ' + self.access_token}
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['data']['myInbox'], statements
+
+    def test_inbox_order_and_pagination(self):
+        page, _ = self.get_inbox('first: 3')
+        self.assertEqual(
+            [e['node']['lastMessagePreview'] for e in page['edges']],
+            ['again', 'hello 3', 'hello 2']
+        )
+        self.assertEqual(page['edges'][0]['node']['lastMessage']['sender']['email'], 'user@test.com')
+        self.assertTrue(page['pageInfo']['hasNextPage'])
+
+        page, _ = self.get_inbox(f'first: 3, after: "{page["pageInfo"]["endCursor"]}"')
+        self.assertEqual([e['node']['lastMessagePreview'] for e in page['edges']], ['hello 1'])
+        self.assertFalse(page['pageInfo']['hasNextPage'])
+
+    def test_unread_count_and_mark_read(self):
+        def unread():
+            response = self.client.post(
+                self.endpoint, json={'query': '{ myInbox { edges { node { unreadCount } } } }'},
+                headers={'Authorization': 'Bearer ' + self.access_token}
+            )
+            return [e['node']['unreadCount'] for e in response.get_json()['data']['myInbox']['edges']]
+
+        self.assertEqual(unread(), [0, 1, 1, 1])
+        response = self.client.post(
+            self.endpoint, json={
+                'query': 'mutation ($id: Int!) { markRead (conversationId: $id) { conversation { unreadCount } } }',
+                'variables': {'id': self.chats[1].id}
+            }, headers={'Authorization': 'Bearer ' + self.access_token}
+        )
+        self.assertEqual(response.get_json()['data']['markRead']['conversation']['unreadCount'], 0)
+        self.assertEqual(unread(), [0, 1, 1, 0])
+
+    def test_inbox_is_one_query(self):
+        _, statements = self.get_inbox('first: 10')
+        # The user behind the token is already known, the page is the only query.
+        self.assertEqual(len(statements), 1)
+
+
+class FanOutOnWriteInboxTestCase(InboxTestCase):
+    config = {'FLCHAT_INBOX_FANOUT': 'write'}
+
+    def my_chats(self):
+        response = self.client.post(
+            self.endpoint, json={'query': '{ myChats { lastMessagePreview } }'},
+            headers={'Authorization': 'Bearer ' + self.access_token}
+        )
+        return [c['lastMessagePreview'] for c in response.get_json()['data']['myChats']]
+
+    def test_inbox_entries(self):
+        self.assertEqual(InboxEntry.query.count(), 8)
+        group = self.user.start_multiperson_chat(name='group')
+        self.assertEqual(self.my_chats(), [None, 'again', 'hello 3', 'hello 2', 'hello 1'])
+
+        friend = User.query.filter_by(email='target2@test.com').one()
+        group.add_user_to_mpc(friend)
+        friend.send_message(self.chats[1], 'late')
+        self.assertEqual(self.my_chats(), ['late', None, 'again', 'hello 3', 'hello 2'])
+        entry = InboxEntry.query.get((friend.id, group.id))
+        self.assertEqual(entry.updated_at, group.updated_at)
+
+    def test_chat_with_yourself(self):
+        response = self.client.post(
+            self.endpoint, json={
+                'query': 'mutation { sendMessage(destination: "user@test.com", message: "note") '
+                         '{ conversation { id } } }'
+            }, headers={'Authorization': 'Bearer ' + self.access_token}
+        ).get_json()
+        self.assertNotIn('errors', response)
+        conversation_id = int(response['data']['sendMessage']['conversation']['id'])
+        self.assertEqual(
+            [(e.user_id, e.conversation_id) for e in InboxEntry.query.filter_by(conversation_id=conversation_id)],
+            [(self.user.id, conversation_id)]
+        )
+        self.assertEqual(self.my_chats()[0], 'note')
+
+    def test_rebuild_inbox(self):
+        expected = self.my_chats()
+        InboxEntry.query.delete()
+        db.session.commit()
+        self.assertEqual(self.my_chats(), [])
+
+        self.assertEqual(rebuild_inbox(), 8)
+        self.assertEqual(self.my_chats(), expected)
+
+
+class SendMessagesTestCase(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.user = User(email='bot@test.com', password_hash='-', first_name='bot')
+        self.friend = User(email='friend@test.com', password_hash='-', first_name='friend')
+        self.other = User(email='other@test.com', password_hash='-', first_name='other')
+        db.session.add_all([self.user, self.friend, self.other])
+        self.chat = self.user.start_personal_chat(self.friend)
+        self.group = self.user.start_multiperson_chat(name='group', targets=[self.friend])
+        self.access_token = create_access_token(self.user)
+
+    def send(self, items):
+        return self.client.post(
+            self.endpoint, json={
+                'query':
+                    r'''
+                    mutation ($items: [MessageInput!]!) {
+                        sendMessages (items: $items) {
+                            results { clientId message { message } conversation { id } }
+                        }
+                    }
+                    ''',
+                'variables': {'items': items}
+            }, headers={'Authorization': 'Bearer ' + self.access_token}
+        ).get_json()
+
+    def test_send_messages(self):
+        group_id = str(self.group.id)
+        response = self.send([
+            {'destination': 'friend@test.com', 'message': 'a', 'clientId': '1'},
+            {'destination': group_id, 'message': 'b', 'clientId': '2'},
+            {'destination': 'other@test.com', 'message': 'c', 'clientId': '3'},
+            {'destination': group_id, 'message': 'd', 'clientId': '4'},
+        ])
+        results = response['data']['sendMessages']['results']
+        self.assertEqual([r['clientId'] for r in results], ['1', '2', '3', '4'])
+        self.assertEqual([r['message']['message'] for r in results], ['a', 'b', 'c', 'd'])
+        self.assertEqual(results[1]['conversation']['id'], results[3]['conversation']['id'])
+
+        self.assertEqual(self.chat.messages.count(), 1)
+        self.assertEqual(self.group.last_message_preview, 'd')
+        self.assertEqual(self.group.participant(self.friend).unread_count, 2)
+        self.assertEqual(self.user.start_personal_chat(self.other).messages.count(), 1)
+
+    def test_unknown_destination_sends_nothing(self):
+        response = self.send([
+            {'destination': 'friend@test.com', 'message': 'a'},
+            {'destination': 'nobody@test.com', 'message': 'b'},
+        ])
+        self.assertEqual(response['errors'][0]['message'], 'user nobody@test.com does not exist')
+        self.assertEqual(self.chat.messages.count(), 0)
+
+    def send_once(self, message, client_message_id):
+        return self.client.post(
+            self.endpoint, json={
+                'query':
+                    r'''
+                    mutation ($message: String, $key: String) {
+                        sendMessage (destination: "friend@test.com", message: $message, clientMessageId: $key) {
+                            message { id message }
+                        }
+                    }
+                    ''',
+                'variables': {'message': message, 'key': client_message_id}
+            }, headers={'Authorization': 'Bearer ' + self.access_token}
+        ).get_json()['data']['sendMessage']['message']
+
+    def test_send_message_retry_is_idempotent(self):
+        first = self.send_once('hello', 'key-1')
+        retry = self.send_once('hello', 'key-1')
+        self.assertEqual(retry, first)
+        other = self.send_once('hello', 'key-2')
+        self.assertNotEqual(other['id'], first['id'])
+        self.assertEqual(self.chat.messages.count(), 2)
+        self.assertEqual(self.chat.participant(self.friend).unread_count, 2)
+
+        # Keys are per sender.
+        self.assertEqual(self.friend.send_message(self.chat, 'hi', 'key-1').sender, self.friend)
+
+    def test_concurrent_retry_returns_original(self):
+        first = self.user.send_message(self.chat, 'hello', 'key-1')
+        # A retry that got past the lookup fails on the unique index.
+        self.assertEqual(self.user.send_message(self.chat, 'hello again', 'key-1'), first)
+        self.assertEqual(self.chat.messages.count(), 1)
+        self.assertEqual(self.chat.last_message_preview, 'hello')
+
+
+class SearchTestCase(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.user = User(email='user@test.com', password_hash='-', first_name='user')
+        self.friend = User(email='friend@test.com', password_hash='-', first_name='friend')
+        self.stranger = User(email='stranger@test.com', password_hash='-', first_name='stranger')
+        db.session.add_all([self.user, self.friend, self.stranger])
+        self.chat = self.user.start_personal_chat(self.friend)
+        self.other_chat = self.friend.start_personal_chat(self.stranger)
+
+        self.user.send_message(self.chat, 'hello there')
+        self.friend.send_message(self.chat, 'Hello hello')
+        self.user.send_message(self.chat, 'fine, thanks')
+        self.friend.send_message(self.other_chat, 'hello stranger')
+        self.access_token = create_access_token(self.user)
+
+    def search(self, arguments):
+        response = self.client.post(
+            self.endpoint, json={
+                'query':
+                    fr'''
+                    query {{
+                        searchMessages ({arguments}) {{
+                            edges {{ node {{ highlight message {{ message }} }} }}
+                            pageInfo {{ hasNextPage endCursor }}
+                        }}
+                    }}
+                    '''
+            }, headers={'Authorization': 'Bearer ' + self.access_token}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['data']['searchMessages']
+
+    def test_search_is_ranked_and_paginated(self):
+        page = self.search('query: "Hello", first: 1')
+        self.assertEqual(
+            [e['node']['highlight'] for e in page['edges']],
+            ['<mark>Hello</mark> <mark>hello</mark>']
+        )
+        self.assertTrue(page['pageInfo']['hasNextPage'])
+
+        page = self.search(f'query: "hello", first: 5, after: "{page["pageInfo"]["endCursor"]}"')
+        self.assertEqual([e['node']['message']['message'] for e in page['edges']], ['hello there'])
+        self.assertFalse(page['pageInfo']['hasNextPage'])
+
+    def test_search_only_sees_own_conversations(self):
+        self.assertEqual(len(self.search('query: "stranger"')['edges']), 0)
+        self.assertEqual(len(self.search(f'query: "fine", conversationId: {self.other_chat.id}')['edges']), 0)
+        self.assertEqual(len(self.search(f'query: "fine", conversationId: {self.chat.id}')['edges']), 1)
+        self.assertEqual(len(self.search('query: "\\" OR *"')['edges']), 0)
+
+    def test_search_unavailable(self):
+        with mock.patch.dict(search.BACKENDS, clear=True):
+            response = self.client.post(
+                self.endpoint, json={'query': '{ searchMessages (query: "hello") { edges { cursor } } }'},
+                headers={'Authorization': 'Bearer ' + self.access_token}
+            ).get_json()
+        self.assertEqual(response['errors'][0]['message'], 'full-text search is not available')
+
+    def test_invalid_cursor(self):
+        response = self.client.post(
+            self.endpoint, json={
+                'query': 'query ($after: String) { searchMessages (query: "hello", after: $after) '
+                         '{ edges { cursor } } }',
+                'variables': {'after': encode_cursor(['x', 1])}
+            }, headers={'Authorization': 'Bearer ' + self.access_token}
+        ).get_json()
+        self.assertEqual(response['errors'][0]['message'], 'invalid cursor')
+
+
+class IdentityTestCase(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.user = User(email='user@test.com', password_hash='-', first_name='user')
+        self.admin = User(email='admin@test.com', password_hash='-', first_name='admin', is_admin=True)
+        db.session.add_all([self.user, self.admin])
+        db.session.commit()
+        self.user_token = create_access_token(self.user)
+        self.admin_token = create_access_token(self.admin)
+
+    def post(self, query, token):
+        with self.count_statements() as statements:
+            response = self.client.post(
+                self.endpoint, json={'query': query},
+                headers={'Authorization': 'Bearer ' + token}
+            )
+        return response.get_json(), statements
+
+    def test_identity_is_cached(self):
+        db.session.expunge_all()
+        _, statements = self.post('{ me { email } }', self.user_token)
+        self.assertEqual(len(statements), 1)
+        db.session.expunge_all()
+
+        data, statements = self.post('{ me { email } }', self.user_token)
+        self.assertEqual(data['data']['me']['email'], 'user@test.com')
+        self.assertEqual(statements, [])
+
+    def test_update_invalidates_identity(self):
+        self.post('{ me { firstName } }', self.user_token)
+        self.post('mutation { updateUser (firstName: "renamed") { success } }', self.user_token)
+        db.session.expunge_all()
+
+        data, _ = self.post('{ me { firstName } }', self.user_token)
+        self.assertEqual(data['data']['me']['firstName'], 'renamed')
+
+        user = User.query.filter_by(email='user@test.com').first()
+        user.is_active = False
+        db.session.commit()
+        db.session.expunge_all()
+        data, _ = self.post('{ me { firstName } }', self.user_token)
+        self.assertIsNone(data['data']['me'])
+
+    def test_admin_check_uses_claims(self):
+        data, _ = self.post('{ users { edges { node { email } } } }', self.user_token)
+        self.assertEqual(data['errors'][0]['message'], 'insufficient permission')
+
+        self.post('{ me { email } }', self.admin_token)
+        data, statements = self.post('{ users { edges { node { email } } } }', self.admin_token)
+        self.assertEqual(len(data['data']['users']['edges']), 2)
+        self.assertEqual(len(statements), 1)
+
+
+class AdminListingTestCase(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.admin = User(email='admin@test.com', password_hash='-', first_name='admin', is_admin=True)
+        db.session.add(self.admin)
+        for i in range(5):
+            user = User(email=f'user{i}@test.com', password_hash='-', first_name=f'user{i}')
+            db.session.add(user)
+            self.admin.start_personal_chat(user)
+        self.access_token = create_access_token(self.admin)
+
+    def post(self, query):
+        with self.count_statements() as statements:
+            response = self.client.post(
+                self.endpoint, json={'query': query},
+                headers={'Authorization': 'Bearer ' + self.access_token}
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['data'], statements
+
+    def test_users_are_paginated_and_filtered(self):
+        data, statements = self.post(
+            '{ users (email: "user", first: 3) { totalCount edges { node { email } } pageInfo { endCursor } } }'
+        )
+        users = data['users']
+        self.assertEqual(
+            [e['node']['email'] for e in users['edges']],
+            ['user0@test.com', 'user1@test.com', 'user2@test.com']
+        )
+        self.assertIsNone(users['totalCount'])
+        self.assertNotIn('password_hash', statements[-1])
+        self.assertNotIn('first_name', statements[-1])
+
+        data, _ = self.post(
+            f'{{ users (email: "user", after: "{users["pageInfo"]["endCursor"]}") {{ edges {{ node {{ email }} }} }} }}'
+        )
+        self.assertEqual(len(data['users']['edges']), 2)
+
+    def test_conversations_load_relationship_keys(self):
+        data, _ = self.post(
+            '{ conversations (kind: "pc", first: 2) { edges { node { title creator { email } } } } }'
+        )
+        edges = data['conversations']['edges']
+        self.assertEqual(len(edges), 2)
+        self.assertEqual(edges[0]['node']['creator']['email'], 'admin@test.com')
+
+
+class DocumentCacheTestCase(GraphQLTestCase):
+    def test_documents_are_parsed_once(self):
+        backend = self.app.extensions['graphql_backend']
+        for _ in range(3):
+            response = self.client.post(self.endpoint, json={'query': '{hello}'})
+            self.assertEqual(response.get_json()['data']['hello'], 'hello')
+        self.assertEqual(len(backend.documents), 1)
+
+        response = self.client.post(self.endpoint, json={'query': '{nope}'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.endpoint, json={'query': '{nope}'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(backend.documents), 2)
+
+    def test_document_cache_is_bounded(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+
+    def test_persisted_query(self):
+        query = '{hello}'
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': query_hash(query)}}
+
+        response = self.client.post(self.endpoint, json={'extensions': extensions})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['errors'][0]['message'], 'PersistedQueryNotFound')
+
+        response = self.client.post(self.endpoint, json={'query': query, 'extensions': extensions})
+        self.assertEqual(response.get_json()['data']['hello'], 'hello')
+
+        response = self.client.post(self.endpoint, json={'extensions': extensions})
+        self.assertEqual(response.get_json()['data']['hello'], 'hello')
+
+        response = self.client.get(
+            self.endpoint, query_string={'extensions': json.dumps(extensions)}
+        )
+        self.assertEqual(response.get_json()['data']['hello'], 'hello')
+
+    def test_persisted_query_hash_mismatch(self):
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': query_hash('{me {email}}')}}
+        response = self.client.post(self.endpoint, json={'query': '{hello}', 'extensions': extensions})
+        self.assertEqual(response.status_code, 400)
+
+
+class QueryCostTestCase(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+
+        user = User(email='user@test.com', password_hash='-', first_name='user')
+        db.session.add(user)
+        db.session.commit()
+        self.headers = {'Authorization': 'Bearer ' + create_access_token(user)}
+
+    def post(self, query, variables=None):
+        return self.client.post(
+            self.endpoint, json={'query': query, 'variables': variables},
+            headers=self.headers
+        )
+
+    def test_cost_is_reported(self):
+        response = self.post('{ hello me { email } }')
+        self.assertEqual(response.status_code, 200)
+        cost = response.get_json()['extensions']['cost']
+        self.assertEqual(cost['requestedQueryCost'], 1)
+        self.assertEqual(cost['depth'], 2)
+
+        response = self.post(
+            'query ($n: Int) { myChats { messages (first: $n) { edges { node { sender { email } } } } } }',
+            {'n': 10}
+        )
+        cost = response.get_json()['extensions']['cost']
+        # myChats + 20 chats * (messages + 10 edges * (edges + node + sender))
+        self.assertEqual(cost['requestedQueryCost'], 1 + 20 * (1 + 10 * 3))
+        self.assertEqual(cost['depth'], 6)
+
+    def test_depth_limit(self):
+        self.app.extensions['graphql_backend'].limiter.max_cost = 10 ** 9
+        response = self.post(
+            '''
+            fragment chat on Conversation { participants { participates { id } } }
+            { myChats { participants { participates { ...chat } } } }
+            '''
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.app.extensions['graphql_backend'].limiter.max_depth = 5
+        response = self.post(
+            '''
+            fragment chat on Conversation { participants { participates { id } } }
+            { myChats { participants { participates { ...chat } } } }
+            '''
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('depth 6', response.get_json()['errors'][0]['message'])
+
+    def test_cost_limit(self):
+        response = self.post(
+            '{ myChats { participants { participates { participants { participates { id } } } } } }'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('exceeds the maximum cost', response.get_json()['errors'][0]['message'])
+
+
+class RateLimitTestCase(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.user = User(email='user@test.com', password='secret', first_name='user')
+        self.friend = User(email='friend@test.com', password_hash='-', first_name='friend')
+        db.session.add_all([self.user, self.friend])
+        db.session.commit()
+        rate_limiter.limits.update({
+            'Mutation.login': (2, 60),
+            'Mutation.sendMessage': (3, 60),
+        })
+
+    def post(self, query, headers=None, **environ):
+        return self.client.post(
+            self.endpoint, json={'query': query}, headers=headers, environ_base=environ
+        ).get_json()
+
+    def test_login_is_limited_per_address(self):
+        login = 'mutation { login(email: "user@test.com", password: "secret") { accessToken } }'
+        for _ in range(2):
+            self.assertNotIn('errors', self.post(login))
+
+        error = self.post(login)['errors'][0]
+        self.assertEqual(error['extensions']['code'], 'RATE_LIMITED')
+        self.assertGreater(error['extensions']['retryAfter'], 0)
+        self.assertLessEqual(error['extensions']['retryAfter'], 30)
+
+        self.assertNotIn('errors', self.post(login, REMOTE_ADDR='10.0.0.2'))
+
+    def test_send_message_is_limited_per_user(self):
+        send = 'mutation { sendMessage(destination: "friend@test.com", message: "hi") { conversation { id } } }'
+        headers = {'Authorization': 'Bearer ' + create_access_token(self.user)}
+        for _ in range(3):
+            self.assertNotIn('errors', self.post(send, headers))
+        self.assertEqual(
+            self.post(send, headers, REMOTE_ADDR='10.0.0.2')['errors'][0]['extensions']['code'],
+            'RATE_LIMITED'
+        )
+
+        headers = {'Authorization': 'Bearer ' + create_access_token(self.friend)}
+        send = 'mutation { sendMessage(destination: "user@test.com", message: "hi") { conversation { id } } }'
+        self.assertNotIn('errors', self.post(send, headers))
+
+
+class ProxiedRateLimitTestCase(RateLimitTestCase):
+    def setUp(self):
+        with mock.patch.object(TestingConfig, 'FLCHAT_PROXY_HOPS', 1):
+            super().setUp()
+
+    def test_login_is_limited_per_forwarded_address(self):
+        login = 'mutation { login(email: "user@test.com", password: "secret") { accessToken } }'
+        for _ in range(2):
+            self.assertNotIn('errors', self.post(login, {'X-Forwarded-For': '203.0.113.1'}))
+        self.assertIn('errors', self.post(login, {'X-Forwarded-For': '203.0.113.1'}))
+
+        # Another client behind the same proxy has its own bucket.
+        self.assertNotIn('errors', self.post(login, {'X-Forwarded-For': '203.0.113.2'}))
+
+
+class SyncTestCase(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.user = User(email='bot@test.com', password_hash='-', first_name='bot')
+        self.friend = User(email='friend@test.com', password_hash='-', first_name='friend')
+        db.session.add_all([self.user, self.friend])
+        db.session.commit()
+        self.access_token = create_access_token(self.user)
+
+    def sync(self, since=None, limit=None):
+        return self.client.post(
+            self.endpoint, json={
+                'query':
+                    r'''
+                    query ($since: String, $limit: Int) {
+                        sync (since: $since, limit: $limit) {
+                            token hasMore
+                            changes { seq kind conversation { id } message { message } user { email } }
+                        }
+                    }
+                    ''',
+                'variables': {'since': since, 'limit': limit}
+            }, headers={'Authorization': 'Bearer ' + self.access_token}
+        ).get_json()['data']['sync']
+
+    def test_sync(self):
+        token = self.sync()['token']
+        chat = self.user.start_personal_chat(self.friend)
+        self.friend.send_message(chat, 'hello')
+        self.user.add_contact(self.friend)
+
+        page = self.sync(token, limit=2)
+        self.assertTrue(page['hasMore'])
+        self.assertEqual([c['kind'] for c in page['changes']], ['member', 'message'])
+        self.assertEqual(page['changes'][0]['user'], None)
+        self.assertEqual(page['changes'][1], {
+            'seq': 2, 'kind': 'message', 'conversation': {'id': str(chat.id)},
+            'message': {'message': 'hello'}, 'user': {'email': 'friend@test.com'},
+        })
+
+        page = self.sync(page['token'], limit=2)
+        self.assertFalse(page['hasMore'])
+        self.assertEqual(page['changes'], [{
+            'seq': 3, 'kind': 'contact', 'conversation': None,
+            'message': None, 'user': {'email': 'friend@test.com'},
+        }])
+
+        # Nothing new, the token stays valid.
+        self.assertEqual(self.sync(page['token']), {'token': page['token'], 'hasMore': False, 'changes': []})
+        self.assertEqual(self.sync()['token'], page['token'])
+
+    def test_invalid_token(self):
+        for values in (['x'], [1.5], [True], [None], [1, 2]):
+            since = encode_cursor(values)
+            response = self.client.post(
+                self.endpoint, json={
+                    'query': 'query ($since: String) { sync (since: $since) { token } }',
+                    'variables': {'since': since}
+                }, headers={'Authorization': 'Bearer ' + self.access_token}
+            ).get_json()
+            self.assertEqual(response['errors'][0]['message'], 'invalid cursor', values)
+
+    def test_sync_is_per_user(self):
+        chat = self.user.start_personal_chat(self.friend)
+        self.friend.add_contact(self.user)
+        token = self.sync()['token']
+        self.friend.send_message(chat, 'hello')
+        self.assertEqual([c['kind'] for c in self.sync(token)['changes']], ['message'])
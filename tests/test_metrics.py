@@ -0,0 +1,106 @@
+import unittest
+from unittest import mock
+from flask_jwt_extended import create_access_token
+from app import create_app, db, metrics
+from app.models import User
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+@unittest.skipIf(prometheus_client is None, 'prometheus_client is not installed')
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.user = User(email='user@test.com', password_hash='-', first_name='user')
+        self.friend = User(email='friend@test.com', password_hash='-', first_name='friend')
+        db.session.add_all([self.user, self.friend])
+        self.chat = self.user.start_personal_chat(self.friend)
+        self.token = create_access_token(self.user)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def query(self, query, **kwargs):
+        return self.client.post(
+            '/api/graphql', json=dict(query=query, **kwargs),
+            headers={'Authorization': 'Bearer ' + self.token}
+        ).get_json()
+
+    def sample(self, name, **labels):
+        return prometheus_client.REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_operation_and_resolver_metrics(self):
+        count = self.sample('flchat_graphql_operation_seconds_count', operation='MetricsInbox')
+        statements = self.sample('flchat_graphql_operation_sql_statements_total', operation='MetricsInbox')
+        resolver = self.sample('flchat_graphql_resolver_seconds_count', field='Query.myInbox')
+
+        response = self.query(
+            'query MetricsInbox { myInbox { edges { node { id title } } } }'
+        )
+        self.assertNotIn('errors', response)
+
+        self.assertEqual(
+            self.sample('flchat_graphql_operation_seconds_count', operation='MetricsInbox'),
+            count + 1
+        )
+        self.assertGreater(
+            self.sample('flchat_graphql_operation_sql_statements_total', operation='MetricsInbox'),
+            statements
+        )
+        self.assertEqual(
+            self.sample('flchat_graphql_resolver_seconds_count', field='Query.myInbox'),
+            resolver + 1
+        )
+        # Scalar leaves are not measured.
+        self.assertIsNone(prometheus_client.REGISTRY.get_sample_value(
+            'flchat_graphql_resolver_seconds_count', {'field': 'Conversation.title'}
+        ))
+
+    def test_errors_are_counted(self):
+        errors = self.sample('flchat_graphql_operation_errors_total', operation='MetricsFail')
+        response = self.query(
+            'mutation MetricsFail { sendMessages(items: [{destination: "nowhere", message: "hi"}]) '
+            '{ results { clientId } } }'
+        )
+        self.assertIn('errors', response)
+        self.assertEqual(
+            self.sample('flchat_graphql_operation_errors_total', operation='MetricsFail'),
+            errors + 1
+        )
+
+    def test_metrics_endpoint(self):
+        self.query('{ me { email } }')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'flchat_graphql_operation_seconds_bucket', response.data)
+        self.assertIn(b'operation="anonymous"', response.data)
+        self.assertTrue(metrics.enabled)
+
+    def test_operation_names_are_bounded(self):
+        unknown = self.sample('flchat_graphql_operation_seconds_count', operation='unknown')
+        self.query('query Defined { hello }', operationName='junk0')
+        self.assertIsNone(prometheus_client.REGISTRY.get_sample_value(
+            'flchat_graphql_operation_seconds_count', {'operation': 'junk0'}
+        ))
+        self.assertEqual(self.sample('flchat_graphql_operation_seconds_count', operation='unknown'), unknown + 1)
+
+        other = self.sample('flchat_graphql_operation_seconds_count', operation='other')
+        with mock.patch.object(metrics, 'operations', {'Kept'}), \
+                mock.patch.object(metrics, 'max_operations', 1):
+            self.query('query Kept { hello }')
+            self.query('query Dropped { hello }')
+        self.assertEqual(self.sample('flchat_graphql_operation_seconds_count', operation='Kept'), 1)
+        self.assertEqual(self.sample('flchat_graphql_operation_seconds_count', operation='other'), other + 1)
+        self.assertIsNone(prometheus_client.REGISTRY.get_sample_value(
+            'flchat_graphql_operation_seconds_count', {'operation': 'Dropped'}
+        ))
@@ -1,6 +1,13 @@
+import threading
 import unittest
-from app import create_app, db
-from app.models import User, Message, Conversation, Contact
+from concurrent.futures import TimeoutError
+from datetime import datetime, timedelta
+from unittest import mock
+from app import create_app, db, group_committer
+from app.groupcommit import _Pending
+from sqlalchemy.exc import IntegrityError
+from app.models import User, Message, Conversation, Contact, PersonalChat, Change, \
+    ChangeCounter, stage_messages, expire_client_message_ids
 
 
 class UserTestCase(unittest.TestCase):
@@ -68,6 +75,7 @@ class ConversationTestCase(unittest.TestCase):
 
         self.assertEqual(c.creator, self.test_user)
         self.assertTrue(c.title.startswith('pc'))
+        self.assertEqual(c.kind, Conversation.PERSONAL)
         self.assertIn(u, c.participants.all())
         self.assertIn(self.test_user, c.participants.all())
         self.assertTrue(len(c.participants.all()) == 2)
@@ -77,6 +85,50 @@ class ConversationTestCase(unittest.TestCase):
         self.assertIn(c, u.participates)
         self.assertNotIn(c, u.conversations)
 
+    def test_personal_chat_is_reused(self):
+        u = User(
+            email="target@test.com",
+            first_name='target',
+            password='test123'
+        )
+        db.session.add(u)
+        db.session.commit()
+
+        c = self.test_user.start_personal_chat(u)
+        self.assertEqual(u.start_personal_chat(self.test_user), c)
+        self.assertEqual(self.test_user.start_personal_chat(u), c)
+        self.assertEqual(Conversation.query.count(), 1)
+
+        low, high = PersonalChat.pair(u, self.test_user)
+        self.assertLess(low, high)
+        self.assertEqual(PersonalChat.query.get((low, high)).conversation, c)
+
+        db.session.add(PersonalChat(
+            user_low_id=low, user_high_id=high,
+            conversation=self.test_user.create_chat()
+        ))
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+
+    def test_delete_personal_chat_member(self):
+        sqlite = db.engine.dialect.name == 'sqlite'
+        if sqlite:
+            # SQLite only enforces foreign keys when asked to, Postgres always does.
+            db.session.execute('PRAGMA foreign_keys=ON')
+        try:
+            u = User(email='target@test.com', first_name='target', password='test123')
+            db.session.add(u)
+            db.session.commit()
+            self.test_user.send_message(self.test_user.start_personal_chat(u), 'hello')
+
+            db.session.delete(u)
+            db.session.commit()
+            self.assertEqual(PersonalChat.query.count(), 0)
+        finally:
+            db.session.rollback()
+            if sqlite:
+                db.session.execute('PRAGMA foreign_keys=OFF')
+
     def test_multiperson_chat(self):
         u1 = User(
             email="target1@test.com",
@@ -97,6 +149,7 @@ class ConversationTestCase(unittest.TestCase):
 
         self.assertEqual(c.creator, self.test_user)
         self.assertTrue(c.title.startswith('mpc'))
+        self.assertEqual(c.kind, Conversation.MULTIPERSON)
         self.assertIn('test_group', c.title)
 
         c.add_user_to_mpc(u1)
@@ -112,6 +165,19 @@ class ConversationTestCase(unittest.TestCase):
         self.assertNotIn(c, u1.conversations)
         self.assertNotIn(c, u2.conversations)
 
+    def test_add_users_to_mpc(self):
+        users = [
+            User(email=f'member{i}@test.com', first_name=f'member{i}', password_hash='-')
+            for i in range(3)
+        ]
+        c = self.test_user.start_multiperson_chat(name='group', targets=users[:1])
+        self.assertEqual(c.participants.count(), 2)
+
+        added = c.add_users_to_mpc(users + users[:2] + [self.test_user])
+        self.assertEqual(added, [users[1].id, users[2].id])
+        self.assertEqual(c.participants.count(), 4)
+        self.assertEqual(c.add_users_to_mpc(users), [])
+
 
 class MessageContactTestCase(unittest.TestCase):
     def setUp(self):
@@ -174,6 +240,150 @@ class MessageContactTestCase(unittest.TestCase):
             m = participant.participates.filter(Conversation.title.startswith('mpc')).first().messages.filter_by(message='Test123').first()
             self.assertTrue(m)
 
+    def test_send_message_updates_summary(self):
+        self.test_user1.send_message(self.test_pc, 'first')
+        last = self.test_user2.send_message(self.test_pc, 'x' * 500)
+
+        self.assertEqual(self.test_pc.last_message, last)
+        self.assertEqual(self.test_pc.updated_at, last.sent_at)
+        self.assertEqual(self.test_pc.last_message_preview, 'x' * Conversation.PREVIEW_LENGTH)
+
+    def test_unread_counts(self):
+        self.test_mpc.add_user_to_mpc(self.test_user2)
+        self.test_mpc.add_user_to_mpc(self.test_user2)
+        self.assertEqual(self.test_mpc.participants.count(), 2)
+
+        first = self.test_user1.send_message(self.test_mpc, 'one')
+        self.test_user1.send_message(self.test_mpc, 'two')
+        reader = self.test_mpc.participant(self.test_user2)
+        self.assertEqual(reader.unread_count, 2)
+        self.assertEqual(self.test_mpc.participant(self.test_user1).unread_count, 0)
+
+        reader.mark_read(first.id)
+        self.assertEqual(reader.unread_count, 1)
+        self.test_user2.send_message(self.test_mpc, 'three')
+        self.assertEqual(self.test_mpc.participant(self.test_user2).unread_count, 0)
+        self.assertEqual(self.test_mpc.participant(self.test_user1).unread_count, 1)
+
+    def test_group_commit(self):
+        self.test_mpc.add_users_to_mpc([self.test_user2, self.test_user3])
+        group_committer.enabled = True
+        try:
+            first = group_committer.send_message(self.test_user1, self.test_mpc, 'one')
+            second = group_committer.send_message(self.test_user2, self.test_mpc, 'two')
+        finally:
+            group_committer.enabled = False
+
+        db.session.expire_all()
+        self.assertEqual(first.message, 'one')
+        self.assertEqual(self.test_mpc.last_message, second)
+        self.assertEqual(self.test_mpc.participant(self.test_user1).unread_count, 1)
+        self.assertEqual(self.test_mpc.participant(self.test_user2).unread_count, 0)
+        self.assertEqual(self.test_mpc.participant(self.test_user3).unread_count, 2)
+
+    def test_group_commit_survives_failures(self):
+        group_committer.enabled = True
+        try:
+            with mock.patch.object(group_committer, 'flush', side_effect=RuntimeError('connection lost')):
+                with self.assertRaises(RuntimeError):
+                    group_committer.send_message(self.test_user1, self.test_mpc, 'lost')
+
+            # A committer that died is started again.
+            dead = threading.Thread(target=lambda: None)
+            dead.start()
+            dead.join()
+            group_committer.thread = dead
+            message = group_committer.send_message(self.test_user1, self.test_mpc, 'kept')
+        finally:
+            group_committer.enabled = False
+        self.assertEqual(message.message, 'kept')
+        self.assertTrue(group_committer.thread.is_alive())
+
+    def test_group_commit_skips_abandoned_messages(self):
+        pending = _Pending(self.test_user1.id, self.test_mpc.id, 'late', None)
+        group_committer.timeout = 0.01
+        with self.assertRaises(TimeoutError):
+            group_committer.wait(pending)
+        self.assertTrue(pending.future.cancelled())
+
+        group_committer.flush([pending])
+        self.assertEqual(self.test_mpc.messages.count(), 0)
+
+    def test_staged_messages_of_several_senders(self):
+        self.test_mpc.add_users_to_mpc([self.test_user2, self.test_user3])
+        messages = stage_messages([
+            (self.test_user1, self.test_mpc, 'one'),
+            (self.test_user2, self.test_mpc, 'two'),
+            (self.test_user1, self.test_mpc, 'three'),
+            (self.test_user3, self.test_pc, 'four'),
+        ])
+        db.session.commit()
+
+        reader = self.test_mpc.participant(self.test_user2)
+        self.assertEqual((reader.last_read_message_id, reader.unread_count), (messages[1].id, 1))
+        self.assertEqual(self.test_mpc.participant(self.test_user1).unread_count, 0)
+        self.assertEqual(self.test_mpc.participant(self.test_user3).unread_count, 3)
+        self.assertEqual(self.test_pc.last_message, messages[3])
+
+    def test_expire_client_message_ids(self):
+        old = [self.test_user1.send_message(self.test_pc, f'old {i}', f'old-{i}') for i in range(5)]
+        recent = self.test_user1.send_message(self.test_pc, 'recent', 'recent')
+        for message in old:
+            message.sent_at = datetime.utcnow() - timedelta(days=2)
+        db.session.commit()
+
+        self.assertEqual(expire_client_message_ids(86400, batch_size=2), 5)
+        self.assertEqual(
+            [m.client_message_id for m in self.test_pc.messages.order_by(Message.id)],
+            [None] * 5 + ['recent']
+        )
+        self.assertEqual(self.test_user1.send_message(self.test_pc, 'again', 'old-0').message, 'again')
+        self.assertEqual(self.test_user1.send_message(self.test_pc, 'again', 'recent'), recent)
+
+    def test_change_log(self):
+        self.test_mpc.add_user_to_mpc(self.test_user3)
+        message = self.test_user3.send_message(self.test_mpc, 'hello')
+        self.test_user1.add_contact(self.test_user2)
+
+        def log(user):
+            return [
+                (c.seq, c.kind, c.conversation_id, c.message_id, c.subject_id)
+                for c in Change.query.filter_by(user_id=user.id).order_by(Change.seq)
+            ]
+
+        pc, mpc = self.test_pc.id, self.test_mpc.id
+        user2, user3 = self.test_user2.id, self.test_user3.id
+        self.assertEqual(log(self.test_user1), [
+            (1, Change.MEMBER, pc, None, None),
+            (2, Change.MEMBER, mpc, None, None),
+            (3, Change.MEMBER, mpc, None, None),
+            (4, Change.MESSAGE, mpc, message.id, user3),
+            (5, Change.CONTACT, None, None, user2),
+        ])
+        self.assertEqual(log(self.test_user3), [
+            (1, Change.MEMBER, mpc, None, None),
+            (2, Change.MESSAGE, mpc, message.id, user3),
+        ])
+        self.assertEqual(ChangeCounter.query.get(self.test_user1.id).seq, 5)
+
+    def test_group_creation_logs_one_change_per_member(self):
+        users = [User(email=f'member{i}@test.com', password_hash='-', first_name=f'member{i}') for i in range(20)]
+        group = self.test_user1.start_multiperson_chat(name='big', targets=users)
+
+        self.assertEqual(group.participants.count(), 21)
+        # The creator's own join is logged before the members are added.
+        self.assertEqual(Change.query.filter_by(conversation_id=group.id).count(), 22)
+
+    def test_kind_does_not_depend_on_title(self):
+        self.test_mpc.title = 'pc-looking group'
+        db.session.commit()
+
+        self.assertEqual(self.test_user1.start_personal_chat(self.test_user2), self.test_pc)
+        self.assertEqual(
+            self.test_user1.participates.filter_by(kind=Conversation.MULTIPERSON).all(),
+            [self.test_mpc]
+        )
+
     def test_add_contact(self):
         self.test_user1.add_contact(self.test_user2)
         self.test_user1.add_contact(self.test_user3)
@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+from flask import Flask
+from app.ratelimit import MemoryStore, RateLimiter, SQLiteStore, refill
+
+
+class RateLimitStoreTestCase(unittest.TestCase):
+    def test_refill(self):
+        # A new bucket starts full.
+        self.assertEqual(refill(None, 0, 100, 1, 3)[0], 2)
+        tokens, full_at, retry_after = refill(0.5, 100, 100, 0.5, 3)
+        self.assertEqual(retry_after, 1)
+        self.assertEqual(full_at, 105)
+        self.assertEqual(refill(0.5, 100, 101, 0.5, 3)[2], 0)
+
+    def check_store(self, first, second):
+        # A burst of 2, then one token every 10 seconds.
+        self.assertEqual(first.take('k', 0.1, 2, 1000), 0)
+        self.assertEqual(second.take('k', 0.1, 2, 1000), 0)
+        self.assertAlmostEqual(first.take('k', 0.1, 2, 1001), 9)
+        self.assertEqual(second.take('k', 0.1, 2, 1010), 0)
+        self.assertEqual(second.take('other', 0.1, 2, 1010), 0)
+
+    def test_memory_store(self):
+        store = MemoryStore()
+        self.check_store(store, store)
+
+    def test_sqlite_store_is_shared(self):
+        path = os.path.join(tempfile.mkdtemp(), 'ratelimit.sqlite3')
+        self.check_store(SQLiteStore(path), SQLiteStore(path))
+
+    def test_limits_can_be_turned_off(self):
+        app = Flask(__name__)
+        app.config.update(
+            FLCHAT_RATE_LIMITS={'Mutation.login': (1, 60)},
+            FLCHAT_RATE_LIMITS_ENABLED=True,
+            FLCHAT_RATE_LIMIT_STORE='memory',
+        )
+        limiter = RateLimiter(app)
+        self.assertGreater(max(limiter.hit('Mutation.login', 'ip:a') for _ in range(2)), 0)
+
+        app.config['FLCHAT_RATE_LIMITS_ENABLED'] = False
+        limiter = RateLimiter(app)
+        self.assertEqual(max(limiter.hit('Mutation.login', 'ip:a') for _ in range(2)), 0)
@@ -0,0 +1,62 @@
+import unittest
+from app import create_app, db
+from app.models import Contact, Conversation, Message, Participant, PersonalChat, User
+from app.seed import SeedSpec, seed
+
+
+class SeedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def seed(self, **kwargs):
+        spec = SeedSpec(**dict(dict(
+            users=30, contacts=5, personal_chats=0.5, groups=4, group_size=(3, 6),
+            messages=10, max_messages=100, skew=1.5, days=30, password='secret',
+        ), **kwargs))
+        with db.engine.begin() as connection:
+            return seed(connection, spec, random_seed=1, batch_size=50)
+
+    def test_seed(self):
+        existing = User(email='existing@test.com', password_hash='-', first_name='existing')
+        db.session.add(existing)
+        db.session.commit()
+
+        counts = self.seed()
+        self.assertEqual(counts['user'], 30)
+        self.assertEqual(User.query.count(), 31)
+        self.assertEqual(Contact.query.count(), counts['contact'])
+        self.assertEqual(Message.query.count(), counts['message'])
+        self.assertEqual(
+            Conversation.query.filter_by(kind=Conversation.PERSONAL).count(),
+            PersonalChat.query.count()
+        )
+        self.assertEqual(Conversation.query.filter_by(kind=Conversation.MULTIPERSON).count(), 4)
+
+        user = User.query.filter(User.id != existing.id).first()
+        self.assertTrue(user.verify_password('secret'))
+
+        for conversation in Conversation.query.filter(Conversation.last_message_id.isnot(None)):
+            last = conversation.messages.order_by(Message.id.desc()).first()
+            self.assertEqual(conversation.last_message_id, last.id)
+            self.assertEqual(conversation.updated_at, last.sent_at)
+            self.assertEqual(conversation.last_message_preview, last.message[:100])
+
+        # Unread counts agree with a recount from the read cursor.
+        for participant in Participant.query:
+            recount = Participant(conversation_id=participant.conversation_id, user_id=participant.user_id)
+            recount.mark_read(participant.last_read_message_id or 0)
+            self.assertEqual(participant.unread_count, recount.unread_count)
+
+    def test_seed_appends(self):
+        first = self.seed()
+        second = self.seed()
+        self.assertEqual(User.query.count(), 60)
+        self.assertEqual(Message.query.count(), first['message'] + second['message'])
@@ -0,0 +1,143 @@
+import json
+import unittest
+from unittest import mock
+from flask_jwt_extended import create_access_token
+from app import create_app, db, pubsub
+from app.pubsub import MESSAGES_CHANNEL
+from app.graphql.schema import schema
+from app.graphql.subscriptions import SubscriptionConnection
+from app.models import User
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(json.loads(data))
+
+    def pop(self):
+        sent, self.sent = self.sent, []
+        return sent
+
+
+class SubscriptionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+        self.user1 = User(email='user1@test.com', password='test123', first_name='user1')
+        self.user2 = User(email='user2@test.com', password='test123', first_name='user2')
+        self.user3 = User(email='user3@test.com', password='test123', first_name='user3')
+        db.session.add_all([self.user1, self.user2, self.user3])
+        db.session.commit()
+        self.conversation = self.user1.start_personal_chat(self.user2)
+        self.conversation_id = self.conversation.id
+
+        self.ws = FakeWebSocket()
+        self.connection = SubscriptionConnection(self.ws, schema)
+
+    def tearDown(self):
+        self.connection.unsubscribe_all()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def handle(self, **message):
+        return self.connection.handle_message(json.dumps(message))
+
+    def process_pending(self):
+        while not self.connection.events.empty():
+            self.connection.process(self.connection.events.get())
+
+    def connect(self, user):
+        self.handle(type='connection_init', payload={
+            'authToken': create_access_token(user)
+        })
+        self.assertEqual(self.ws.pop(), [{'type': 'connection_ack'}])
+
+    def test_invalid_token(self):
+        self.assertFalse(self.handle(type='connection_init', payload={'authToken': 'x'}))
+        self.assertEqual(self.ws.pop()[0]['type'], 'connection_error')
+
+    def test_message_added(self):
+        self.connect(self.user2)
+        self.handle(type='start', id='1', payload={
+            'query': 'subscription ($id: Int!) { messageAdded (conversationId: $id) { message sender { email } } }',
+            'variables': {'id': self.conversation_id},
+        })
+        self.assertEqual(self.ws.pop(), [])
+
+        self.user1.send_message(self.conversation, 'hello')
+        self.process_pending()
+
+        self.assertEqual(self.ws.pop(), [{
+            'type': 'data', 'id': '1',
+            'payload': {'data': {'messageAdded': {
+                'message': 'hello', 'sender': {'email': 'user1@test.com'}
+            }}}
+        }])
+
+        self.handle(type='stop', id='1')
+        self.user1.send_message(self.conversation, 'are you there?')
+        self.process_pending()
+        self.assertEqual(self.ws.pop(), [])
+
+    def test_message_added_requires_participation(self):
+        self.connect(self.user3)
+        self.handle(type='start', id='1', payload={
+            'query': 'subscription ($id: Int!) { messageAdded (conversationId: $id) { message } }',
+            'variables': {'id': self.conversation_id},
+        })
+        sent = self.ws.pop()
+        self.assertEqual(sent[0]['type'], 'data')
+        self.assertEqual(sent[0]['payload']['errors'][0]['message'], 'conversation does not exist')
+
+    def test_inbox_updated(self):
+        self.connect(self.user2)
+        self.handle(type='start', id='inbox', payload={
+            'query': 'subscription { inboxUpdated { id title } }',
+        })
+
+        self.user1.send_message(self.conversation, 'hello')
+        self.process_pending()
+
+        sent = self.ws.pop()
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(sent[0]['payload']['data']['inboxUpdated']['id'], str(self.conversation_id))
+
+    def test_sockets_are_capped(self):
+        from app.graphql.views import graphql_ws
+        sockets = self.app.extensions['graphql_sockets']
+        for _ in range(self.app.config['FLCHAT_MAX_SUBSCRIPTION_SOCKETS']):
+            self.assertTrue(sockets.acquire(blocking=False))
+
+        ws = mock.Mock()
+        graphql_ws.__wrapped__(ws)
+        ws.close.assert_called_once_with(reason=1013, message='too many subscriptions')
+        ws.receive.assert_not_called()
+
+        sockets.release()
+        ws = mock.Mock()
+        ws.receive.side_effect = Exception('closed')
+        graphql_ws.__wrapped__(ws)
+        ws.close.assert_not_called()
+        self.assertTrue(sockets.acquire(blocking=False))
+
+    def test_message_batch_is_published_once(self):
+        other = self.user1.start_personal_chat(self.user3)
+        self.connect(self.user2)
+        self.handle(type='start', id='inbox', payload={
+            'query': 'subscription { inboxUpdated { id } }',
+        })
+
+        with mock.patch.object(pubsub.broker, 'publish', wraps=pubsub.broker.publish) as publish:
+            self.user1.send_messages([(self.conversation, 'hello'), (other, 'hi'), (self.conversation, 'bye')])
+        channels = [call[0][0] for call in publish.call_args_list]
+        self.assertEqual(channels.count(MESSAGES_CHANNEL), 1)
+
+        self.process_pending()
+        sent = self.ws.pop()
+        self.assertEqual([s['payload']['data']['inboxUpdated']['id'] for s in sent], [str(self.conversation_id)])
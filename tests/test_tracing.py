@@ -0,0 +1,80 @@
+import json
+import os
+import tempfile
+import unittest
+from flask_jwt_extended import create_access_token
+from app import create_app, db
+from app.models import User
+from app.tracing import redact
+
+USERS_QUERY = 'query AdminUsers { users { edges { node { email participates { id } } } } }'
+
+
+class TracingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['FLCHAT_TRACE_MODE'] = 'debug'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = self.app.test_client()
+
+        self.admin = User(email='admin@test.com', password_hash='-', first_name='admin', is_admin=True)
+        db.session.add(self.admin)
+        for i in range(4):
+            user = User(email=f'user{i}@test.com', password_hash='-', first_name=f'user{i}')
+            db.session.add(user)
+            self.admin.start_personal_chat(user)
+        self.access_token = create_access_token(self.admin)
+        db.session.expunge_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def post(self, query):
+        response = self.client.post(
+            '/api/graphql', json={'query': query},
+            headers={'Authorization': 'Bearer ' + self.access_token}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+    def test_trace_extension_flags_n_plus_one(self):
+        trace = self.post(USERS_QUERY)['extensions']['trace']
+        self.assertEqual(trace['operation'], 'AdminUsers')
+
+        fields = [span['field'] for span in trace['resolvers']]
+        self.assertIn('Query.users', fields)
+        self.assertNotIn('User.email', fields)
+
+        lazy_loads = [s for s in trace['resolvers'] if s['field'] == 'User.participates']
+        self.assertEqual(len(lazy_loads), 5)
+        statement = lazy_loads[0]['sql'][0]
+        self.assertEqual(statement['parameters'], ['int'])
+        self.assertIsNotNone(statement['durationMs'])
+
+        self.assertEqual(len(trace['nPlusOne']), 1)
+        self.assertEqual(trace['nPlusOne'][0]['count'], 5)
+        self.assertEqual(trace['nPlusOne'][0]['resolvers'], ['User.participates'])
+
+    def test_no_trace_when_off(self):
+        self.app.config['FLCHAT_TRACE_MODE'] = 'off'
+        self.assertNotIn('trace', self.post(USERS_QUERY)['extensions'])
+
+    def test_slow_log(self):
+        path = os.path.join(tempfile.mkdtemp(), 'slow.log')
+        self.app.config.update(FLCHAT_SLOW_LOG=path, FLCHAT_SLOW_REQUEST_MS=0)
+        self.post(USERS_QUERY)
+        self.app.config['FLCHAT_TRACE_MODE'] = 'off'
+        self.post('query Me { me { email } }')
+
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['operation'] for line in lines], ['AdminUsers', 'Me'])
+        self.assertIn('nPlusOne', lines[0])
+        self.assertNotIn('resolvers', lines[1])
+
+    def test_redact(self):
+        self.assertEqual(redact({'email': 'a@b.c', 'ids': (1, 2)}), {'email': 'str', 'ids': ['int', 'int']})